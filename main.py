@@ -1,23 +1,63 @@
 import tkinter as tk
-from tkinter import ttk, messagebox
+from tkinter import ttk, messagebox, filedialog
 import sqlite3
-from docxtpl import DocxTemplate
+from docxtpl import DocxTemplate, InlineImage
+from docx.shared import Mm
+from docx.opc.constants import CONTENT_TYPE as CT
+from docx.opc.spec import default_content_types
+from jinja2 import Environment, nodes
+from xml.sax.saxutils import quoteattr
 import datetime
 import os
+import sys
 import json
-from collections import deque
+import argparse
+import contextlib
+import calendar
+import csv
+from collections import deque, OrderedDict
 import re
-from typing import List, Dict, Any
+import threading
+import queue
+import hashlib
+import tempfile
+import shutil
+import random
+import multiprocessing
+import zipfile
+import zlib
+import struct
+import io
+import time
+import atexit
+import cProfile
+import pstats
+import functools
+import gc
+import itertools
+import operator
+import tracemalloc
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Dict, Any, Callable, Optional, Iterable, Iterator
 import customtkinter as ctk
 from PIL import Image, ImageTk
+try:
+    import qrcode  # Optional, for payment QR codes on invoices
+except ImportError:
+    qrcode = None
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
 
-# Queue for invoice history
-invoice_history = deque(maxlen=10)
+# Queue for invoice history: summaries of the most recent invoices, newest first
+RECENT_INVOICES_SIZE = 10
+invoice_history = deque(maxlen=RECENT_INVOICES_SIZE)
 
 # Settings file path
 SETTINGS_FILE = "invoice_settings.json"
 
+# Database file path and how long connections wait on a locked database
+DATABASE_FILE = "admin_accounts.db"
+DATABASE_BUSY_TIMEOUT_MS = 5000
+
 def load_settings() -> Dict[str, Any]:
     """Load application settings from JSON file"""
     try:
@@ -32,16 +72,54 @@ def load_settings() -> Dict[str, Any]:
         "default_tax_rate": 0.0,
         "company_name": "Your Company",
         "company_address": "123 Business St",
-        "company_phone": "123-456-7890"
+        "company_phone": "123-456-7890",
+        "docx_compression_level": 6,
+        "compiled_renderer": True,
+        "large_invoice_group_lines": False,
+        "large_invoice_page_size": 0,
+        "recent_invoices_size": 10,
+        "recurring_offpeak_windows": ["22:00-06:00"],
+        "recurring_batch_size": 50,
+        "recurring_max_workers": 1,
+        "recurring_poll_seconds": 300,
+        "memory_budget_mb": 0,
+        "profile_dir": "profiles",
+        "profile_keep": 50,
+        "maintenance_idle_seconds": 300,
+        "maintenance_interval_minutes": 60,
+        "maintenance_vacuum_pages": 1000,
+        "logo_path": "",
+        "logo_width_mm": 40,
+        "payment_qr_template": "",
+        "payment_qr_width_mm": 25,
+        "payment_terms_days": 30,
+        "default_invoice_status": "Paid"
     }
 
 def save_settings(settings: Dict[str, Any]) -> None:
     """Save application settings to JSON file"""
+    global _settings_cache
     try:
         with open(SETTINGS_FILE, 'w') as f:
             json.dump(settings, f, indent=4)
     except Exception as e:
         print(f"Error saving settings: {e}")
+    _settings_cache = (None, None)
+
+_settings_cache = (None, None)
+
+def current_settings() -> Dict[str, Any]:
+    """Shared load_settings() result, re-read only when the file changes; do not modify it"""
+    global _settings_cache
+    try:
+        mtime = os.stat(SETTINGS_FILE).st_mtime_ns
+    except OSError:
+        mtime = None
+    cached_mtime, settings = _settings_cache
+    if settings is None or cached_mtime != mtime:
+        settings = load_settings()
+        _settings_cache = (mtime, settings)
+    return settings
 
 def binary_search_invoices(invoices: List[Dict], target_name: str) -> List[Dict]:
     """Binary search implementation for finding invoices by customer name"""
@@ -74,143 +152,3658 @@ def binary_search_invoices(invoices: List[Dict], target_name: str) -> List[Dict]
     
     return results
 
-def validate_phone(phone: str) -> bool:
-    """Simple phone number validation"""
-    # For now, accept any non-empty input
-    return bool(phone.strip())
+# Typed phone numbers may use common separators; normalize_phone() of what is
+# typed must match PHONE_PATTERN
+PHONE_CHARACTERS = re.compile(r"\+?[\d \-.()/]+")
+PHONE_PATTERN = re.compile(r"\+?\d{7,15}")
+EMAIL_PATTERN = re.compile(r"[^@\s]+@[^@\s.]+(?:\.[^@\s.]+)+")
+
+def validate_phone(phone: str) -> bool:
+    """Check a phone number: 7 to 15 digits, optional leading +, common separators"""
+    phone = phone.strip()
+    return (PHONE_CHARACTERS.fullmatch(phone) is not None
+            and PHONE_PATTERN.fullmatch(normalize_phone(phone)) is not None)
+
+def validate_email(email: str) -> bool:
+    """Check the basic shape of an email address: local@domain.tld"""
+    return EMAIL_PATTERN.fullmatch(email.strip()) is not None
+
+def apply_azure_theme(window):
+    # Configure customtkinter appearance
+    ctk.set_appearance_mode("dark")  # Set to dark mode for modern look
+    ctk.set_default_color_theme("blue")  # Use blue theme
+    
+    # Configure ttk style for treeview
+    style = ttk.Style(window)
+    style.configure("Treeview",
+                   background="#2b2b2b",
+                   foreground="white",
+                   rowheight=30,
+                   fieldbackground="#2b2b2b",
+                   borderwidth=0)
+    style.configure("Treeview.Heading",
+                   background="#1e1e1e",
+                   foreground="white",
+                   font=('Aptos Black', 10, 'bold'),
+                   borderwidth=0)
+    style.map('Treeview', 
+              background=[('selected', '#0078D7')],
+              foreground=[('selected', 'white')])
+    
+    # Configure alternating row colors
+    style.map('Treeview',
+              background=[('selected', '#0078D7'),
+                         ('alternate', '#2b2b2b')],
+              foreground=[('selected', 'white'),
+                         ('!selected', 'white')])
+    
+    # Configure custom styles for better visual hierarchy
+    style.configure("Custom.TFrame",
+                   background="#1e1e1e")
+    style.configure("Custom.TLabel",
+                   background="#1e1e1e",
+                   foreground="white",
+                   font=('Aptos', 10))
+    style.configure("Custom.TButton",
+                   background="#0078D7",
+                   foreground="white",
+                   font=('Aptos', 10, 'bold'))
+
+# --- Profiling ---
+PROFILE_DIR = "profiles"
+PROFILE_KEEP = 50
+
+def collapse_profile_stacks(stats: pstats.Stats, max_depth: int = 64) -> Dict[str, int]:
+    """Fold cProfile call edges into "root;...;leaf" stacks weighted in microseconds.
+
+    cProfile keeps caller/callee totals rather than full stacks, so each
+    function's time is split over its callers in proportion to the time
+    they spent calling it, the usual approximation for flame graphs.
+    """
+    callees = {}
+    for func, (_, _, _, _, callers) in stats.stats.items():
+        for caller, (_, _, _, edge_time) in callers.items():
+            callees.setdefault(caller, []).append((func, edge_time))
+    roots = [func for func, entry in stats.stats.items() if not entry[4]]
+    folded = {}
+
+    def label(func):
+        filename, line, name = func
+        if filename == "~":
+            return name.replace(";", ",")
+        return f"{name} ({os.path.basename(filename)}:{line})".replace(";", ",")
+
+    def walk(func, path, share, on_path):
+        _, _, self_time, total_time, _ = stats.stats[func]
+        fraction = share / total_time if total_time else 0.0
+        stack = path + [label(func)]
+        micros = int(self_time * fraction * 1e6)
+        if micros:
+            key = ";".join(stack)
+            folded[key] = folded.get(key, 0) + micros
+        if len(stack) >= max_depth:
+            return
+        for callee, edge_time in callees.get(func, ()):
+            child_share = edge_time * fraction
+            if callee not in on_path and child_share >= 1e-6:
+                walk(callee, stack, child_share, on_path | {callee})
+
+    for root in roots:
+        walk(root, [], stats.stats[root][3], {root})
+    return folded
+
+class Profiler:
+    """Switchable cProfile hooks for GUI actions and batch entry points.
+
+    Each wrapped call that runs while profiling is enabled writes a .pstats
+    file and a .folded collapsed-stack file (for flamegraph.pl or
+    speedscope) to the profiles directory, keeping the newest `keep` pairs.
+    Calls nested in a profiled call, and calls on other threads while one
+    is being profiled, run unprofiled.
+    """
+
+    def __init__(self, directory: str = PROFILE_DIR, keep: int = PROFILE_KEEP):
+        self.directory = directory
+        self.keep = keep
+        self.enabled = False
+        self._local = threading.local()
+
+    def wrap(self, name: str, func: Callable) -> Callable:
+        """Return func, profiled whenever profiling is enabled"""
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not self.enabled or getattr(self._local, "active", False):
+                return func(*args, **kwargs)
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                return func(*args, **kwargs)  # Another profiler is active
+            self._local.active = True
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profile.disable()
+                self._local.active = False
+                self._save(name, profile)
+        return wrapper
+
+    def _save(self, name: str, profile: cProfile.Profile) -> None:
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+            base = os.path.join(self.directory, f"{stamp}_{name}_{os.getpid()}")
+            stats = pstats.Stats(profile)
+            stats.dump_stats(base + ".pstats")
+            with open(base + ".folded", "w", encoding="utf-8") as f:
+                for stack, micros in collapse_profile_stacks(stats).items():
+                    f.write(f"{stack} {micros}\n")
+            self._rotate()
+        except (OSError, TypeError) as e:
+            print(f"Error saving profile for {name}: {e}")
+
+    def _rotate(self) -> None:
+        profiles = sorted(entry.path for entry in os.scandir(self.directory)
+                          if entry.name.endswith(".pstats"))
+        for path in profiles[:max(len(profiles) - self.keep, 0)]:
+            for extension in (".pstats", ".folded"):
+                try:
+                    os.remove(path[:-len(".pstats")] + extension)
+                except FileNotFoundError:
+                    pass
+
+_profiler = None
+
+def get_profiler() -> Profiler:
+    """Return the shared profiler"""
+    global _profiler
+    if _profiler is None:
+        settings = load_settings()
+        _profiler = Profiler(settings.get("profile_dir", PROFILE_DIR),
+                             int(settings.get("profile_keep", PROFILE_KEEP)))
+    return _profiler
+
+def profiled(name: str) -> Callable[[Callable], Callable]:
+    """Decorator hooking a function into the shared profiler"""
+    return lambda func: get_profiler().wrap(name, func)
+
+# --- Customers ---
+# Invoices keep the customer details as billed; customer_id links them to one
+# deduplicated customer so per-customer history is an indexed range scan
+# Everything but digits and a leading +
+PHONE_NOISE = re.compile(r"(?!^\+)\D")
+
+def normalize_customer_name(name: Optional[str]) -> str:
+    return " ".join((name or "").split()).casefold()
+
+def normalize_email(email: Optional[str]) -> str:
+    return (email or "").strip().casefold()
+
+def normalize_phone(phone: Optional[str]) -> str:
+    return PHONE_NOISE.sub("", (phone or "").strip())
+
+def customer_keys(name: Optional[str], email: Optional[str], phone: Optional[str]) -> tuple:
+    """Return the (name, email, phone) keys a customer is deduplicated on"""
+    return normalize_customer_name(name), normalize_email(email), normalize_phone(phone)
+
+def upsert_customer(cursor: sqlite3.Cursor, name: str, email: Optional[str], phone: Optional[str]) -> int:
+    """Return the id of the matching customer, creating it if needed"""
+    keys = customer_keys(name, email, phone)
+    # The latest spelling is kept for display; unchanged rows are not rewritten
+    cursor.execute("""
+        INSERT INTO customers (name, email, phone, name_key, email_key, phone_key)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(name_key, email_key, phone_key) DO UPDATE SET
+            name = excluded.name, email = excluded.email, phone = excluded.phone
+        WHERE name IS NOT excluded.name OR email IS NOT excluded.email OR phone IS NOT excluded.phone
+    """, (name, email, phone, *keys))
+    return cursor.execute("""
+        SELECT id FROM customers WHERE name_key = ? AND email_key = ? AND phone_key = ?
+    """, keys).fetchone()[0]
+
+def backfill_customers(conn: sqlite3.Connection) -> int:
+    """Link invoices without a customer_id to deduplicated customers.
+
+    Customers are created from the newest invoice of each key first, so the
+    latest spelling wins. Returns the number of invoices linked.
+    """
+    if conn.execute("SELECT 1 FROM invoices WHERE customer_id IS NULL LIMIT 1").fetchone() is None:
+        return 0
+    conn.create_function("customer_name_key", 1, normalize_customer_name)
+    conn.create_function("customer_email_key", 1, normalize_email)
+    conn.create_function("customer_phone_key", 1, normalize_phone)
+    conn.execute("""
+        INSERT OR IGNORE INTO customers (name, email, phone, name_key, email_key, phone_key)
+        SELECT customer_name, customer_email, customer_phone, customer_name_key(customer_name),
+               customer_email_key(customer_email), customer_phone_key(customer_phone)
+        FROM invoices WHERE customer_id IS NULL
+        ORDER BY date_created DESC, id DESC
+    """)
+    return conn.execute("""
+        UPDATE invoices SET customer_id = (
+            SELECT id FROM customers
+            WHERE name_key = customer_name_key(invoices.customer_name)
+              AND email_key = customer_email_key(invoices.customer_email)
+              AND phone_key = customer_phone_key(invoices.customer_phone)
+        )
+        WHERE customer_id IS NULL
+    """).rowcount
+
+def find_customers(conn: sqlite3.Connection, search_term: str = "", limit: Optional[int] = None) -> List[tuple]:
+    """Return (id, name, email, phone) of customers whose name contains the term"""
+    limit_sql = f"LIMIT {int(limit)}" if limit else ""
+    return conn.execute(f"""
+        SELECT id, name, email, phone FROM customers
+        WHERE name_key LIKE ? ORDER BY name_key {limit_sql}
+    """, (f"%{normalize_customer_name(search_term)}%",)).fetchall()
+
+def customer_history(conn: sqlite3.Connection, customer_id: int, limit: Optional[int] = None) -> List[tuple]:
+    """Return a customer's live invoice summaries, newest first"""
+    limit_sql = f"LIMIT {int(limit)}" if limit else ""
+    return conn.execute(f"""
+        SELECT {INVOICE_SUMMARY_COLUMNS} FROM invoices
+        WHERE customer_id = ? ORDER BY date_created DESC {limit_sql}
+    """, (customer_id,)).fetchall()
+
+def customer_totals(conn: sqlite3.Connection, customer_id: int) -> Dict[str, Any]:
+    """Invoice count, total billed and first/last invoice date of a customer's live invoices"""
+    count, total, first, last = conn.execute("""
+        SELECT COUNT(*), COALESCE(SUM(total_amount), 0), MIN(date_created), MAX(date_created)
+        FROM invoices WHERE customer_id = ?
+    """, (customer_id,)).fetchone()
+    return {"invoices": count, "total": total, "first": first, "last": last}
+
+# --- Database Setup ---
+def connect_database(path: str = DATABASE_FILE) -> sqlite3.Connection:
+    """Open a connection that waits for locks instead of failing immediately"""
+    conn = sqlite3.connect(path, timeout=DATABASE_BUSY_TIMEOUT_MS / 1000)
+    conn.execute(f"PRAGMA busy_timeout = {DATABASE_BUSY_TIMEOUT_MS}")
+    return conn
+
+# Tables whose inserts, updates and deletes are recorded in change_log
+CHANGE_CAPTURE_TABLES = ("invoices", "invoice_items", "items", "customers", "payments")
+
+def setup_database():
+    """Setup database with proper error handling and security measures"""
+    try:
+        conn = connect_database()
+        cursor = conn.cursor()
+        
+        # New databases can give free pages back with incremental vacuum;
+        # existing ones are converted by "maintenance --migrate"
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        
+        # Create admins table with additional security fields
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS admins (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT UNIQUE NOT NULL,
+                password TEXT NOT NULL,
+                email TEXT UNIQUE,
+                last_login TIMESTAMP,
+                failed_attempts INTEGER DEFAULT 0,
+                account_locked BOOLEAN DEFAULT 0
+            )
+        """)
+        
+        # Create items table for storing predefined items/services
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS items (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                description TEXT,
+                unit_price REAL NOT NULL,
+                category TEXT,
+                created_by TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(name, created_by)
+            )
+        """)
+        
+        # Create invoices table
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS invoices (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                invoice_number TEXT UNIQUE NOT NULL,
+                customer_name TEXT NOT NULL,
+                customer_email TEXT,
+                customer_phone TEXT,
+                total_amount REAL NOT NULL,
+                date_created TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                created_by TEXT NOT NULL,
+                status TEXT DEFAULT 'Draft'
+            )
+        """)
+        
+        # Add new columns for tax information if they don't exist
+        try:
+            cursor.execute("ALTER TABLE invoices ADD COLUMN tax_rate REAL DEFAULT 0")
+        except sqlite3.OperationalError:
+            pass  # Column already exists
+            
+        try:
+            cursor.execute("ALTER TABLE invoices ADD COLUMN tax_amount REAL DEFAULT 0")
+        except sqlite3.OperationalError:
+            pass  # Column already exists
+            
+        try:
+            cursor.execute("ALTER TABLE invoices ADD COLUMN subtotal REAL DEFAULT 0")
+        except sqlite3.OperationalError:
+            pass  # Column already exists
+        
+        # Add columns recording where the generated document was stored
+        try:
+            cursor.execute("ALTER TABLE invoices ADD COLUMN document_path TEXT")
+        except sqlite3.OperationalError:
+            pass  # Column already exists
+            
+        try:
+            cursor.execute("ALTER TABLE invoices ADD COLUMN document_size INTEGER")
+        except sqlite3.OperationalError:
+            pass  # Column already exists
+        
+        # Record the tax region whose rules taxed the invoice (NULL for a flat rate)
+        try:
+            cursor.execute("ALTER TABLE invoices ADD COLUMN tax_region TEXT")
+        except sqlite3.OperationalError:
+            pass  # Column already exists
+        
+        # Create customers, deduplicated on normalized name, email and phone
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS customers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                email TEXT,
+                phone TEXT,
+                name_key TEXT NOT NULL,
+                email_key TEXT NOT NULL DEFAULT '',
+                phone_key TEXT NOT NULL DEFAULT '',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(name_key, email_key, phone_key)
+            )
+        """)
+        
+        try:
+            cursor.execute("ALTER TABLE invoices ADD COLUMN customer_id INTEGER REFERENCES customers (id)")
+        except sqlite3.OperationalError:
+            pass  # Column already exists
+        
+        # Track what has been paid; invoices already Paid are settled in full
+        try:
+            cursor.execute("ALTER TABLE invoices ADD COLUMN amount_paid REAL DEFAULT 0")
+            cursor.execute("UPDATE invoices SET amount_paid = total_amount WHERE status = 'Paid'")
+            backfill_payments = True
+        except sqlite3.OperationalError:
+            backfill_payments = False  # Column already exists
+        
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS payments (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                invoice_id INTEGER NOT NULL,
+                amount REAL NOT NULL,
+                paid_on DATE NOT NULL,
+                method TEXT,
+                reference TEXT,
+                recorded_by TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (invoice_id) REFERENCES invoices (id)
+            )
+        """)
+        if backfill_payments:
+            # Invoices that were Paid before payments were tracked get one
+            # payment each, so payments always add up to amount_paid
+            cursor.execute("""
+                INSERT INTO payments (invoice_id, amount, paid_on, method, recorded_by)
+                SELECT id, amount_paid, date(date_created), 'Paid on creation', created_by
+                FROM invoices WHERE status = 'Paid' AND amount_paid > 0
+            """)
+        
+        # Create invoice_items table
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS invoice_items (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                invoice_id INTEGER,
+                description TEXT NOT NULL,
+                quantity INTEGER NOT NULL,
+                unit_price REAL NOT NULL,
+                total_price REAL NOT NULL,
+                FOREIGN KEY (invoice_id) REFERENCES invoices (id)
+            )
+        """)
+        
+        # Add per-line category and tax to invoice items
+        try:
+            cursor.execute("ALTER TABLE invoice_items ADD COLUMN category TEXT")
+        except sqlite3.OperationalError:
+            pass  # Column already exists
+            
+        try:
+            cursor.execute("ALTER TABLE invoice_items ADD COLUMN tax_amount REAL DEFAULT 0")
+        except sqlite3.OperationalError:
+            pass  # Column already exists
+        
+        # Create tax rules; '' region or category matches any
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS tax_rules (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                rate REAL NOT NULL,
+                region TEXT NOT NULL DEFAULT '',
+                category TEXT NOT NULL DEFAULT '',
+                compound BOOLEAN DEFAULT 0,
+                priority INTEGER DEFAULT 0,
+                UNIQUE(name, region, category)
+            )
+        """)
+        
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS tax_exemptions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                region TEXT NOT NULL DEFAULT '',
+                category TEXT NOT NULL DEFAULT '',
+                UNIQUE(region, category)
+            )
+        """)
+        
+        # Create recurring invoice definitions and their line items
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS recurring_invoices (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                customer_name TEXT NOT NULL,
+                customer_email TEXT,
+                customer_phone TEXT,
+                tax_rate REAL DEFAULT 0,
+                cadence TEXT NOT NULL,
+                start_date DATE NOT NULL,
+                next_run DATE NOT NULL,
+                runs INTEGER DEFAULT 0,
+                last_invoice_number TEXT,
+                active BOOLEAN DEFAULT 1,
+                created_by TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS recurring_invoice_items (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                recurring_id INTEGER NOT NULL,
+                description TEXT NOT NULL,
+                quantity INTEGER NOT NULL,
+                unit_price REAL NOT NULL,
+                FOREIGN KEY (recurring_id) REFERENCES recurring_invoices (id)
+            )
+        """)
+        
+        # Create durable job queue for bulk invoice runs
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS invoice_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                run_id TEXT NOT NULL,
+                idempotency_key TEXT UNIQUE NOT NULL,
+                payload TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending',
+                invoice_id INTEGER,
+                failures INTEGER DEFAULT 0,
+                lease_owner TEXT,
+                lease_expires REAL,
+                last_error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (invoice_id) REFERENCES invoices (id)
+            )
+        """)
+        
+        # Recurring invoices are taxed like the invoice they were created from
+        try:
+            cursor.execute("ALTER TABLE recurring_invoices ADD COLUMN tax_region TEXT")
+        except sqlite3.OperationalError:
+            pass  # Column already exists
+            
+        try:
+            cursor.execute("ALTER TABLE recurring_invoice_items ADD COLUMN category TEXT")
+        except sqlite3.OperationalError:
+            pass  # Column already exists
+        
+        # Append-only change log for downstream sync. AUTOINCREMENT keeps
+        # sequence numbers from being reused once consumed entries are compacted
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS change_log (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                table_name TEXT NOT NULL,
+                row_id INTEGER NOT NULL,
+                operation TEXT NOT NULL,
+                changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS change_consumers (
+                name TEXT PRIMARY KEY,
+                watermark INTEGER NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        # Changes are only recorded while someone consumes them. Recreated on
+        # every start so databases with older trigger definitions pick this up
+        for table in CHANGE_CAPTURE_TABLES:
+            for event, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+                cursor.execute(f"DROP TRIGGER IF EXISTS trg_{table}_{event.lower()}_change_log")
+                cursor.execute(f"""
+                    CREATE TRIGGER trg_{table}_{event.lower()}_change_log
+                    AFTER {event} ON {table}
+                    WHEN EXISTS (SELECT 1 FROM change_consumers)
+                    BEGIN
+                        INSERT INTO change_log (table_name, row_id, operation)
+                        VALUES ('{table}', {row}.id, '{event.lower()}');
+                    END
+                """)
+        
+        # Indexes for history queries and archiving
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_invoices_date_created ON invoices (date_created)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_invoice_items_invoice_id ON invoice_items (invoice_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_payments_invoice_id ON payments (invoice_id)")
+        # Only unpaid invoices are indexed, so the aging report and overdue
+        # checks stay small however much settled history there is
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_invoices_open
+            ON invoices (date_created, status, total_amount, amount_paid)
+            WHERE status IN ('Sent', 'Overdue')
+        """)
+        # Per-customer history in date order; totals are read from the index alone
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_invoices_customer_id
+            ON invoices (customer_id, date_created, total_amount)
+        """)
+        
+        # Due recurring invoices are found by next_run among active definitions only
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_recurring_invoices_next_run
+            ON recurring_invoices (next_run) WHERE active = 1
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_invoice_jobs_state
+            ON invoice_jobs (state, id) WHERE state IN ('pending', 'inserted')
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_invoice_jobs_run_id ON invoice_jobs (run_id, state)")
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_recurring_invoice_items_recurring_id
+            ON recurring_invoice_items (recurring_id)
+        """)
+        
+        # Phone keys used to drop the leading +; customers.phone keeps it
+        cursor.execute("""
+            UPDATE OR IGNORE customers SET phone_key = '+' || phone_key
+            WHERE ltrim(phone) LIKE '+%' AND phone_key NOT LIKE '+%'
+        """)
+        
+        # Link invoices created before the customers table existed
+        backfill_customers(conn)
+        
+        conn.commit()
+    except sqlite3.Error as e:
+        messagebox.showerror("Database Error", f"Error setting up database: {str(e)}")
+    finally:
+        if 'conn' in locals():
+            conn.close()
+
+setup_database()
+
+# --- Database Writer ---
+class DatabaseWriter:
+    """Single writer thread that owns the write connection.
+
+    Producers submit operations (callables taking a cursor) and get a Future
+    back. The writer drains whatever is queued, runs each operation inside its
+    own savepoint and commits the whole batch in one transaction, so many
+    producers share one commit instead of fighting over the database lock.
+    """
+
+    _STOP = object()
+
+    def __init__(self, path: str = DATABASE_FILE, batch_size: int = 256):
+        self.path = path
+        self.batch_size = batch_size
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        # Time spent waiting for the database write lock (busy timeout)
+        self.lock_wait_seconds = 0.0
+        self.lock_wait_max = 0.0
+        self.commits = 0
+
+    def start(self) -> None:
+        """Start the writer thread if it is not already running"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run,
+                                                name="DatabaseWriter",
+                                                daemon=True)
+                self._thread.start()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def submit(self, operation: Callable[[sqlite3.Cursor], Any]) -> Future:
+        """Queue a write operation and return a Future for its result"""
+        future = Future()
+        self._queue.put((future, operation))
+        return future
+
+    def flush(self) -> None:
+        """Block until everything queued so far has been committed"""
+        self.submit(lambda cursor: None).result()
+
+    def stop(self) -> None:
+        """Commit the remaining queue and stop the writer thread"""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None and thread.is_alive():
+            self._queue.put(self._STOP)
+            thread.join()
+
+    def _run(self) -> None:
+        conn = connect_database(self.path)
+        conn.isolation_level = None  # Transactions are managed per batch
+        try:
+            conn.execute("PRAGMA journal_mode = WAL")
+            stopping = False
+            while not stopping:
+                batch = [self._queue.get()]
+                # Group commit: take everything that queued up meanwhile
+                while len(batch) < self.batch_size:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if self._STOP in batch:
+                    stopping = True
+                    batch = [entry for entry in batch if entry is not self._STOP]
+                if batch:
+                    self._commit_batch(conn, batch)
+        finally:
+            conn.close()
+
+    def _commit_batch(self, conn: sqlite3.Connection, batch: list) -> None:
+        outcomes = []
+        cursor = conn.cursor()
+        try:
+            waiting = time.perf_counter()
+            cursor.execute("BEGIN IMMEDIATE")
+            waited = time.perf_counter() - waiting
+            self.lock_wait_seconds += waited
+            self.lock_wait_max = max(self.lock_wait_max, waited)
+            for future, operation in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                cursor.execute("SAVEPOINT write_op")
+                try:
+                    result = operation(cursor)
+                    cursor.execute("RELEASE write_op")
+                    outcomes.append((future, result, None))
+                except Exception as e:
+                    # Only this operation is undone, the rest of the batch commits
+                    cursor.execute("ROLLBACK TO write_op")
+                    cursor.execute("RELEASE write_op")
+                    outcomes.append((future, None, e))
+            cursor.execute("COMMIT")
+            self.commits += 1
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            for future, _operation in batch:
+                if not future.done():
+                    if future.running() or future.set_running_or_notify_cancel():
+                        future.set_exception(e)
+            return
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+_db_writer = None
+_db_writer_lock = threading.Lock()
+
+def get_db_writer() -> DatabaseWriter:
+    """Return the shared database writer, starting it on first use"""
+    global _db_writer
+    with _db_writer_lock:
+        if _db_writer is None:
+            _db_writer = DatabaseWriter()
+            _db_writer.start()
+            atexit.register(_db_writer.stop)
+        return _db_writer
+
+# --- Change Feed ---
+# Downstream systems read change_log after their stored watermark, so a sync
+# costs O(changes) instead of a full table dump
+CHANGE_BATCH_SIZE = 500
+
+def register_change_consumer(name: str, from_start: bool = False) -> int:
+    """Register a consumer and return its watermark.
+
+    New consumers start after the latest change (sync the full tables once
+    first), or at the oldest retained change with from_start. Nothing is
+    recorded while no consumer is registered. Registering an existing
+    consumer leaves its watermark alone.
+    """
+    def register(cursor):
+        cursor.execute("""
+            INSERT OR IGNORE INTO change_consumers (name, watermark)
+            VALUES (?, CASE WHEN ? THEN 0 ELSE (SELECT COALESCE(MAX(seq), 0) FROM change_log) END)
+        """, (name, int(from_start)))
+        return cursor.execute("SELECT watermark FROM change_consumers WHERE name = ?", (name,)).fetchone()[0]
+    return get_db_writer().submit(register).result()
+
+def change_watermark(conn: sqlite3.Connection, name: str) -> int:
+    """Return a consumer's watermark; ValueError for unknown consumers"""
+    row = conn.execute("SELECT watermark FROM change_consumers WHERE name = ?", (name,)).fetchone()
+    if row is None:
+        raise ValueError(f"Unknown change consumer '{name}'")
+    return row[0]
+
+def read_changes(conn: sqlite3.Connection, name: str,
+                 limit: int = CHANGE_BATCH_SIZE) -> List[Dict[str, Any]]:
+    """Read up to limit changes after a consumer's watermark, oldest first.
+
+    Each change carries the current row (None once deleted or archived), so
+    a row changed several times may show its latest state more than once.
+    Reading does not move the watermark; see acknowledge_changes().
+    """
+    changes = [
+        {"seq": seq, "table": table, "id": row_id, "operation": operation, "changed_at": changed_at}
+        for seq, table, row_id, operation, changed_at in conn.execute("""
+            SELECT seq, table_name, row_id, operation, changed_at FROM change_log
+            WHERE seq > ? ORDER BY seq LIMIT ?
+        """, (change_watermark(conn, name), limit))
+    ]
+    wanted = {}
+    for change in changes:
+        if change["table"] in CHANGE_CAPTURE_TABLES:
+            wanted.setdefault(change["table"], set()).add(change["id"])
+    rows = {}
+    for table, ids in wanted.items():
+        for chunk in _chunked(sorted(ids), CHANGE_BATCH_SIZE):
+            cursor = conn.execute(f"SELECT * FROM {table} WHERE id IN ({', '.join('?' for _ in chunk)})", chunk)
+            columns = [column[0] for column in cursor.description]
+            for values in cursor:
+                row = dict(zip(columns, values))
+                rows[(table, row["id"])] = row
+    for change in changes:
+        change["row"] = rows.get((change["table"], change["id"]))
+    return changes
+
+def acknowledge_changes(name: str, seq: int) -> None:
+    """Move a consumer's watermark forward to seq"""
+    get_db_writer().submit(lambda cursor: cursor.execute("""
+        UPDATE change_consumers SET watermark = MAX(watermark, ?), updated_at = CURRENT_TIMESTAMP
+        WHERE name = ?
+    """, (seq, name))).result()
+
+def consume_changes(name: str, handler: Callable[[List[Dict[str, Any]]], Any],
+                    batch_size: int = CHANGE_BATCH_SIZE) -> int:
+    """Pass every pending change to handler in batches and return the count.
+
+    The watermark moves after each batch the handler returns from, so a
+    failure part way repeats at most the batch that failed.
+    """
+    conn = connect_database()
+    try:
+        consumed = 0
+        while True:
+            changes = read_changes(conn, name, batch_size)
+            if not changes:
+                return consumed
+            handler(changes)
+            acknowledge_changes(name, changes[-1]["seq"])
+            consumed += len(changes)
+    finally:
+        conn.close()
+
+def _compact_change_log(cursor: sqlite3.Cursor) -> int:
+    # Without consumers nobody will read the log, so all of it goes
+    return cursor.execute("""
+        DELETE FROM change_log
+        WHERE seq <= COALESCE((SELECT MIN(watermark) FROM change_consumers),
+                              (SELECT MAX(seq) FROM change_log))
+    """).rowcount
+
+def compact_change_log() -> int:
+    """Delete the changes every consumer has acknowledged and return how many"""
+    return get_db_writer().submit(_compact_change_log).result()
+
+def change_feed_status(conn: sqlite3.Connection) -> Dict[str, Any]:
+    """Retained change range and each consumer's watermark and backlog"""
+    oldest, latest, retained = conn.execute(
+        "SELECT MIN(seq), MAX(seq), COUNT(*) FROM change_log").fetchone()
+    consumers = [
+        {"name": name, "watermark": watermark, "pending": pending, "updated_at": updated_at}
+        for name, watermark, updated_at, pending in conn.execute("""
+            SELECT name, watermark, updated_at,
+                   (SELECT COUNT(*) FROM change_log WHERE seq > watermark)
+            FROM change_consumers ORDER BY name
+        """)
+    ]
+    return {"oldest": oldest, "latest": latest, "retained": retained, "consumers": consumers}
+
+# --- Database Maintenance ---
+AUTO_VACUUM_MODES = {0: "none", 1: "full", 2: "incremental"}
+MAINTENANCE_VACUUM_PAGES = 1000
+# Rows ANALYZE samples per index when PRAGMA optimize refreshes statistics
+MAINTENANCE_ANALYSIS_LIMIT = 400
+
+def database_stats(conn: sqlite3.Connection, path: str = DATABASE_FILE) -> Dict[str, Any]:
+    """Page layout and size figures of a database"""
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    freelist_count = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    file_bytes = sum(os.path.getsize(name) for name in (path, path + "-wal") if os.path.exists(name))
+    return {
+        "page_size": page_size,
+        "page_count": page_count,
+        "freelist_count": freelist_count,
+        "free_percent": freelist_count / page_count * 100 if page_count else 0.0,
+        "auto_vacuum": AUTO_VACUUM_MODES.get(auto_vacuum, str(auto_vacuum)),
+        "file_bytes": file_bytes,
+        "analyzed": conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone() is not None,
+    }
+
+def format_database_stats(stats: Dict[str, Any]) -> str:
+    """One line summary of database_stats()"""
+    return (f"{stats['file_bytes'] / 1024:,.0f} KiB, {stats['page_count']} pages of {stats['page_size']} B, "
+            f"{stats['freelist_count']} free ({stats['free_percent']:.1f}%), "
+            f"auto_vacuum={stats['auto_vacuum']}, {'analyzed' if stats['analyzed'] else 'never analyzed'}")
+
+@profiled("maintenance")
+def run_maintenance(vacuum_pages: int = MAINTENANCE_VACUUM_PAGES, full_analyze: bool = False,
+                    path: str = DATABASE_FILE) -> Dict[str, Any]:
+    """Refresh planner statistics and release free pages without blocking writers for long.
+
+    Runs as one operation on the database writer: compacting the consumed
+    change log, a full ANALYZE the first time (or when asked), PRAGMA
+    optimize otherwise, then an incremental vacuum of at most vacuum_pages
+    pages when the database supports it. Returns the stats before and after
+    and the number of change log entries compacted.
+    """
+    conn = connect_database(path)
+    try:
+        before = database_stats(conn, path)
+    finally:
+        conn.close()
+
+    def maintain(cursor):
+        compacted = _compact_change_log(cursor)
+        if full_analyze or not before["analyzed"]:
+            cursor.execute("ANALYZE")
+        else:
+            cursor.execute(f"PRAGMA analysis_limit = {MAINTENANCE_ANALYSIS_LIMIT}")
+            cursor.execute("PRAGMA optimize")
+        if before["auto_vacuum"] == "incremental" and vacuum_pages > 0:
+            # The sqlite3 module steps the pragma once, which frees a single page
+            for _ in range(min(vacuum_pages, cursor.execute("PRAGMA freelist_count").fetchone()[0])):
+                cursor.execute("PRAGMA incremental_vacuum")
+        return compacted
+
+    if path == DATABASE_FILE:
+        compacted = get_db_writer().submit(maintain).result()
+    else:
+        conn = connect_database(path)
+        try:
+            with conn:
+                compacted = maintain(conn.cursor())
+        finally:
+            conn.close()
+    conn = connect_database(path)
+    try:
+        # Move the freed pages out of the WAL so the file size shows the effect
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+        after = database_stats(conn, path)
+    finally:
+        conn.close()
+    return {"before": before, "after": after, "compacted": compacted}
+
+def migrate_database(page_size: Optional[int] = None, path: str = DATABASE_FILE) -> Dict[str, Any]:
+    """Rebuild the database with auto_vacuum=INCREMENTAL and optionally a new page size.
+
+    Needs exclusive access: the shared writer is stopped first and no other
+    process may have the database open. The journal mode is restored after
+    the VACUUM, since the page size cannot change in WAL mode.
+    """
+    if page_size is not None and (page_size < 512 or page_size > 65536 or page_size & (page_size - 1)):
+        raise ValueError("Page size must be a power of two between 512 and 65536")
+    if _db_writer is not None:
+        _db_writer.stop()
+    conn = connect_database(path)
+    conn.isolation_level = None
+    try:
+        before = database_stats(conn, path)
+        journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        if journal_mode == "wal":
+            conn.execute("PRAGMA journal_mode = DELETE")
+        if page_size is not None:
+            conn.execute(f"PRAGMA page_size = {page_size}")
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        if journal_mode == "wal":
+            conn.execute("PRAGMA journal_mode = WAL")
+        after = database_stats(conn, path)
+    finally:
+        conn.close()
+    if _db_writer is not None:
+        _db_writer.start()
+    return {"before": before, "after": after}
+
+class IdleMaintenance:
+    """Run run_maintenance() from the GUI once the user has been idle a while.
+
+    The GUI reports activity through note_activity() and calls poll()
+    periodically; maintenance runs on a background thread at most once per
+    idle period and once per interval.
+    """
+
+    def __init__(self, idle_seconds: Optional[float] = None, interval_seconds: Optional[float] = None):
+        settings = load_settings()
+        self.idle_seconds = idle_seconds or float(settings.get("maintenance_idle_seconds", 300))
+        self.interval_seconds = interval_seconds or float(settings.get("maintenance_interval_minutes", 60)) * 60
+        self.vacuum_pages = int(settings.get("maintenance_vacuum_pages", MAINTENANCE_VACUUM_PAGES))
+        self.last_activity = time.monotonic()
+        self.last_run = None
+        self._ran_this_idle = False
+        self._running = threading.Event()
+
+    def note_activity(self, event=None) -> None:
+        self.last_activity = time.monotonic()
+        self._ran_this_idle = False
+
+    def poll(self) -> bool:
+        """Start maintenance if the user is idle and it is due; True if started"""
+        now = time.monotonic()
+        if (self._ran_this_idle or self._running.is_set()
+                or now - self.last_activity < self.idle_seconds
+                or (self.last_run is not None and now - self.last_run < self.interval_seconds)):
+            return False
+        self._ran_this_idle = True
+        self.last_run = now
+        self._running.set()
+        threading.Thread(target=self._run, name="IdleMaintenance", daemon=True).start()
+        return True
+
+    def _run(self) -> None:
+        try:
+            run_maintenance(self.vacuum_pages)
+        except sqlite3.Error as e:
+            print(f"Error during database maintenance: {e}")
+        finally:
+            self._running.clear()
+
+# --- Invoice Archive ---
+# Closed invoices older than a cutoff move to one SQLite file per year
+ARCHIVE_DIR = "archive"
+CLOSED_INVOICE_STATUSES = ("Paid", "Void")
+INVOICE_SUMMARY_COLUMNS = "invoice_number, customer_name, date_created, total_amount"
+
+def archive_path(year: int, archive_dir: str = ARCHIVE_DIR) -> str:
+    """Return the archive database file for a given year"""
+    return os.path.join(archive_dir, f"invoices_{year}.db")
+
+def list_archive_years(archive_dir: str = ARCHIVE_DIR) -> List[int]:
+    """List the years that have an archive database, newest first"""
+    if not os.path.isdir(archive_dir):
+        return []
+    years = []
+    for filename in os.listdir(archive_dir):
+        match = re.fullmatch(r"invoices_(\d{4})\.db", filename)
+        if match:
+            years.append(int(match.group(1)))
+    return sorted(years, reverse=True)
+
+def attach_archive(conn: sqlite3.Connection, year: int, archive_dir: str = ARCHIVE_DIR) -> str:
+    """Attach a year's archive to the connection and return its schema name"""
+    schema = f"archive_{year}"
+    attached = {row[1] for row in conn.execute("PRAGMA database_list")}
+    if schema not in attached:
+        conn.execute(f"ATTACH DATABASE ? AS {schema}", (archive_path(year, archive_dir),))
+    return schema
+
+def detach_archive(conn: sqlite3.Connection, schema: str) -> None:
+    """Detach an archive schema previously attached with attach_archive()"""
+    conn.execute(f"DETACH DATABASE {schema}")
+
+def _table_columns(conn: sqlite3.Connection, schema: str, table: str) -> List[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+def _ensure_archive_schema(conn: sqlite3.Connection, schema: str) -> None:
+    """Create or widen the archive tables so they match the live tables"""
+    for table in ("invoices", "invoice_items", "payments"):
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {schema}.{table} AS SELECT * FROM main.{table} WHERE 0")
+        archived = set(_table_columns(conn, schema, table))
+        for column in _table_columns(conn, "main", table):
+            if column not in archived:
+                conn.execute(f'ALTER TABLE {schema}.{table} ADD COLUMN "{column}"')
+    conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {schema}.idx_invoices_id ON invoices(id)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {schema}.idx_invoices_number ON invoices(invoice_number)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {schema}.idx_invoices_date ON invoices(date_created)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {schema}.idx_invoices_customer ON invoices(customer_name)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {schema}.idx_invoices_customer_id ON invoices(customer_id, date_created)")
+    conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {schema}.idx_invoice_items_id ON invoice_items(id)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {schema}.idx_invoice_items_invoice ON invoice_items(invoice_id)")
+    conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {schema}.idx_payments_id ON payments(id)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {schema}.idx_payments_invoice ON payments(invoice_id)")
+
+@profiled("archive_invoices")
+def archive_invoices(cutoff: datetime.date, path: str = DATABASE_FILE,
+                     archive_dir: str = ARCHIVE_DIR) -> Dict[int, int]:
+    """Move closed invoices created before the cutoff into per-year archives.
+
+    Rows are first copied and committed to the archive, then deleted from the
+    live database, so an interrupted run loses nothing and can be re-run.
+    Returns the number of invoices archived per year.
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    placeholders = ", ".join("?" for _ in CLOSED_INVOICE_STATUSES)
+    selection = f"""
+        date_created < ? AND status IN ({placeholders})
+        AND strftime('%Y', date_created) = ?
+    """
+    archived = {}
+    conn = connect_database(path)
+    conn.isolation_level = None
+    try:
+        years = [int(row[0]) for row in conn.execute(f"""
+            SELECT DISTINCT strftime('%Y', date_created) FROM invoices
+            WHERE date_created < ? AND status IN ({placeholders})
+        """, (cutoff.isoformat(), *CLOSED_INVOICE_STATUSES))]
+        for year in years:
+            params = (cutoff.isoformat(), *CLOSED_INVOICE_STATUSES, f"{year:04d}")
+            schema = attach_archive(conn, year, archive_dir)
+            try:
+                _ensure_archive_schema(conn, schema)
+                invoice_columns = ", ".join(f'"{c}"' for c in _table_columns(conn, "main", "invoices"))
+                item_columns = ", ".join(f'"{c}"' for c in _table_columns(conn, "main", "invoice_items"))
+                payment_columns = ", ".join(f'"{c}"' for c in _table_columns(conn, "main", "payments"))
+
+                # Copy into the archive first
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute(f"""
+                    INSERT OR IGNORE INTO {schema}.invoices ({invoice_columns})
+                    SELECT {invoice_columns} FROM main.invoices WHERE {selection}
+                """, params)
+                conn.execute(f"""
+                    INSERT OR IGNORE INTO {schema}.invoice_items ({item_columns})
+                    SELECT {item_columns} FROM main.invoice_items
+                    WHERE invoice_id IN (SELECT id FROM main.invoices WHERE {selection})
+                """, params)
+                conn.execute(f"""
+                    INSERT OR IGNORE INTO {schema}.payments ({payment_columns})
+                    SELECT {payment_columns} FROM main.payments
+                    WHERE invoice_id IN (SELECT id FROM main.invoices WHERE {selection})
+                """, params)
+                conn.execute("COMMIT")
+
+                # Then drop from the live database only what the archive now holds
+                conn.execute("BEGIN IMMEDIATE")
+                last_change = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM change_log").fetchone()[0]
+                conn.execute(f"""
+                    DELETE FROM main.invoice_items
+                    WHERE invoice_id IN (SELECT id FROM {schema}.invoices)
+                """)
+                conn.execute(f"""
+                    DELETE FROM main.payments
+                    WHERE invoice_id IN (SELECT id FROM {schema}.invoices)
+                """)
+                moved = conn.execute(f"""
+                    DELETE FROM main.invoices
+                    WHERE id IN (SELECT id FROM {schema}.invoices)
+                """).rowcount
+                # Downstream sync should see these rows as archived, not deleted
+                conn.execute("""
+                    UPDATE change_log SET operation = 'archive'
+                    WHERE seq > ? AND operation = 'delete'
+                """, (last_change,))
+                conn.execute("COMMIT")
+                archived[year] = moved
+                if moved and _invoice_details_cache is not None:
+                    _invoice_details_cache.invalidate()
+            except sqlite3.Error:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+            finally:
+                detach_archive(conn, schema)
+    finally:
+        conn.close()
+    if any(archived.values()) and invoice_history and path == DATABASE_FILE:
+        # Archived invoices leave the live recent list
+        load_invoice_history(invoice_history.maxlen)
+    return archived
+
+def _archive_years_in_range(date_from: Optional[str], date_to: Optional[str],
+                            archive_dir: str = ARCHIVE_DIR) -> List[int]:
+    years = list_archive_years(archive_dir)
+    if date_from:
+        years = [y for y in years if y >= int(date_from[:4])]
+    if date_to:
+        years = [y for y in years if y <= int(date_to[:4])]
+    return years
+
+def query_invoice_summaries(conn: sqlite3.Connection, search_term: str = "",
+                            date_from: Optional[str] = None, date_to: Optional[str] = None,
+                            limit: Optional[int] = None,
+                            archive_dir: str = ARCHIVE_DIR) -> List[tuple]:
+    """Search invoices, newest first, attaching archives only when needed.
+
+    Without a search term or date range only the live database is read.
+    Otherwise each archive year that can match is attached in turn.
+    """
+    conditions, params = [], []
+    if search_term:
+        # Match customers first, then read their invoices by customer_id;
+        # invoices archived before customers existed have no customer_id
+        conditions.append("""(customer_id IN (SELECT id FROM main.customers WHERE name_key LIKE ?)
+                              OR (customer_id IS NULL AND customer_name LIKE ?))""")
+        params.extend([f"%{normalize_customer_name(search_term)}%", f"%{search_term}%"])
+    if date_from:
+        conditions.append("date_created >= ?")
+        params.append(date_from)
+    if date_to:
+        conditions.append("date_created < date(?, '+1 day')")
+        params.append(date_to)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    limit_sql = f"LIMIT {int(limit)}" if limit else ""
+
+    def run(schema):
+        return conn.execute(f"""
+            SELECT {INVOICE_SUMMARY_COLUMNS} FROM {schema}.invoices
+            {where} ORDER BY date_created DESC {limit_sql}
+        """, params).fetchall()
+
+    results = run("main")
+    if conditions:
+        for year in _archive_years_in_range(date_from, date_to, archive_dir):
+            if limit and len(results) >= limit:
+                break  # Archives are older than everything already collected
+            schema = attach_archive(conn, year, archive_dir)
+            try:
+                results.extend(run(schema))
+            finally:
+                detach_archive(conn, schema)
+    results.sort(key=lambda row: row[2], reverse=True)
+    return results[:limit] if limit else results
+
+def locate_invoice(conn: sqlite3.Connection, invoice_number: str,
+                   archive_dir: str = ARCHIVE_DIR) -> Optional[str]:
+    """Return the schema holding an invoice, attaching its archive if needed"""
+    if conn.execute("SELECT 1 FROM invoices WHERE invoice_number = ?", (invoice_number,)).fetchone():
+        return "main"
+    # Invoice numbers start with their creation date, so try that year first
+    years = list_archive_years(archive_dir)
+    match = re.match(r"INV-(\d{4})", invoice_number)
+    if match and int(match.group(1)) in years:
+        years.remove(int(match.group(1)))
+        years.insert(0, int(match.group(1)))
+    for year in years:
+        schema = attach_archive(conn, year, archive_dir)
+        if conn.execute(f"SELECT 1 FROM {schema}.invoices WHERE invoice_number = ?",
+                        (invoice_number,)).fetchone():
+            return schema
+        detach_archive(conn, schema)
+    return None
+
+# --- Invoice Details Cache ---
+INVOICE_DETAILS_CACHE_SIZE = 128
+
+def fetch_invoice_details(conn: sqlite3.Connection, invoice_number: str) -> Optional[Dict[str, Any]]:
+    """Load an invoice and its line items with one joined query.
+
+    Returns {"invoice": (number, customer, email, phone, date, total,
+    tax rate, tax amount, subtotal, status, amount paid), "items":
+    [(description, quantity, unit price, total), ...]} or None if the
+    invoice does not exist.
+    """
+    def query(schema):
+        # Archives written before payments were tracked have no amount_paid
+        amount_paid = ("i.amount_paid" if "amount_paid" in _table_columns(conn, schema, "invoices")
+                       else "NULL")
+        return conn.execute(f"""
+            SELECT i.invoice_number, i.customer_name, i.customer_email, i.customer_phone,
+                   i.date_created, i.total_amount, i.tax_rate, i.tax_amount, i.subtotal,
+                   i.status, {amount_paid},
+                   it.description, it.quantity, it.unit_price, it.total_price
+            FROM {schema}.invoices i
+            LEFT JOIN {schema}.invoice_items it ON it.invoice_id = i.id
+            WHERE i.invoice_number = ?
+            ORDER BY it.id
+        """, (invoice_number,)).fetchall()
+
+    rows = query("main")
+    if not rows:
+        # Not live; look in the yearly archives
+        schema = locate_invoice(conn, invoice_number)
+        if not schema:
+            return None
+        try:
+            rows = query(schema)
+        finally:
+            if schema != "main":
+                detach_archive(conn, schema)
+    return {
+        "invoice": rows[0][:11],
+        "items": [row[11:] for row in rows if row[11] is not None]
+    }
+
+class InvoiceDetailsCache:
+    """Thread-safe LRU cache of decoded invoice details keyed by invoice number"""
+
+    def __init__(self, maxsize: int = INVOICE_DETAILS_CACHE_SIZE, path: str = DATABASE_FILE):
+        self.maxsize = maxsize
+        self.path = path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._prefetcher = None
+
+    def _load(self, invoice_number: str) -> Optional[Dict[str, Any]]:
+        conn = connect_database(self.path)
+        try:
+            return fetch_invoice_details(conn, invoice_number)
+        finally:
+            conn.close()
+
+    def _store(self, invoice_number: str, details: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[invoice_number] = details
+            self._entries.move_to_end(invoice_number)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def get(self, invoice_number: str) -> Optional[Dict[str, Any]]:
+        """Return cached details, loading them from the database on a miss"""
+        with self._lock:
+            if invoice_number in self._entries:
+                self._entries.move_to_end(invoice_number)
+                return self._entries[invoice_number]
+        details = self._load(invoice_number)
+        if details is not None:
+            self._store(invoice_number, details)
+        return details
+
+    def prefetch(self, invoice_numbers: List[str]) -> None:
+        """Load invoices that are not cached yet on a background thread"""
+        with self._lock:
+            missing = [n for n in invoice_numbers if n not in self._entries]
+            if not missing:
+                return
+            if self._prefetcher is None:
+                self._prefetcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="InvoicePrefetch")
+        for invoice_number in missing:
+            self._prefetcher.submit(self.get, invoice_number)
+
+    def invalidate(self, invoice_number: Optional[str] = None) -> None:
+        """Drop one invoice from the cache, or everything when no number is given"""
+        with self._lock:
+            if invoice_number is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(invoice_number, None)
+
+_invoice_details_cache = None
+
+def get_invoice_details_cache() -> InvoiceDetailsCache:
+    """Return the shared invoice details cache"""
+    global _invoice_details_cache
+    if _invoice_details_cache is None:
+        _invoice_details_cache = InvoiceDetailsCache()
+    return _invoice_details_cache
+
+# --- Recent Invoices ---
+def load_invoice_history(size: Optional[int] = None) -> None:
+    """Fill the recent invoices cache from the database"""
+    global invoice_history
+    if size is None:
+        size = int(load_settings().get("recent_invoices_size", RECENT_INVOICES_SIZE))
+    conn = connect_database()
+    try:
+        rows = query_invoice_summaries(conn, limit=size)
+    finally:
+        conn.close()
+    invoice_history = deque(rows, maxlen=size)
+
+def record_invoice_history(summary: tuple) -> None:
+    """Push a newly committed invoice summary onto the recent invoices cache"""
+    invoice_history.appendleft(summary)
+
+# --- Background Queries ---
+# Delay after the last keystroke before a live search runs
+SEARCH_DEBOUNCE_MS = 250
+
+class QueryCancelled(Exception):
+    """Raised for a query that was superseded before it could finish"""
+
+class LatestQueryRunner:
+    """Run read queries on a worker thread, keeping only the newest one alive.
+
+    Every submit() starts a new generation. Queued queries from older
+    generations are skipped and a running one is stopped with
+    Connection.interrupt(), so a burst of searches costs one query.
+    """
+
+    def __init__(self, path: str = DATABASE_FILE):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="LatestQuery")
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._active_conn = None
+
+    def submit(self, query: Callable[[sqlite3.Connection], Any]) -> tuple:
+        """Queue a query and return (generation, Future)"""
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+            active_conn = self._active_conn
+        if active_conn is not None:
+            try:
+                active_conn.interrupt()
+            except sqlite3.ProgrammingError:
+                pass  # Finished and closed in the meantime
+        return generation, self._executor.submit(self._run, generation, query)
+
+    def cancel(self) -> None:
+        """Supersede whatever is queued or running without starting a new query"""
+        with self._lock:
+            self._generation += 1
+            active_conn = self._active_conn
+        if active_conn is not None:
+            try:
+                active_conn.interrupt()
+            except sqlite3.ProgrammingError:
+                pass
+
+    def is_current(self, generation: int) -> bool:
+        """Whether a generation is still the newest one submitted"""
+        return generation == self._generation
+
+    def _run(self, generation: int, query: Callable[[sqlite3.Connection], Any]) -> Any:
+        if not self.is_current(generation):
+            raise QueryCancelled()
+        conn = connect_database(self.path)
+        with self._lock:
+            self._active_conn = conn
+        try:
+            return query(conn)
+        except sqlite3.OperationalError:
+            if not self.is_current(generation):
+                raise QueryCancelled()  # Interrupted by a newer query
+            raise
+        finally:
+            with self._lock:
+                self._active_conn = None
+            conn.close()
+
+# --- Line Item Import ---
+# Rows inserted into the invoice tree per event loop turn
+LINE_IMPORT_CHUNK_ROWS = 200
+LINE_ITEM_COLUMNS = {
+    "qty": 0, "quantity": 0,
+    "description": 1, "desc": 1, "item": 1, "name": 1,
+    "price": 2, "unit_price": 2, "unit price": 2,
+    "category": 3,
+}
+
+def _parse_amount(value: str) -> float:
+    """Parse a price as pasted from a spreadsheet, e.g. "$1,234.50" """
+    return float(value.strip().lstrip("$").replace(",", ""))
+
+def _is_line_item_header(fields: List[str]) -> bool:
+    """A header row names only known columns"""
+    names = [field.strip().lower() for field in fields if field.strip()]
+    return bool(names) and all(name in LINE_ITEM_COLUMNS for name in names)
+
+def parse_line_items(text: str) -> tuple:
+    """Parse pasted or CSV line items into invoice rows and (line, error) pairs.
+
+    Spreadsheet clipboards are tab separated, anything else is read as CSV.
+    Columns are qty, description, price and an optional category, in that
+    order unless a header row names them; a missing quantity means 1, a
+    missing price is an error.
+    """
+    lines = text.splitlines()
+    delimiter = "\t" if lines and "\t" in lines[0] else ","
+    rows, errors = [], []
+    columns = (0, 1, 2, 3)
+    for line_number, fields in enumerate(csv.reader(lines, delimiter=delimiter), 1):
+        if not any(field.strip() for field in fields):
+            continue
+        if line_number == 1 and _is_line_item_header(fields):
+            names = [field.strip().lower() for field in fields]
+            positions = {LINE_ITEM_COLUMNS[name]: i for i, name in enumerate(names)
+                         if name in LINE_ITEM_COLUMNS}
+            columns = tuple(positions.get(column) for column in range(4))
+            continue
+        values = [fields[i].strip() if i is not None and i < len(fields) else "" for i in columns]
+        if not values[2]:
+            errors.append((line_number, "Price is required"))
+            continue
+        try:
+            qty = int(values[0].replace(",", "")) if values[0] else 1
+            price = _parse_amount(values[2])
+        except ValueError:
+            errors.append((line_number, "Quantity and price must be numbers"))
+            continue
+        if not values[1]:
+            errors.append((line_number, "Description cannot be empty"))
+        elif qty <= 0:
+            errors.append((line_number, "Quantity must be greater than 0"))
+        elif price < 0:
+            errors.append((line_number, "Price cannot be negative"))
+        else:
+            rows.append([qty, values[1], price, round(qty * price, 2), values[3]])
+    return rows, errors
+
+def read_line_items_file(path: str) -> tuple:
+    """Parse line items from a CSV or tab separated file"""
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        return parse_line_items(f.read())
+
+# --- Batch Validation ---
+# Bulk invoice files are checked a chunk at a time, one column at a time,
+# before any job is queued or document rendered
+VALIDATION_CHUNK_ROWS = 1000
+VALIDATION_MAX_ERRORS = 1000
+VALIDATION_MAX_QUANTITY = 1000000
+VALIDATION_MAX_PRICE = 1e9
+VALIDATION_MAX_TAX_RATE = 100.0
+
+def _parse_quantity(value: Any) -> int:
+    """Whole quantities only: 2 and 2.0 are fine, 2.5 and true are not"""
+    if isinstance(value, bool):
+        raise TypeError(value)
+    if isinstance(value, float) and not value.is_integer():
+        raise ValueError(value)
+    return int(value)
+
+def _parse_price(value: Any) -> float:
+    if isinstance(value, bool):
+        raise TypeError(value)
+    return _parse_amount(value) if isinstance(value, str) else float(value)
+
+@contextlib.contextmanager
+def _gc_paused():
+    """Pause cyclic garbage collection while a chunk of acyclic JSON data is built.
+
+    Collections triggered by the allocations would otherwise rescan the
+    whole chunk over and over; reference counting still frees everything.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+def _column(records: list, field: str) -> list:
+    """One field of every record, None where missing, gathered without a Python loop"""
+    return list(map(dict.get, records, itertools.repeat(field)))
+
+def _convert_column(values: list, convert: Callable[[Any], Any]) -> list:
+    """Convert a column, with None for the values that do not convert"""
+    try:
+        return list(map(convert, values))
+    except (TypeError, ValueError, OverflowError):
+        pass
+    converted = []
+    for value in values:
+        try:
+            converted.append(convert(value))
+        except (TypeError, ValueError, OverflowError):
+            converted.append(None)
+    return converted
+
+def _quantity_column(values: list) -> list:
+    # JSON integers need no conversion at all
+    if set(map(type, values)) <= {int}:
+        return values
+    return _convert_column(values, _parse_quantity)
+
+def _price_column(values: list) -> list:
+    # JSON numbers go through float() in C; only text such as "$1,200" needs parsing
+    if set(map(type, values)) <= {int, float}:
+        return list(map(float, values))
+    return _convert_column(values, _parse_price)
+
+def read_jsonl_chunks(path: str, chunk_rows: int = VALIDATION_CHUNK_ROWS) -> Iterator[list]:
+    """Stream a JSONL file as chunks of (line number, line, record) triples.
+
+    Every line is decoded on its own, so a broken line can never shift the
+    records of its neighbours; lines that are not JSON get None.
+    """
+    with open(path, encoding="utf-8") as f:
+        first_line = 1
+        while True:
+            block = list(itertools.islice(f, chunk_rows))
+            if not block:
+                return
+            chunk = [(line_number, line.strip()) for line_number, line in enumerate(block, first_line)]
+            chunk = [(line_number, line) for line_number, line in chunk if line]
+            first_line += len(block)
+            try:
+                with _gc_paused():
+                    records = list(map(json.loads, [line for _, line in chunk]))
+            except ValueError:
+                records = []
+                for _, line in chunk:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        records.append(None)
+            yield [(line_number, line, record) for (line_number, line), record in zip(chunk, records)]
+
+def _check_invoice_columns(records: List[tuple]) -> tuple:
+    """Run every rule over (line number, record) pairs, one column at a time.
+
+    Returns (columns, errors): the cleaned columns of the records that are
+    JSON objects and (line, field, message) triples in line order.
+    """
+    errors = []
+    rows = [(line_number, record) for line_number, record in records if isinstance(record, dict)]
+    if len(rows) < len(records):
+        errors += [(line_number, "record", "Not a JSON object")
+                   for line_number, record in records if not isinstance(record, dict)]
+    lines = [line_number for line_number, _ in rows]
+    records = [record for _, record in rows]
+
+    # Customer columns
+    names = [" ".join(str(name).split()) if name else "" for name in _column(records, "name")]
+    errors += [(n, "name", "Customer name is required") for n, name in zip(lines, names) if not name]
+    typed_phones = [str(phone).strip() if phone else "" for phone in _column(records, "phone")]
+    phones = list(map(normalize_phone, typed_phones))
+    errors += [(n, "phone", f"Invalid phone number '{typed}'")
+               for n, typed, phone, characters in zip(lines, typed_phones, phones,
+                                                      map(PHONE_CHARACTERS.fullmatch, typed_phones))
+               if typed and (characters is None or PHONE_PATTERN.fullmatch(phone) is None)]
+    emails = [str(email).strip() if email else "" for email in _column(records, "email")]
+    errors += [(n, "email", f"Invalid email address '{email}'")
+               for n, email, match in zip(lines, emails, map(EMAIL_PATTERN.fullmatch, emails))
+               if email and match is None]
+    tax_rates = _price_column([rate or 0 for rate in _column(records, "tax_rate")])
+    errors += [(n, "tax_rate", f"Tax rate must be a number from 0 to {VALIDATION_MAX_TAX_RATE:g}")
+               for n, rate in zip(lines, tax_rates)
+               if rate is None or not 0 <= rate <= VALIDATION_MAX_TAX_RATE]
+
+    # Item columns, flattened; owners maps each item back to its record
+    entries = _column(records, "items")
+    for row, invoice_items in enumerate(entries):
+        if not invoice_items or not isinstance(invoice_items, list):
+            errors.append((lines[row], "items", "Invoice must have at least one item"))
+            entries[row] = []
+    lengths = list(map(len, entries))
+    owners = list(itertools.chain.from_iterable(map(itertools.repeat, range(len(entries)), lengths)))
+    positions = list(itertools.chain.from_iterable(map(range, lengths)))
+    items = list(itertools.chain.from_iterable(entries))
+    if not set(map(type, items)) <= {dict}:
+        errors += [(lines[row], f"items[{position}]", "Not a JSON object")
+                   for row, position, item in zip(owners, positions, items) if not isinstance(item, dict)]
+        kept = [i for i, item in enumerate(items) if isinstance(item, dict)]
+        owners, positions, items = ([column[i] for i in kept] for column in (owners, positions, items))
+        lengths = [0] * len(entries)
+        for row in owners:
+            lengths[row] += 1
+    item_lines = [lines[row] for row in owners]
+    quantities = _quantity_column(_column(items, "quantity"))
+    errors += [(n, f"items[{position}].quantity",
+                f"Quantity must be a whole number from 1 to {VALIDATION_MAX_QUANTITY:,}")
+               for n, position, qty in zip(item_lines, positions, quantities)
+               if qty is None or not 0 < qty <= VALIDATION_MAX_QUANTITY]
+    prices = _price_column(_column(items, "unit_price"))
+    errors += [(n, f"items[{position}].unit_price",
+                f"Price must be a number from 0 to {VALIDATION_MAX_PRICE:,.0f}")
+               for n, position, price in zip(item_lines, positions, prices)
+               if price is None or not 0 <= price <= VALIDATION_MAX_PRICE]  # Also rejects nan
+    descriptions = [str(description).strip() if description else ""
+                    for description in _column(items, "description")]
+    errors += [(n, f"items[{position}].description", "Description cannot be empty")
+               for n, position, description in zip(item_lines, positions, descriptions) if not description]
+
+    errors.sort(key=operator.itemgetter(0))
+    columns = {"lines": lines, "records": records, "names": names, "phones": phones,
+               "emails": emails, "tax_rates": tax_rates, "lengths": lengths, "items": items,
+               "quantities": quantities, "prices": prices, "descriptions": descriptions}
+    return columns, errors
+
+def validate_invoice_chunk(records: List[tuple]) -> tuple:
+    """Validate (line number, record) pairs of bulk invoices.
+
+    Returns (valid, errors): valid maps line numbers to cleaned records with
+    a normalized phone and an invoice_list, errors holds (line, field,
+    message) triples in line order. A record with any error is rejected.
+    """
+    with _gc_paused():
+        columns, errors = _check_invoice_columns(records)
+        lines = columns["lines"]
+        rejected = {error[0] for error in errors}
+        quantities, prices = columns["quantities"], columns["prices"]
+        if None in quantities or None in prices:
+            # Values that did not convert belong to rejected records
+            quantities = [qty or 0 for qty in quantities]
+            prices = [price or 0.0 for price in prices]
+        totals = list(map(round, map(operator.mul, quantities, prices), itertools.repeat(2)))
+        categories = [str(category) if category else "" for category in _column(columns["items"], "category")]
+        item_rows = list(map(list, zip(quantities, columns["descriptions"], prices, totals, categories)))
+        # Items are in record order, so each invoice_list is one slice
+        offsets = list(itertools.accumulate([0] + columns["lengths"]))
+        invoice_lists = [item_rows[start:end] for start, end in zip(offsets, offsets[1:])]
+        valid = {}
+        for row, (n, record) in enumerate(zip(lines, columns["records"])):
+            if n not in rejected:
+                region = record.get("region")
+                valid[n] = {"name": columns["names"][row], "phone": columns["phones"][row],
+                            "email": columns["emails"][row], "tax_rate": columns["tax_rates"][row],
+                            "region": None if region is None else str(region),
+                            "key": record.get("key"), "invoice_list": invoice_lists[row]}
+    return valid, errors
+
+def validate_invoice_file(path: str, chunk_rows: int = VALIDATION_CHUNK_ROWS,
+                          max_errors: int = VALIDATION_MAX_ERRORS) -> Dict[str, Any]:
+    """Validate a bulk invoice JSONL file without touching the database.
+
+    Keeps the first max_errors (line, field, message) errors and a count of
+    every error message, so a large bad file still gives a short report.
+    """
+    result = {"rows": 0, "valid": 0, "rejected": 0, "errors": [], "error_counts": {}, "seconds": 0.0}
+    counts = result["error_counts"]
+    start = time.perf_counter()
+    for chunk in read_jsonl_chunks(path, chunk_rows):
+        with _gc_paused():
+            _, errors = _check_invoice_columns([(n, record) for n, _, record in chunk])
+        rejected = len({error[0] for error in errors})
+        result["rows"] += len(chunk)
+        result["valid"] += len(chunk) - rejected
+        result["rejected"] += rejected
+        result["errors"].extend(errors[:max(max_errors - len(result["errors"]), 0)])
+        for _, field, message in errors:
+            # Count by rule: item index and offending value left out
+            rule = field.split("[")[0] + ": " + message.partition(" '")[0]
+            counts[rule] = counts.get(rule, 0) + 1
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+def format_validation_report(result: Dict[str, Any]) -> str:
+    """Summarize a validate_invoice_file() result for the user"""
+    rate = result["rows"] / result["seconds"] if result["seconds"] else 0.0
+    report = (f"Validated {result['rows']} invoice(s) in {result['seconds']:.2f}s "
+              f"({rate:,.0f} rows/sec): {result['valid']} valid, {result['rejected']} rejected")
+    for rule, count in sorted(result["error_counts"].items(), key=lambda entry: -entry[1]):
+        report += f"\n  {count:>8}  {rule}"
+    for line_number, field, message in result["errors"][:10]:
+        report += f"\n  line {line_number}: {field}: {message}"
+    if result["rejected"] and len(result["errors"]) > 10:
+        report += f"\n  ... and {len(result['errors']) - 10} more listed"
+    return report
+
+# --- Catalog Import ---
+CATALOG_IMPORT_CHUNK_SIZE = 5000
+CATALOG_IMPORT_MAX_ERRORS = 50
+
+CATALOG_UPSERT_SQL = """
+    INSERT INTO items (name, description, unit_price, category, created_by)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(name, created_by) DO UPDATE SET
+        description = excluded.description,
+        unit_price = excluded.unit_price,
+        category = excluded.category
+"""
+
+def read_catalog_rows(path: str) -> Iterator[tuple]:
+    """Stream (line number, record) pairs from a CSV or JSONL catalog file"""
+    if os.path.splitext(path)[1].lower() in (".jsonl", ".ndjson"):
+        with open(path, encoding="utf-8") as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+                yield line_number, record
+    else:
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            reader = csv.DictReader(f)
+            if reader.fieldnames:
+                reader.fieldnames = [field.strip().lower() for field in reader.fieldnames]
+            for record in reader:
+                yield reader.line_num, record
+
+def validate_catalog_chunk(records: List[tuple], created_by: str) -> tuple:
+    """Turn raw catalog records into upsert parameters and (line, error) pairs"""
+    params, errors = [], []
+    for line_number, record in records:
+        if not isinstance(record, dict):
+            errors.append((line_number, "Not a valid record"))
+            continue
+        name = str(record.get("name") or "").strip()
+        if not name:
+            errors.append((line_number, "Item name is required"))
+            continue
+        price = record.get("unit_price", record.get("price"))
+        try:
+            price = float(str(price).strip())
+        except (TypeError, ValueError):
+            errors.append((line_number, f"Invalid price '{price}'"))
+            continue
+        if price < 0:
+            errors.append((line_number, "Price cannot be negative"))
+            continue
+        if not price < float("inf"):  # Also rejects nan
+            errors.append((line_number, f"Invalid price '{price}'"))
+            continue
+        description = str(record.get("description") or "").strip()
+        category = str(record.get("category") or "").strip()
+        params.append((name, description, price, category, created_by))
+    return params, errors
+
+def _chunked(iterable: Iterable, size: int) -> Iterator[list]:
+    chunk = []
+    for entry in iterable:
+        chunk.append(entry)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+@profiled("import_catalog")
+def import_catalog(path: str, created_by: str,
+                   chunk_size: int = CATALOG_IMPORT_CHUNK_SIZE,
+                   progress: Optional[Callable[[int], None]] = None) -> Dict[str, Any]:
+    """Upsert a catalog file into the items table of one admin.
+
+    The file is streamed and validated chunk by chunk; each chunk is written
+    with one executemany() in its own transaction on the database writer
+    while the next chunk is being read, so memory stays bounded by the
+    chunk size. Invalid rows are skipped and reported, later rows for the
+    same item name win.
+    """
+    writer = get_db_writer()
+    result = {"rows": 0, "imported": 0, "skipped": 0, "errors": [], "seconds": 0.0}
+    start = time.perf_counter()
+    pending = None
+    try:
+        for records in _chunked(read_catalog_rows(path), chunk_size):
+            params, errors = validate_catalog_chunk(records, created_by)
+            result["rows"] += len(records)
+            result["skipped"] += len(errors)
+            room = CATALOG_IMPORT_MAX_ERRORS - len(result["errors"])
+            result["errors"].extend(errors[:max(room, 0)])
+            if pending is not None:
+                written, pending = pending, None
+                result["imported"] += written.result()
+                if progress:
+                    progress(result["imported"])
+            if params:
+                pending = writer.submit(
+                    lambda cursor, params=params: cursor.executemany(CATALOG_UPSERT_SQL, params).rowcount)
+        if pending is not None:
+            written, pending = pending, None
+            result["imported"] += written.result()
+            if progress:
+                progress(result["imported"])
+    finally:
+        if pending is not None:
+            pending.exception()  # Let the chunk in flight finish before returning
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+def format_catalog_import_report(result: Dict[str, Any]) -> str:
+    """Summarize an import_catalog() result for the user"""
+    rate = result["rows"] / result["seconds"] if result["seconds"] else 0.0
+    report = (f"Imported {result['imported']} of {result['rows']} item(s) "
+              f"in {result['seconds']:.2f}s ({rate:,.0f} rows/sec)")
+    if result["skipped"]:
+        report += f", skipped {result['skipped']} invalid row(s)"
+        for line_number, error in result["errors"][:10]:
+            report += f"\n  line {line_number}: {error}"
+        if result["skipped"] > 10:
+            report += f"\n  ... and {result['skipped'] - 10} more"
+    return report
+
+# --- Document Output Store ---
+OUTPUT_DIR = "invoices"
+BUNDLE_DIR = "bundles"
+
+def _current_umask() -> int:
+    # The umask can only be read by setting it, so this runs once at import
+    mask = os.umask(0o022)
+    os.umask(mask)
+    return mask
+
+# Mode open() would give a new file; mkstemp() files are 0600 until chmod'ed to it
+NEW_FILE_MODE = 0o666 & ~_current_umask()
+
+class OutputStore:
+    """Sharded on-disk store for generated documents.
+
+    Files are laid out as <root>/YYYY/MM/DD/<hash prefix>/<filename> so no
+    single directory grows without bound, and every write goes to a temp
+    file in the target directory followed by an atomic rename.
+    """
+
+    def __init__(self, root: str = OUTPUT_DIR):
+        self.root = root
+
+    def path_for(self, filename: str, when: Optional[datetime.date] = None) -> str:
+        """Return the sharded path a file with this name is stored at"""
+        when = when or datetime.date.today()
+        shard = hashlib.sha1(filename.encode("utf-8")).hexdigest()[:2]
+        return os.path.join(self.root, f"{when:%Y}", f"{when:%m}", f"{when:%d}", shard, filename)
+
+    def _write_atomic(self, path: str, write: Callable[[str], None]) -> int:
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".part")
+        os.close(fd)
+        try:
+            write(temp_path)
+            with open(temp_path, "rb+") as f:
+                os.fsync(f.fileno())
+            os.chmod(temp_path, NEW_FILE_MODE)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return os.path.getsize(path)
+
+    def write_bytes(self, filename: str, data: bytes,
+                    when: Optional[datetime.date] = None) -> tuple:
+        """Atomically store raw bytes and return (path, size)"""
+        path = self.path_for(filename, when)
+
+        def write(temp_path):
+            with open(temp_path, "wb") as f:
+                f.write(data)
+
+        return path, self._write_atomic(path, write)
+
+    def write_with(self, filename: str, write: Callable[[Any], Any],
+                   when: Optional[datetime.date] = None) -> tuple:
+        """Atomically store a file produced by write(binary file) and return (path, size)"""
+        path = self.path_for(filename, when)
+
+        def write_file(temp_path):
+            with open(temp_path, "wb") as f:
+                write(f)
+
+        return path, self._write_atomic(path, write_file)
+
+    def save_document(self, doc, filename: str, when: Optional[datetime.date] = None,
+                      writer: Optional["PrecompressedDocxWriter"] = None) -> tuple:
+        """Atomically save a rendered document and return (path, size)"""
+        path = self.path_for(filename, when)
+        if writer is not None:
+            return path, self._write_atomic(path, lambda temp_path: writer.save(doc, temp_path))
+        return path, self._write_atomic(path, doc.save)
+
+    def bundle(self, paths: List[str], bundle_name: str, bundle_dir: str = BUNDLE_DIR) -> str:
+        """Roll stored files into a zip bundle with a JSON manifest"""
+        manifest = []
+        bundle_path = os.path.join(bundle_dir, bundle_name)
+
+        def write(temp_path):
+            # Documents are already compressed, so members are stored as-is
+            with zipfile.ZipFile(temp_path, "w", zipfile.ZIP_STORED) as bundle:
+                for path in paths:
+                    digest = hashlib.sha256()
+                    with open(path, "rb") as f:
+                        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                            digest.update(chunk)
+                    member = os.path.relpath(path, self.root).replace(os.sep, "/")
+                    bundle.write(path, member)
+                    manifest.append({
+                        "file": member,
+                        "size": os.path.getsize(path),
+                        "sha256": digest.hexdigest()
+                    })
+                bundle.writestr("manifest.json", json.dumps({
+                    "created": datetime.datetime.now().isoformat(timespec="seconds"),
+                    "count": len(manifest),
+                    "files": manifest
+                }, indent=4))
+
+        self._write_atomic(bundle_path, write)
+        return bundle_path
+
+
+# --- Precompressed DOCX Writer ---
+# Deflate level for rendered parts; 0 stores members uncompressed for speed
+DOCX_COMPRESSION_LEVEL = 6
+
+_ZIP_LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+_ZIP_CENTRAL_HEADER = struct.Struct("<4s6H3L5H2L")
+_ZIP_END_OF_DIRECTORY = struct.Struct("<4s4H2LH")
+_ZIP_DATA_DESCRIPTOR = struct.Struct("<4s3L")
+
+def compress_zip_member(data: bytes, compresslevel: int = DOCX_COMPRESSION_LEVEL) -> tuple:
+    """Return (method, crc, payload, uncompressed size) for a zip member"""
+    crc = zlib.crc32(data)
+    if compresslevel == 0:
+        return zipfile.ZIP_STORED, crc, data, len(data)
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+    payload = compressor.compress(data) + compressor.flush()
+    return zipfile.ZIP_DEFLATED, crc, payload, len(data)
+
+def write_zip_members(f, members, compresslevel: int = DOCX_COMPRESSION_LEVEL) -> None:
+    """Write (name, member) pairs as a zip archive to a binary file.
+
+    A member is either a compressed tuple from compress_zip_member() or an
+    iterable of raw byte chunks, which is compressed as it streams and
+    followed by a data descriptor carrying its CRC and sizes.
+    """
+    now = datetime.datetime.now()
+    dos_time = (now.hour << 11) | (now.minute << 5) | (now.second // 2)
+    dos_date = ((now.year - 1980) << 9) | (now.month << 5) | now.day
+    directory = []
+    offset = 0
+    for name, member in members:
+        encoded_name = name.encode("utf-8")
+        flags = 0x800 if not encoded_name.isascii() else 0
+        if isinstance(member, tuple):
+            method, crc, payload, size = member
+            header = _ZIP_LOCAL_HEADER.pack(b"PK\x03\x04", 20, flags, method,
+                                            dos_time, dos_date, crc, len(payload), size,
+                                            len(encoded_name), 0)
+            f.write(header)
+            f.write(encoded_name)
+            f.write(payload)
+            compressed_size = len(payload)
+            written = len(header) + len(encoded_name) + compressed_size
+        else:
+            flags |= 0x08
+            method = zipfile.ZIP_STORED if compresslevel == 0 else zipfile.ZIP_DEFLATED
+            header = _ZIP_LOCAL_HEADER.pack(b"PK\x03\x04", 20, flags, method,
+                                            dos_time, dos_date, 0, 0, 0,
+                                            len(encoded_name), 0)
+            f.write(header)
+            f.write(encoded_name)
+            compressor = (zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+                          if method == zipfile.ZIP_DEFLATED else None)
+            crc = size = compressed_size = 0
+            for chunk in member:
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+                if compressor is not None:
+                    chunk = compressor.compress(chunk)
+                f.write(chunk)
+                compressed_size += len(chunk)
+            if compressor is not None:
+                tail = compressor.flush()
+                f.write(tail)
+                compressed_size += len(tail)
+            descriptor = _ZIP_DATA_DESCRIPTOR.pack(b"PK\x07\x08", crc, compressed_size, size)
+            f.write(descriptor)
+            written = len(header) + len(encoded_name) + compressed_size + len(descriptor)
+        directory.append(_ZIP_CENTRAL_HEADER.pack(b"PK\x01\x02", 20, 20, flags, method,
+                                                  dos_time, dos_date, crc, compressed_size, size,
+                                                  len(encoded_name), 0, 0, 0, 0, 0, offset)
+                         + encoded_name)
+        offset += written
+    directory_bytes = b"".join(directory)
+    f.write(directory_bytes)
+    f.write(_ZIP_END_OF_DIRECTORY.pack(b"PK\x05\x06", 0, 0, len(directory), len(directory),
+                                       len(directory_bytes), offset, 0))
+
+def content_types_xml(parts) -> bytes:
+    """Build [Content_Types].xml for package parts the way python-docx does"""
+    defaults = {"rels": CT.OPC_RELATIONSHIPS, "xml": CT.XML}
+    overrides = {}
+    for part in parts:
+        ext = part.partname.ext
+        if (ext.lower(), part.content_type) in default_content_types:
+            defaults[ext.lower()] = part.content_type
+        else:
+            overrides[str(part.partname)] = part.content_type
+    xml = ["<?xml version='1.0' encoding='UTF-8' standalone='yes'?>\n",
+           '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">']
+    xml += [f"<Default Extension={quoteattr(ext)} ContentType={quoteattr(content_type)}/>"
+            for ext, content_type in sorted(defaults.items())]
+    xml += [f"<Override PartName={quoteattr(partname)} ContentType={quoteattr(content_type)}/>"
+            for partname, content_type in sorted(overrides.items())]
+    xml.append("</Types>")
+    return "".join(xml).encode("utf-8")
+
+class PrecompressedDocxWriter:
+    """Save rendered DocxTemplate documents without recompressing static parts.
+
+    Every member of the template is compressed once up front. On save only
+    the parts docxtpl renders (body, headers, footers, footnotes, core
+    properties) plus the package bookkeeping (content types, rels) are
+    compressed again; everything else is copied as precompressed bytes.
+    """
+
+    RENDERED_CONTENT_TYPES = {
+        "application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml",
+        "application/vnd.openxmlformats-officedocument.wordprocessingml.template.main+xml",
+        "application/vnd.ms-word.document.macroEnabled.main+xml",
+        "application/vnd.openxmlformats-officedocument.wordprocessingml.header+xml",
+        "application/vnd.openxmlformats-officedocument.wordprocessingml.footer+xml",
+        "application/vnd.openxmlformats-officedocument.wordprocessingml.footnotes+xml",
+        "application/vnd.openxmlformats-package.core-properties+xml",
+    }
+
+    def __init__(self, template_path: str = "pyinvoice.docx",
+                 compresslevel: int = DOCX_COMPRESSION_LEVEL):
+        if not 0 <= compresslevel <= 9:
+            raise ValueError("Compression level must be between 0 and 9")
+        self.template_path = template_path
+        self.compresslevel = compresslevel
+        self._static = {}
+        with zipfile.ZipFile(template_path) as template:
+            for info in template.infolist():
+                self._static["/" + info.filename] = self._compress(template.read(info))
+
+    def _compress(self, data: bytes) -> tuple:
+        return compress_zip_member(data, self.compresslevel)
+
+    def _members(self, doc):
+        package = doc.docx.part.package
+        parts = list(package.iter_parts())
+        yield "[Content_Types].xml", self._compress(content_types_xml(parts))
+        yield "_rels/.rels", self._compress(package.rels.xml)
+        for part in parts:
+            partname = str(part.partname)
+            if partname in self._static and part.content_type not in self.RENDERED_CONTENT_TYPES:
+                yield partname[1:], self._static[partname]
+            elif part.content_type.startswith("image/"):
+                # Embedded images are already compressed
+                yield partname[1:], compress_zip_member(part.blob, 0)
+            else:
+                yield partname[1:], self._compress(part.blob)
+            if len(part.rels):
+                yield part.partname.rels_uri[1:], self._compress(part.rels.xml)
+
+    def write(self, doc, f) -> None:
+        """Write a rendered document as a .docx zip to a binary file object"""
+        write_zip_members(f, self._members(doc))
+
+    def save(self, doc, filename: str) -> None:
+        """Save a rendered document, falling back to docxtpl when it must post-process"""
+        if (not doc.is_rendered or doc.pics_to_replace or doc.crc_to_new_media
+                or doc.crc_to_new_embedded or doc.zipname_to_replace):
+            doc.save(filename)
+            return
+        with open(filename, "wb") as f:
+            self.write(doc, f)
+
+_docx_writers = {}
+
+def get_docx_writer(template_path: str = "pyinvoice.docx") -> PrecompressedDocxWriter:
+    """Return a cached writer for the template at the configured compression level"""
+    level = int(current_settings().get("docx_compression_level", DOCX_COMPRESSION_LEVEL))
+    key = (template_path, level)
+    if key not in _docx_writers:
+        _docx_writers[key] = PrecompressedDocxWriter(template_path, level)
+    return _docx_writers[key]
+
+# --- Invoice Images ---
+IMAGE_CACHE_DIR = "image_cache"
+IMAGE_MEMORY_CACHE_SIZE = 32
+IMAGE_DPI = 300
+
+def _mm_to_pixels(mm: float) -> int:
+    return max(1, round(mm / 25.4 * IMAGE_DPI))
+
+class ImageCache:
+    """Pre-scaled PNGs keyed by source hash and target size, in memory and on disk.
+
+    Decoding, resizing and re-encoding happen once per source and size; bulk
+    runs then only copy the finished bytes into each document. Source files
+    are hashed once per (path, mtime, size), so an edited logo is picked up.
+    QR codes are usually unique per invoice, so they are kept in a separate
+    memory LRU and never written to disk.
+    """
+
+    def __init__(self, directory: str = IMAGE_CACHE_DIR, size: int = IMAGE_MEMORY_CACHE_SIZE):
+        self.directory = directory
+        self.size = size
+        self.processed = 0
+        self._memory = OrderedDict()
+        self._transient = OrderedDict()
+        self._file_hashes = {}
+        self._lock = threading.Lock()
+
+    def scaled_image(self, path: str, width_px: int) -> bytes:
+        """PNG of an image file, shrunk to width_px if it is wider"""
+        stat = os.stat(path)
+        file_key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            source_hash = self._file_hashes.get(file_key)
+        if source_hash is None:
+            with open(path, "rb") as f:
+                source_hash = hashlib.sha1(f.read()).hexdigest()
+            with self._lock:
+                self._file_hashes[file_key] = source_hash
+
+        def build():
+            with Image.open(path) as image:
+                image.load()
+                if image.mode not in ("RGB", "RGBA", "L", "LA"):
+                    image = image.convert("RGBA")
+                if image.width > width_px:
+                    height = max(1, round(image.height * width_px / image.width))
+                    image = image.resize((width_px, height), Image.LANCZOS)
+                return image
+        return self._get(f"{source_hash}_{width_px}", build)
+
+    def qr_code(self, payload: str, width_px: int) -> bytes:
+        """PNG QR code for a payload, scaled to width_px; needs the qrcode package"""
+        if qrcode is None:
+            raise RuntimeError("Install the qrcode package to embed payment QR codes")
+
+        def build():
+            code = qrcode.QRCode(border=2)
+            code.add_data(payload)
+            code.make(fit=True)
+            image = code.make_image().get_image().convert("L")
+            return image.resize((width_px, width_px), Image.NEAREST)
+        return self._get((payload, width_px), build, persist=False)
+
+    def _build(self, build: Callable[[], Any]) -> bytes:
+        buffer = io.BytesIO()
+        build().save(buffer, "PNG")
+        with self._lock:
+            self.processed += 1
+        return buffer.getvalue()
+
+    def _get(self, key, build: Callable[[], Any], persist: bool = True) -> bytes:
+        memory = self._memory if persist else self._transient
+        with self._lock:
+            if key in memory:
+                memory.move_to_end(key)
+                return memory[key]
+        if not persist:
+            data = self._build(build)
+        else:
+            path = os.path.join(self.directory, key + ".png")
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+            except FileNotFoundError:
+                data = self._build(build)
+                os.makedirs(self.directory, exist_ok=True)
+                fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+                try:
+                    with os.fdopen(fd, "wb") as f:
+                        f.write(data)
+                    os.chmod(temp_path, NEW_FILE_MODE)
+                    os.replace(temp_path, path)
+                except BaseException:
+                    if os.path.exists(temp_path):
+                        os.remove(temp_path)
+                    raise
+        with self._lock:
+            memory[key] = data
+            while len(memory) > self.size:
+                memory.popitem(last=False)
+        return data
+
+_image_cache = None
+
+def get_image_cache() -> ImageCache:
+    """Return the shared image cache"""
+    global _image_cache
+    if _image_cache is None:
+        _image_cache = ImageCache()
+    return _image_cache
+
+_template_variables = {}
+
+def invoice_image_names(template_path: str = "pyinvoice.docx") -> List[str]:
+    """Image placeholders the template uses that are configured in the settings"""
+    if template_path not in _template_variables:
+        _template_variables[template_path] = DocxTemplate(template_path).get_undeclared_template_variables()
+    settings = current_settings()
+    configured = []
+    if settings.get("logo_path"):
+        configured.append("logo")
+    if settings.get("payment_qr_template"):
+        configured.append("payment_qr")
+    return [name for name in configured if name in _template_variables[template_path]]
+
+def invoice_images(doc: DocxTemplate, context: Dict[str, Any], names: List[str]) -> Dict[str, InlineImage]:
+    """InlineImages for the given placeholders, built from cached pre-scaled PNGs"""
+    settings = current_settings()
+    cache = get_image_cache()
+    images = {}
+    if "logo" in names:
+        width = float(settings.get("logo_width_mm", 40))
+        data = cache.scaled_image(settings["logo_path"], _mm_to_pixels(width))
+        images["logo"] = InlineImage(doc, io.BytesIO(data), width=Mm(width))
+    if "payment_qr" in names:
+        width = float(settings.get("payment_qr_width_mm", 25))
+        try:
+            payload = settings["payment_qr_template"].format(**context)
+        except (KeyError, IndexError, ValueError) as e:
+            raise ValueError(f"payment_qr_template in {SETTINGS_FILE} is invalid ({e!r}); "
+                             f"use fields such as {{invoice_number}} or {{total}}") from None
+        images["payment_qr"] = InlineImage(doc, io.BytesIO(cache.qr_code(payload, _mm_to_pixels(width))),
+                                           width=Mm(width))
+    return images
+
+# --- Compiled Template Renderer ---
+# Slot markers used while compiling; private-use characters never occur in real data
+_SLOT_OPEN, _SLOT_CLOSE = "\ue000", "\ue001"
+_SLOT_MARKER = re.compile(f"{_SLOT_OPEN}([^{_SLOT_OPEN}{_SLOT_CLOSE}]*){_SLOT_CLOSE}")
+_EMPTY_ELEMENT = re.compile(r"<([^\s<>/!?]+)((?:\s[^<>]*)?)></\1>")
+_OPEN_TAG_AT_END = re.compile(r"<([^\s<>/!?]+)(?:\s[^<>]*)?(?<!/)>$")
+_LENIENT_WHITESPACE = re.compile("[\t\n\r\x0b\x0c]")
+_LENIENT_DROP = re.compile("[\x00-\x1f\ue000\ue001]")
+_FAST_PATH_UNSAFE = re.compile("[\x00-\x1f\ue000\ue001]|\\{_[{%]|[}%]_\\}")
+
+class _SlotRow:
+    """Stand-in line item whose fields render as row slot markers"""
+
+    def __getitem__(self, index):
+        if not isinstance(index, int) or isinstance(index, bool):
+            raise TypeError("Only integer indexes are supported")
+        return f"{_SLOT_OPEN}#{index}{_SLOT_CLOSE}"
+
+class CompiledDocxTemplate:
+    """Fast-path renderer for templates made of plain placeholders and one row loop.
+
+    The template is rendered once through docxtpl with marker values, and the
+    resulting document.xml is cut into static text and slots. Rendering an
+    invoice is then a join of escaped values; every other member of the
+    document is the same for all invoices and is compressed only once.
+    compile() returns None for templates it cannot handle, and render()
+    returns None for values that need docxtpl (control characters, etc.).
+    """
+
+    def __init__(self, members: list, document_name: str, prefix: list, row: list,
+                 suffix: list, names: List[str], loop_name: Optional[str],
+                 compresslevel: int = DOCX_COMPRESSION_LEVEL):
+        self.members = members
+        self.document_name = document_name
+        self.prefix = prefix
+        self.row = row
+        self.suffix = suffix
+        self.names = names
+        self.loop_name = loop_name
+        self.compresslevel = compresslevel
+
+    @staticmethod
+    def _analyze(ast) -> Optional[tuple]:
+        """Return (names, loop name) if the template only uses supported constructs"""
+        names, loop_name, loop_target = [], None, None
+
+        def output_ok(node, in_loop):
+            for child in node.nodes:
+                if isinstance(child, nodes.TemplateData):
+                    continue
+                if isinstance(child, nodes.Name) and child.name != loop_target:
+                    if child.name not in names:
+                        names.append(child.name)
+                elif (in_loop and isinstance(child, nodes.Getitem)
+                      and isinstance(child.node, nodes.Name) and child.node.name == loop_target
+                      and isinstance(child.arg, nodes.Const) and type(child.arg.value) is int):
+                    continue
+                else:
+                    return False
+            return True
+
+        for node in ast.body:
+            if isinstance(node, nodes.Output):
+                if not output_ok(node, False):
+                    return None
+            elif isinstance(node, nodes.For) and loop_name is None:
+                if (not isinstance(node.target, nodes.Name) or not isinstance(node.iter, nodes.Name)
+                        or node.else_ or node.test is not None or node.recursive):
+                    return None
+                loop_name, loop_target = node.iter.name, node.target.name
+                for child in node.body:
+                    if not isinstance(child, nodes.Output) or not output_ok(child, True):
+                        return None
+                loop_target = None
+            else:
+                return None
+        return names, loop_name
+
+    @staticmethod
+    def _split(xml: str) -> Optional[list]:
+        """Split XML into alternating static text and (slot, open tag, close tag).
+
+        When a slot is the only content of an element its tags are kept with
+        the slot, so a blank value can be written self-closing like lxml does.
+        """
+        pieces, position = [], 0
+        for match in _SLOT_MARKER.finditer(xml):
+            # Slots must sit in text content, not inside a tag or attribute
+            if xml.rfind("<", 0, match.start()) > xml.rfind(">", 0, match.start()):
+                return None
+            key = match.group(1)
+            key = int(key[1:]) if key.startswith("#") else key
+            pieces.append(xml[position:match.start()])
+            pieces.append((key, "", ""))
+            position = match.end()
+        pieces.append(xml[position:])
+        for i in range(1, len(pieces), 2):
+            open_tag = _OPEN_TAG_AT_END.search(pieces[i - 1])
+            if open_tag:
+                close_tag = f"</{open_tag.group(1)}>"
+                if pieces[i + 1].startswith(close_tag):
+                    pieces[i - 1] = pieces[i - 1][:open_tag.start()]
+                    pieces[i + 1] = pieces[i + 1][len(close_tag):]
+                    pieces[i] = (pieces[i][0], open_tag.group(0), close_tag)
+        return pieces
+
+    @classmethod
+    def compile(cls, template_path: str = "pyinvoice.docx",
+                compresslevel: int = DOCX_COMPRESSION_LEVEL) -> Optional["CompiledDocxTemplate"]:
+        """Analyze a template once; returns None if it needs the full docxtpl pipeline"""
+        doc = DocxTemplate(template_path)
+        doc.init_docx()
+        analysis = cls._analyze(Environment().parse(doc.patch_xml(doc.get_xml())))
+        if analysis is None:
+            return None
+        names, loop_name = analysis
+        document_name = str(doc.docx.part.partname)[1:]
+
+        def probe(rows):
+            context = {name: f"{_SLOT_OPEN}{name}{_SLOT_CLOSE}" for name in names}
+            if loop_name:
+                context[loop_name] = [_SlotRow()] * rows
+            probe_doc = DocxTemplate(template_path)
+            probe_doc.render(context, autoescape=True)
+            buffer = io.BytesIO()
+            probe_doc.save(buffer)
+            with zipfile.ZipFile(buffer) as package:
+                return [(info.filename, package.read(info)) for info in package.infolist()]
+
+        members = probe(1)
+        for name, data in members:
+            if name != document_name and _SLOT_OPEN.encode("utf-8") in data:
+                return None  # Placeholders outside the body are left to docxtpl
+        xml = dict(members)[document_name].decode("utf-8")
+
+        prefix, row, suffix = xml, "", ""
+        if loop_name:
+            first, last = xml.find(_SLOT_OPEN + "#"), xml.rfind(_SLOT_OPEN + "#")
+            starts = [m.start() for m in re.finditer(r"<w:tr[ >]", xml[:max(first, 0)])]
+            end = xml.find("</w:tr>", last)
+            if first < 0 or not starts or end < 0:
+                return None
+            end += len("</w:tr>")
+            prefix, row, suffix = xml[:starts[-1]], xml[starts[-1]:end], xml[end:]
+            # The loop must expand to exactly one copy of the row per item
+            empty = dict(probe(0))[document_name].decode("utf-8")
+            double = dict(probe(2))[document_name].decode("utf-8")
+            if (empty != prefix + suffix or double != prefix + row + row + suffix
+                    or _SLOT_OPEN + "#" in prefix + suffix):
+                return None
+
+        pieces = [cls._split(part) for part in (prefix, row, suffix)]
+        if None in pieces:
+            return None
+        static_members = [(name, compress_zip_member(data, compresslevel))
+                          for name, data in members if name != document_name]
+        member_names = [name for name, _data in members]
+        return cls(static_members + [(document_name, None)], document_name, *pieces,
+                   names, loop_name, compresslevel)._order(member_names)
+
+    def _order(self, member_names: List[str]) -> "CompiledDocxTemplate":
+        by_name = dict(self.members)
+        self.members = [(name, by_name[name]) for name in member_names]
+        return self
+
+    @staticmethod
+    def _escape(value, lenient: bool = False) -> Optional[str]:
+        text = str(value)
+        if _FAST_PATH_UNSAFE.search(text):
+            if not lenient:
+                return None
+            # Streaming mode flattens what docxtpl would turn into extra markup
+            text = _LENIENT_WHITESPACE.sub(" ", text)
+            text = _LENIENT_DROP.sub("", text)
+            text = text.replace("{_{", "{{").replace("}_}", "}}").replace("{_%", "{%").replace("%_}", "%}")
+        return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+    def _values(self, context: Dict[str, Any], lenient: bool = False) -> Optional[Dict[str, str]]:
+        values = {}
+        for name in self.names:
+            value = self._escape(context[name], lenient) if name in context else ""
+            if value is None:
+                return None
+            values[name] = value
+        return values
+
+    def _segment(self, pieces: list, values: Dict[str, str], item=None,
+                 lenient: bool = False) -> Optional[str]:
+        """Render one segment (prefix, a single row or suffix) to XML text"""
+        out = []
+        needs_cleanup = False
+        for i, piece in enumerate(pieces):
+            if i % 2 == 0:
+                out.append(piece)
+                continue
+            key, open_tag, close_tag = piece
+            if type(key) is int:
+                try:
+                    value = self._escape(item[key], lenient)
+                except (IndexError, KeyError, TypeError):
+                    value = ""
+                if value is None:
+                    return None
+            else:
+                value = values[key]
+            if value:
+                out.append(open_tag)
+                out.append(value)
+                out.append(close_tag)
+            elif open_tag:
+                # lxml writes an element left empty as self-closing
+                out.append(open_tag[:-1] + "/>")
+            else:
+                needs_cleanup = True
+        xml = "".join(out)
+        if needs_cleanup:
+            xml = _EMPTY_ELEMENT.sub(r"<\1\2/>", xml)
+        return xml
+
+    def render_document_xml(self, context: Dict[str, Any]) -> Optional[bytes]:
+        """Render document.xml for a context, or None if docxtpl must handle it"""
+        values = self._values(context)
+        if values is None:
+            return None
+        segments = [self._segment(self.prefix, values)]
+        for item in context.get(self.loop_name) or []:
+            segments.append(self._segment(self.row, values, item))
+        segments.append(self._segment(self.suffix, values))
+        if None in segments:
+            return None
+        return "".join(segments).encode("utf-8")
+
+    def render(self, context: Dict[str, Any]) -> Optional[bytes]:
+        """Render a complete .docx, or None if docxtpl must handle this context"""
+        document_xml = self.render_document_xml(context)
+        if document_xml is None:
+            return None
+        buffer = io.BytesIO()
+        write_zip_members(buffer, (
+            (name, member if member is not None else compress_zip_member(document_xml, self.compresslevel))
+            for name, member in self.members
+        ))
+        return buffer.getvalue()
+
+    def write_streaming(self, f, context: Dict[str, Any], rows: Iterable,
+                        chunk_rows: int = 256) -> int:
+        """Stream a .docx with any number of line items to a binary file.
+
+        Rows are pulled from the iterable, rendered and compressed a chunk at
+        a time, so memory stays flat however many lines the invoice has.
+        Values docxtpl would expand into extra markup are flattened instead.
+        Returns the number of rows written.
+        """
+        values = self._values(context, lenient=True)
+        written = 0
+
+        def document_chunks():
+            nonlocal written
+            yield self._segment(self.prefix, values).encode("utf-8")
+            batch = []
+            for item in rows:
+                batch.append(self._segment(self.row, values, item, lenient=True))
+                if len(batch) >= chunk_rows:
+                    written += len(batch)
+                    yield "".join(batch).encode("utf-8")
+                    batch.clear()
+            written += len(batch)
+            yield "".join(batch).encode("utf-8")
+            yield self._segment(self.suffix, values).encode("utf-8")
+
+        write_zip_members(f, (
+            (name, member if member is not None else document_chunks())
+            for name, member in self.members
+        ), self.compresslevel)
+        return written
+
+_compiled_templates = {}
+
+def get_compiled_template(template_path: str = "pyinvoice.docx") -> Optional[CompiledDocxTemplate]:
+    """Return the compiled fast-path renderer for a template, if enabled and supported"""
+    settings = current_settings()
+    if not settings.get("compiled_renderer", True):
+        return None
+    level = int(settings.get("docx_compression_level", DOCX_COMPRESSION_LEVEL))
+    key = (template_path, level)
+    if key not in _compiled_templates:
+        _compiled_templates[key] = CompiledDocxTemplate.compile(template_path, level)
+    return _compiled_templates[key]
+
+# Invoices with at least this many lines are streamed instead of rendered in memory
+LARGE_INVOICE_LINES = 1000
+
+def group_invoice_lines(rows: Iterable) -> Iterator[list]:
+    """Merge lines with the same description and unit price, summing quantities.
+
+    Memory grows with the number of distinct lines, not the number of rows.
+    """
+    groups = {}
+    for qty, desc, price, line_total, *_ in rows:
+        key = (desc, price)
+        if key in groups:
+            groups[key][0] += qty
+            groups[key][3] = round(groups[key][3] + line_total, 2)
+        else:
+            groups[key] = [qty, desc, price, line_total]
+    yield from groups.values()
+
+def paginate_invoice_lines(rows: Iterable, page_size: int) -> Iterator[list]:
+    """Insert a carried-forward subtotal line after every page_size lines"""
+    running_total = 0.0
+    for count, row in enumerate(rows, start=1):
+        running_total = round(running_total + row[3], 2)
+        yield row
+        if count % page_size == 0:
+            yield ["", f"Subtotal carried forward (lines 1-{count})", "", running_total]
+
+def render_invoice_document(context: Dict[str, Any], template_path: str = "pyinvoice.docx"):
+    """Render an invoice through the compiled fast path when possible.
+
+    Returns the finished .docx bytes from the fast path, or a rendered
+    DocxTemplate when the template or context needs the full pipeline.
+    """
+    image_names = invoice_image_names(template_path)
+    compiled = None if image_names else get_compiled_template(template_path)
+    if compiled is not None:
+        data = compiled.render(context)
+        if data is not None:
+            return data
+    doc = DocxTemplate(template_path)
+    if image_names:
+        context = dict(context, **invoice_images(doc, context, image_names))
+    doc.render(context, autoescape=True)
+    return doc
+
+def save_invoice_document(context: Dict[str, Any], filename: str,
+                          template_path: str = "pyinvoice.docx",
+                          group_lines: bool = False, page_size: int = 0) -> tuple:
+    """Render an invoice into the output store and return (path, size).
+
+    Large invoices are streamed row by row, optionally grouped and
+    paginated; smaller ones use the compiled renderer or docxtpl.
+    """
+    store = get_output_store()
+    # Images need docxtpl, so such invoices are not streamed
+    compiled = None if invoice_image_names(template_path) else get_compiled_template(template_path)
+    rows = context.get("invoice_list") or []
+    if compiled is not None and compiled.loop_name == "invoice_list" and (
+            group_lines or page_size or not isinstance(rows, list) or len(rows) >= LARGE_INVOICE_LINES):
+        if group_lines:
+            rows = group_invoice_lines(rows)
+        if page_size:
+            rows = paginate_invoice_lines(rows, page_size)
+        return store.write_with(filename, lambda f: compiled.write_streaming(f, context, rows))
+    rendered = render_invoice_document(context, template_path)
+    if isinstance(rendered, bytes):
+        return store.write_bytes(filename, rendered)
+    return store.save_document(rendered, filename, writer=get_docx_writer(template_path))
+
+_output_store = None
+
+def get_output_store() -> OutputStore:
+    """Return the shared document output store"""
+    global _output_store
+    if _output_store is None:
+        _output_store = OutputStore()
+    return _output_store
+
+# --- Tax Rules ---
+class TaxEngine:
+    """Tax rules compiled into one effective rate per (region, category).
+
+    A rule names a tax (e.g. GST) with a rate in percent for a region and/or
+    category, where '' matches any. For each tax the most specific rule
+    wins, and compound taxes apply to the base plus the taxes before them in
+    priority order. Exemptions zero out a region, a category or a pair.
+    Each pair is resolved once and memoized, so taxing a line is a
+    dictionary lookup and a multiplication.
+    """
+
+    def __init__(self, rules: Iterable[tuple] = (), exemptions: Iterable[tuple] = ()):
+        self._rules = {}
+        for region, category, name, rate, compound, priority in rules:
+            scope = self._rules.setdefault((region or "", category or ""), {})
+            scope[name] = (priority, float(rate), bool(compound))
+        self._exempt = {(region or "", category or "") for region, category in exemptions}
+        self._rates = {}
+
+    @classmethod
+    def load(cls, conn: sqlite3.Connection) -> "TaxEngine":
+        """Compile the tax_rules and tax_exemptions tables"""
+        return cls(conn.execute("SELECT region, category, name, rate, compound, priority FROM tax_rules"),
+                   conn.execute("SELECT region, category FROM tax_exemptions"))
+
+    def regions(self) -> List[str]:
+        """Regions that have rules of their own"""
+        return sorted({region for region, _ in self._rules if region})
+
+    def has_rules(self) -> bool:
+        return bool(self._rules)
+
+    def rate_for(self, region: str, category: str = "") -> float:
+        """Effective tax rate in percent for a region and category"""
+        key = (region or "", category or "")
+        rate = self._rates.get(key)
+        if rate is None:
+            rate = self._rates[key] = self._resolve(*key)
+        return rate
+
+    def _resolve(self, region: str, category: str) -> float:
+        if {(region, category), (region, ""), ("", category)} & self._exempt:
+            return 0.0
+        taxes = {}
+        for scope in (("", ""), ("", category), (region, ""), (region, category)):
+            taxes.update(self._rules.get(scope, {}))
+        gross = 1.0  # Base plus the taxes applied so far, per unit of base
+        for priority, rate, compound in sorted(taxes.values()):
+            gross += rate / 100 * (gross if compound else 1.0)
+        return (gross - 1.0) * 100
+
+    def line_taxes(self, rows: Iterable, region: str) -> List[float]:
+        """Unrounded tax of each [qty, desc, price, total, category] row"""
+        rates = {}
+        taxes = []
+        for row in rows:
+            category = row[4] if len(row) > 4 else ""
+            rate = rates.get(category)
+            if rate is None:
+                rate = rates[category] = self.rate_for(region, category) / 100
+            taxes.append(row[3] * rate)
+        return taxes
+
+# Labels of the tax region menu entries that are not regions
+FLAT_TAX_RATE = "Flat rate"
+ANY_TAX_REGION = "Any region"
+
+_tax_engine = None
+
+def get_tax_engine() -> TaxEngine:
+    """Return the compiled tax rules, loading them on first use"""
+    global _tax_engine
+    if _tax_engine is None:
+        conn = connect_database()
+        try:
+            _tax_engine = TaxEngine.load(conn)
+        finally:
+            conn.close()
+    return _tax_engine
+
+def invalidate_tax_engine() -> None:
+    """Recompile the tax rules on next use after they changed"""
+    global _tax_engine
+    _tax_engine = None
+
+def calculate_invoice_tax(invoice_list: list, tax_rate: float, region: Optional[str] = None) -> tuple:
+    """Return (rounded line taxes, tax amount, effective rate in percent).
+
+    Without a region the flat tax_rate applies to every line; with one
+    (possibly '' for rules that apply everywhere) the tax rules decide.
+    """
+    subtotal = sum(item[3] for item in invoice_list)
+    if region is None:
+        line_taxes = [round(item[3] * tax_rate / 100, 2) for item in invoice_list]
+        return line_taxes, round(subtotal * (tax_rate / 100), 2), tax_rate
+    line_taxes = get_tax_engine().line_taxes(invoice_list, region)
+    tax_amount = round(sum(line_taxes), 2)
+    effective_rate = round(tax_amount / subtotal * 100, 2) if subtotal else 0.0
+    return [round(tax, 2) for tax in line_taxes], tax_amount, effective_rate
+
+# --- Invoice Creation ---
+def build_invoice_context(invoice_number: str, name: str, phone: str, email: str,
+                          invoice_list: list, tax_rate: float, admin_name: str,
+                          date: Optional[datetime.date] = None,
+                          region: Optional[str] = None) -> Dict[str, Any]:
+    """Build the template context for an invoice, computing its totals"""
+    subtotal = sum(item[3] for item in invoice_list)
+    line_taxes, tax_amount, tax_rate = calculate_invoice_tax(invoice_list, tax_rate, region)
+    return {
+        "admin_name": admin_name,
+        "company_name": "Your Company",
+        "company_address": "123 Business St",
+        "company_phone": "123-456-7890",
+        "invoice_number": invoice_number,
+        "name": name,
+        "phone": phone,
+        "email": email,
+        "invoice_list": invoice_list,
+        "line_taxes": line_taxes,
+        "tax_region": region,
+        "subtotal": subtotal,
+        "tax": tax_amount,
+        "tax_rate": tax_rate,
+        "total": round(subtotal + tax_amount, 2),
+        "date": (date or datetime.date.today()).strftime("%Y-%m-%d")
+    }
+
+def insert_invoice(cursor: sqlite3.Cursor, context: Dict[str, Any], status: str) -> tuple:
+    """Insert an invoice and its line items, returning (invoice id, date created).
+
+    An invoice created Paid gets a payment for its total, like one paid later.
+    """
+    customer_id = upsert_customer(cursor, context["name"], context["email"], context["phone"])
+    cursor.execute("""
+        INSERT INTO invoices (
+            invoice_number, customer_name, customer_email, customer_phone,
+            total_amount, tax_rate, tax_amount, subtotal,
+            created_by, status, tax_region, customer_id
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (
+        context["invoice_number"],
+        context["name"],
+        context["email"],
+        context["phone"],
+        context["total"],
+        context["tax_rate"],
+        context["tax"],
+        context["subtotal"],
+        context["admin_name"],
+        status,
+        context.get("tax_region"),
+        customer_id
+    ))
+    
+    invoice_id = cursor.lastrowid
+    if status == "Paid" and context["total"] > PAYMENT_TOLERANCE:
+        _apply_payment(cursor, invoice_id, status, context["total"], 0.0, context["total"],
+                       datetime.date.fromisoformat(context["date"]), "Paid on creation", "",
+                       context["admin_name"])
+    
+    # Save invoice items with their own tax
+    line_taxes = context.get("line_taxes") or [0.0] * len(context["invoice_list"])
+    cursor.executemany("""
+        INSERT INTO invoice_items (
+            invoice_id, description, quantity, unit_price, total_price, category, tax_amount
+        ) VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, [(invoice_id, item[1], item[0], item[2], item[3], item[4] if len(item) > 4 else "", tax)
+          for item, tax in zip(context["invoice_list"], line_taxes)])
+    date_created = cursor.execute("SELECT date_created FROM invoices WHERE id = ?",
+                                  (invoice_id,)).fetchone()[0]
+    return invoice_id, date_created
+
+def store_invoice_document(invoice_id: int, context: Dict[str, Any], customer_label: str) -> str:
+    """Render a committed invoice into the output store and record its path"""
+    # Large invoices may be grouped and paginated as configured
+    settings = current_settings()
+    large = len(context["invoice_list"]) >= LARGE_INVOICE_LINES
+    
+    # Format customer name for filename (remove special characters)
+    customer_label = "".join(c for c in customer_label if c.isalnum() or c == '_')
+    doc_name = f"INV_{context['invoice_number']}_{customer_label}.docx"
+    doc_path, doc_size = save_invoice_document(
+        context, doc_name,
+        group_lines=large and settings.get("large_invoice_group_lines", False),
+        page_size=int(settings.get("large_invoice_page_size", 0)) if large else 0)
+    get_db_writer().submit(lambda cursor: cursor.execute("""
+        UPDATE invoices SET document_path = ?, document_size = ?
+        WHERE id = ?
+    """, (doc_path, doc_size, invoice_id))).result()
+    get_invoice_details_cache().invalidate(context["invoice_number"])
+    return doc_path
+
+# --- Customer Statements ---
+STATEMENT_TEMPLATE = "pystatement.docx"
+STATEMENT_COLUMNS = ("DATE", "INVOICE", "DESCRIPTION", "QTY", "UNIT PRICE", "AMOUNT")
+# One query returns every invoice line of the period, already grouped by
+# customer and invoice, so statements are built in a single pass
+STATEMENT_QUERY = """
+    SELECT c.id, c.name, c.email, c.phone,
+           i.id, i.invoice_number, i.date_created, i.status, i.tax_amount, i.total_amount,
+           it.description, it.quantity, it.unit_price, it.total_price
+    FROM invoices i
+    JOIN customers c ON c.id = i.customer_id
+    LEFT JOIN invoice_items it ON it.invoice_id = i.id
+    WHERE i.date_created >= ? AND i.date_created < date(?, '+1 day') {customer_filter}
+    ORDER BY c.id, i.date_created, i.id, it.id
+"""
+
+def iter_customer_statements(conn: sqlite3.Connection, date_from: datetime.date, date_to: datetime.date,
+                             customer_ids: Optional[List[int]] = None) -> Iterator[Dict[str, Any]]:
+    """Stream each customer's invoices and line items for a period.
+
+    Rows come from one ordered query and are grouped as they arrive, so only
+    the current customer is held in memory.
+    """
+    params = [date_from.isoformat(), date_to.isoformat()]
+    customer_filter = ""
+    if customer_ids:
+        customer_filter = f"AND i.customer_id IN ({', '.join('?' for _ in customer_ids)})"
+        params.extend(customer_ids)
+    cursor = conn.execute(STATEMENT_QUERY.format(customer_filter=customer_filter), params)
+    for customer_id, customer_rows in itertools.groupby(cursor, key=operator.itemgetter(0)):
+        invoices = []
+        for _invoice_id, invoice_rows in itertools.groupby(customer_rows, key=operator.itemgetter(4)):
+            items = []
+            for row in invoice_rows:
+                if row[10] is not None:
+                    items.append(row[10:])
+            invoices.append({"number": row[5], "date": row[6], "status": row[7],
+                             "tax": row[8], "total": row[9], "items": items})
+        yield {"id": customer_id, "name": row[1], "email": row[2], "phone": row[3], "invoices": invoices}
+
+def build_statement_context(statement: Dict[str, Any], date_from: datetime.date,
+                            date_to: datetime.date) -> Dict[str, Any]:
+    """Flatten a customer's invoices into statement rows; Void invoices are listed but not totalled"""
+    lines = []
+    for invoice in statement["invoices"]:
+        first = len(lines)
+        for description, quantity, unit_price, total_price in invoice["items"]:
+            lines.append(["", "", description, quantity, f"{unit_price:.2f}", f"{total_price:.2f}"])
+        if invoice["tax"]:
+            lines.append(["", "", "Tax", "", "", f"{invoice['tax']:.2f}"])
+        lines.append(["", "", f"Invoice total ({invoice['status']})", "", "", f"{invoice['total']:.2f}"])
+        lines[first][0], lines[first][1] = invoice["date"][:10], invoice["number"]
+    return {
+        "company_name": "Your Company",
+        "company_address": "123 Business St",
+        "company_phone": "123-456-7890",
+        "name": statement["name"],
+        "email": statement["email"] or "",
+        "phone": statement["phone"] or "",
+        "period_start": date_from.isoformat(),
+        "period_end": date_to.isoformat(),
+        "date": datetime.date.today().strftime("%Y-%m-%d"),
+        "lines": lines,
+        "invoice_count": len(statement["invoices"]),
+        "total": f"{sum(invoice['total'] for invoice in statement['invoices'] if invoice['status'] != 'Void'):.2f}",
+    }
+
+@profiled("generate_statements")
+def generate_statements(date_from: datetime.date, date_to: datetime.date,
+                        customer_ids: Optional[List[int]] = None, workers: int = 1,
+                        template_path: str = STATEMENT_TEMPLATE,
+                        progress: Optional[Callable[[int], None]] = None) -> Dict[str, Any]:
+    """Render one statement per customer with invoices in the period.
+
+    Statements are rendered on up to workers threads while the query keeps
+    streaming; at most twice that many wait, so memory stays bounded however
+    many customers there are. Returns counts, timing and the paths written.
+    """
+    if not os.path.exists(template_path):
+        raise FileNotFoundError(f"Statement template {template_path} not found; "
+                                f"restore {STATEMENT_TEMPLATE} or pass --template")
+    start = time.perf_counter()
+    paths, invoices = [], 0
+    conn = connect_database()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="Statement") as pool:
+            pending = deque()
+
+            def collect():
+                path, _size = pending.popleft().result()
+                paths.append(path)
+                if progress is not None:
+                    progress(len(paths))
+
+            for statement in iter_customer_statements(conn, date_from, date_to, customer_ids):
+                invoices += len(statement["invoices"])
+                label = "".join(c for c in statement["name"] if c.isalnum() or c == "_")
+                filename = f"STATEMENT_{date_from:%Y%m%d}_{date_to:%Y%m%d}_{statement['id']}_{label}.docx"
+                context = build_statement_context(statement, date_from, date_to)
+                pending.append(pool.submit(save_invoice_document, context, filename, template_path))
+                while len(pending) > 2 * max(1, workers):
+                    collect()
+            while pending:
+                collect()
+    finally:
+        conn.close()
+    return {"statements": len(paths), "invoices": invoices,
+            "seconds": time.perf_counter() - start, "paths": paths}
+
+# --- Receivables ---
+INVOICE_STATUSES = ("Draft", "Sent", "Paid", "Overdue", "Void")
+# Unpaid invoices sent to the customer; must match the idx_invoices_open predicate
+OPEN_INVOICE_STATUSES = ("Sent", "Overdue")
+INVOICE_STATUS_TRANSITIONS = {
+    "Draft": ("Sent", "Paid", "Void"),
+    "Sent": ("Paid", "Overdue", "Void"),
+    "Overdue": ("Paid", "Void"),
+    "Paid": (),
+    "Void": (),
+}
+AGING_BUCKETS = ("0-30", "31-60", "61-90", "90+")
+PAYMENT_TERMS_DAYS = 30
+PAYMENT_TOLERANCE = 0.005
+
+def default_invoice_status() -> str:
+    """Status new invoices start with unless one is picked"""
+    status = current_settings().get("default_invoice_status", "Paid")
+    return status if status in ("Paid", "Sent", "Draft") else "Paid"
+
+def _live_invoice(cursor: sqlite3.Cursor, invoice_number: str) -> tuple:
+    row = cursor.execute("""
+        SELECT id, status, total_amount, amount_paid FROM invoices WHERE invoice_number = ?
+    """, (invoice_number,)).fetchone()
+    if row is None:
+        raise ValueError(f"Invoice {invoice_number} not found (archived invoices are closed)")
+    return row
+
+def _apply_payment(cursor: sqlite3.Cursor, invoice_id: int, status: str, total: float, paid: float,
+                   amount: float, paid_on: datetime.date, method: str, reference: str,
+                   recorded_by: str) -> str:
+    cursor.execute("""
+        INSERT INTO payments (invoice_id, amount, paid_on, method, reference, recorded_by)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (invoice_id, amount, paid_on.isoformat(), method, reference, recorded_by))
+    paid = round(paid + amount, 2)
+    if paid >= total - PAYMENT_TOLERANCE:
+        status = "Paid"
+    elif status == "Draft":
+        status = "Sent"  # A customer paying part of a draft has received it
+    cursor.execute("UPDATE invoices SET amount_paid = ?, status = ? WHERE id = ?", (paid, status, invoice_id))
+    return status
+
+def record_payment(invoice_number: str, amount: float, paid_on: Optional[datetime.date] = None,
+                   method: str = "", reference: str = "", recorded_by: str = "") -> tuple:
+    """Record a payment against an invoice and return (status, outstanding).
+
+    A payment that settles the balance marks the invoice Paid; paying more
+    than is outstanding, or paying a Paid or Void invoice, is a ValueError.
+    """
+    if amount <= 0:
+        raise ValueError("Payment amount must be greater than 0")
+
+    def pay(cursor):
+        invoice_id, status, total, paid = _live_invoice(cursor, invoice_number)
+        if status in ("Paid", "Void"):
+            raise ValueError(f"Invoice {invoice_number} is {status}")
+        if amount > total - paid + PAYMENT_TOLERANCE:
+            raise ValueError(f"Payment exceeds the ${total - paid:.2f} outstanding on {invoice_number}")
+        status = _apply_payment(cursor, invoice_id, status, total, paid, amount,
+                                paid_on or datetime.date.today(), method, reference, recorded_by)
+        return status, round(max(total - paid - amount, 0.0), 2)
+
+    result = get_db_writer().submit(pay).result()
+    get_invoice_details_cache().invalidate(invoice_number)
+    return result
+
+def set_invoice_status(invoice_number: str, status: str, recorded_by: str = "") -> str:
+    """Move an invoice to a new status if the transition is allowed.
+
+    Marking an invoice Paid records its outstanding balance as a payment;
+    invoices with payments cannot be voided.
+    """
+    def update(cursor):
+        invoice_id, current, total, paid = _live_invoice(cursor, invoice_number)
+        if status not in INVOICE_STATUS_TRANSITIONS.get(current, ()):
+            raise ValueError(f"Invoice {invoice_number} cannot go from {current} to {status}")
+        if status == "Void" and paid:
+            raise ValueError(f"Invoice {invoice_number} has payments and cannot be voided")
+        if status == "Paid" and total - paid > PAYMENT_TOLERANCE:
+            return _apply_payment(cursor, invoice_id, current, total, paid, round(total - paid, 2),
+                                  datetime.date.today(), "Marked paid", "", recorded_by)
+        cursor.execute("UPDATE invoices SET status = ? WHERE id = ?", (status, invoice_id))
+        return status
+
+    result = get_db_writer().submit(update).result()
+    get_invoice_details_cache().invalidate(invoice_number)
+    return result
+
+def mark_overdue_invoices(terms_days: Optional[int] = None, today: Optional[datetime.date] = None) -> int:
+    """Mark Sent invoices older than the payment terms Overdue and return how many"""
+    if terms_days is None:
+        terms_days = int(load_settings().get("payment_terms_days", PAYMENT_TERMS_DAYS))
+    cutoff = (today or datetime.date.today()) - datetime.timedelta(days=terms_days)
+    # The IN term lets the partial index find the open invoices
+    marked = get_db_writer().submit(lambda cursor: cursor.execute("""
+        UPDATE invoices SET status = 'Overdue'
+        WHERE status IN ('Sent', 'Overdue') AND status = 'Sent' AND date_created < ?
+    """, (cutoff.isoformat(),)).rowcount).result()
+    if marked:
+        get_invoice_details_cache().invalidate()
+    return marked
+
+def aging_report(conn: sqlite3.Connection, as_of: Optional[datetime.date] = None) -> Dict[str, Any]:
+    """Outstanding balances of open invoices by age in days since the invoice date.
+
+    One grouped query over the partial index on open invoices, so settled
+    history is never read. Returns {"as_of", "buckets": [(label, count,
+    amount), ...], "count", "outstanding"}.
+    """
+    as_of = as_of or datetime.date.today()
+    totals = dict.fromkeys(AGING_BUCKETS, (0, 0.0))
+    for label, count, amount in conn.execute("""
+        SELECT CASE
+                   WHEN age <= 30 THEN '0-30'
+                   WHEN age <= 60 THEN '31-60'
+                   WHEN age <= 90 THEN '61-90'
+                   ELSE '90+'
+               END AS bucket,
+               COUNT(*), SUM(due)
+        FROM (
+            SELECT julianday(?) - julianday(date(date_created)) AS age,
+                   total_amount - amount_paid AS due
+            FROM invoices
+            WHERE status IN ('Sent', 'Overdue')
+        )
+        GROUP BY bucket
+    """, (as_of.isoformat(),)):
+        totals[label] = (count, round(amount or 0.0, 2))
+    buckets = [(label, *totals[label]) for label in AGING_BUCKETS]
+    return {"as_of": as_of, "buckets": buckets,
+            "count": sum(count for _label, count, _amount in buckets),
+            "outstanding": round(sum(amount for _label, _count, amount in buckets), 2)}
+
+def open_invoices(conn: sqlite3.Connection, limit: Optional[int] = None) -> List[tuple]:
+    """Return (number, customer, date, status, total, outstanding) of open invoices, oldest first"""
+    limit_sql = f"LIMIT {int(limit)}" if limit else ""
+    return conn.execute(f"""
+        SELECT invoice_number, customer_name, date_created, status, total_amount,
+               round(total_amount - amount_paid, 2)
+        FROM invoices WHERE status IN ('Sent', 'Overdue')
+        ORDER BY date_created {limit_sql}
+    """).fetchall()
+
+# --- Memory Budget ---
+# Rough in-memory sizes used to charge work against a memory budget,
+# measured with tracemalloc on the bundled template
+INVOICE_CONTEXT_BYTES = 1024
+INVOICE_LINE_BYTES = 256
+RENDER_BASE_BYTES = 384 * 1024
+RENDER_BYTES_PER_PAYLOAD_BYTE = 350
+RENDER_MAX_BYTES = 16 * 2**20  # Larger invoices are streamed
+
+def estimate_context_bytes(context: Dict[str, Any]) -> int:
+    """Approximate memory held by an invoice context"""
+    return INVOICE_CONTEXT_BYTES + INVOICE_LINE_BYTES * len(context["invoice_list"])
+
+def estimate_render_bytes(payload_size: int) -> int:
+    """Approximate peak memory of rendering a job with this payload size"""
+    return min(RENDER_BASE_BYTES + payload_size * RENDER_BYTES_PER_PAYLOAD_BYTE, RENDER_MAX_BYTES)
+
+class MemoryBudget:
+    """Byte-counting semaphore that applies backpressure to producers.
+
+    acquire() blocks while the work already in flight plus the new work
+    would exceed the limit. Work larger than the whole budget still runs,
+    but only on its own.
+    """
+
+    def __init__(self, limit_bytes: int):
+        self.limit = limit_bytes
+        self.in_use = 0
+        self.peak = 0
+        self.waits = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, size: int) -> int:
+        """Wait until size bytes fit in the budget and reserve them"""
+        with self._condition:
+            if self.in_use and self.in_use + size > self.limit:
+                self.waits += 1
+                while self.in_use and self.in_use + size > self.limit:
+                    self._condition.wait()
+            self.in_use += size
+            self.peak = max(self.peak, self.in_use)
+        return size
+
+    def release(self, size: int) -> None:
+        """Return reserved bytes to the budget"""
+        with self._condition:
+            self.in_use -= size
+            self._condition.notify_all()
+
+def memory_budget_from_settings(megabytes: Optional[float] = None) -> Optional[MemoryBudget]:
+    """The configured memory budget, or None when memory is not limited"""
+    if megabytes is None:
+        megabytes = float(load_settings().get("memory_budget_mb", 0))
+    return MemoryBudget(int(megabytes * 2**20)) if megabytes > 0 else None
+
+def chunked_by_budget(iterable: Iterable, max_items: int, max_bytes: Optional[int],
+                      size_of: Callable[[Any], int]) -> Iterator[list]:
+    """Like _chunked, but also closes a chunk once its estimated bytes reach max_bytes"""
+    if max_bytes is None:
+        yield from _chunked(iterable, max_items)
+        return
+    chunk, chunk_bytes = [], 0
+    for entry in iterable:
+        chunk.append(entry)
+        chunk_bytes += size_of(entry)
+        if len(chunk) >= max_items or chunk_bytes >= max_bytes:
+            yield chunk
+            chunk, chunk_bytes = [], 0
+    if chunk:
+        yield chunk
+
+class MemoryReport:
+    """tracemalloc peak and top allocations of a run, for sizing workers.
+
+    checkpoint() is called while the most work is in flight; the snapshot
+    from the checkpoint with the highest traced memory is the one reported.
+    """
+
+    def __init__(self, top: int = 10):
+        self.top = top
+        self._snapshot = None
+        self._snapshot_size = -1
+
+    def __enter__(self) -> "MemoryReport":
+        tracemalloc.start()
+        return self
+
+    def checkpoint(self) -> None:
+        current = tracemalloc.get_traced_memory()[0]
+        if current > self._snapshot_size:
+            self._snapshot = tracemalloc.take_snapshot()
+            self._snapshot_size = current
+
+    def __exit__(self, *exc_info) -> None:
+        self.checkpoint()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"tracemalloc peak: {peak / 2**20:.1f} MiB, "
+              f"top allocations at {self._snapshot_size / 2**20:.1f} MiB traced:")
+        for stat in self._snapshot.statistics("lineno")[:self.top]:
+            print(f"  {stat}")
+
+# --- Invoice Jobs ---
+# A job is pending until its invoice row is committed (inserted) and
+# rendered once its document is stored; failed jobs keep their invoice id
+JOB_STATES = ("pending", "inserted", "rendered", "failed")
+JOB_LEASE_SECONDS = 300
+
+def enqueue_invoice_job(cursor: sqlite3.Cursor, run_id: str, idempotency_key: str,
+                        context: Dict[str, Any], status: str,
+                        customer_label: Optional[str] = None) -> bool:
+    """Queue one invoice unless a job with the same key exists; True if queued"""
+    payload = {"context": context, "status": status,
+               "customer_label": customer_label or context["name"].replace(" ", "_")}
+    cursor.execute("""
+        INSERT OR IGNORE INTO invoice_jobs (run_id, idempotency_key, payload)
+        VALUES (?, ?, ?)
+    """, (run_id, idempotency_key, json.dumps(payload)))
+    return cursor.rowcount == 1
+
+def invoice_job_counts(conn: sqlite3.Connection, run_id: Optional[str] = None) -> Dict[str, int]:
+    """Number of jobs in each state, optionally for one run"""
+    counts = dict.fromkeys(JOB_STATES, 0)
+    query = "SELECT state, COUNT(*) FROM invoice_jobs"
+    params = ()
+    if run_id is not None:
+        query += " WHERE run_id = ?"
+        params = (run_id,)
+    for state, count in conn.execute(query + " GROUP BY state", params):
+        counts[state] = count
+    return counts
+
+def retry_failed_jobs(run_id: Optional[str] = None) -> int:
+    """Requeue failed jobs at the step they failed in and return how many"""
+    def requeue(cursor):
+        query = """
+            UPDATE invoice_jobs
+            SET state = CASE WHEN invoice_id IS NULL THEN 'pending' ELSE 'inserted' END,
+                last_error = NULL, lease_owner = NULL, lease_expires = NULL,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE state = 'failed'
+        """
+        if run_id is None:
+            return cursor.execute(query).rowcount
+        return cursor.execute(query + " AND run_id = ?", (run_id,)).rowcount
+    return get_db_writer().submit(requeue).result()
+
+class InvoiceJobRunner:
+    """Work through queued invoice jobs, checkpointing every step.
+
+    Jobs are leased in batches so several workers (or a restarted one) never
+    process the same job; a lease left behind by a dead worker expires after
+    lease_seconds. Inserting the invoice and marking the job inserted happen
+    in one transaction, so a resumed run never inserts an invoice twice and
+    only re-renders documents that were not recorded as rendered.
+    
+    With a memory budget, a quarter of it caps the payload bytes leased per
+    batch and the rest caps the estimated memory of renders in flight;
+    leasing and rendering wait whenever the budget is used up.
+    """
+
+    def __init__(self, worker_id: Optional[str] = None, lease_seconds: float = JOB_LEASE_SECONDS,
+                 batch_size: int = 50, max_workers: int = 1,
+                 memory_budget: Optional[MemoryBudget] = None,
+                 checkpoint: Optional[Callable[[], None]] = None):
+        self.worker_id = worker_id or f"{os.getpid()}-{threading.get_ident()}-{time.time():.0f}"
+        self.lease_seconds = lease_seconds
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.checkpoint = checkpoint
+        self.render_budget = self.batch_bytes = None
+        if memory_budget is not None:
+            self.batch_bytes = memory_budget.limit // 4
+            self.render_budget = MemoryBudget(memory_budget.limit - self.batch_bytes)
+
+    def lease(self, run_id: Optional[str] = None) -> List[tuple]:
+        """Claim a batch of unfinished jobs as (id, state, invoice id, payload)"""
+        def claim(cursor):
+            now = time.time()
+            query = """
+                SELECT id, state, invoice_id, payload,
+                       SUM(length(payload)) OVER (ORDER BY id) AS batch_bytes
+                FROM invoice_jobs
+                WHERE state IN ('pending', 'inserted')
+                  AND (lease_expires IS NULL OR lease_expires < ?)
+            """
+            params = [now]
+            if run_id is not None:
+                query += " AND run_id = ?"
+                params.append(run_id)
+            # Stop at the byte cap, but always take at least the first job
+            jobs = cursor.execute(f"""
+                SELECT id, state, invoice_id, payload FROM ({query} ORDER BY id LIMIT ?)
+                WHERE batch_bytes <= ? OR batch_bytes = length(payload)
+            """, params + [self.batch_size, self.batch_bytes or sys.maxsize]).fetchall()
+            cursor.executemany("""
+                UPDATE invoice_jobs SET lease_owner = ?, lease_expires = ?
+                WHERE id = ?
+            """, [(self.worker_id, now + self.lease_seconds, job[0]) for job in jobs])
+            return jobs
+        return get_db_writer().submit(claim).result()
+
+    @profiled("invoice_jobs")
+    def run(self, run_id: Optional[str] = None,
+            should_stop: Optional[Callable[[], bool]] = None) -> Dict[str, int]:
+        """Process jobs until none are left; returns how many ended in each state"""
+        outcome = {"rendered": 0, "failed": 0}
+        writer = get_db_writer()
+        with ThreadPoolExecutor(max_workers=self.max_workers,
+                                thread_name_prefix="InvoiceJob") as renderer:
+            while not (should_stop and should_stop()):
+                jobs = self.lease(run_id)
+                if not jobs:
+                    break
+                # Insert all pending invoices of the batch in one group commit
+                inserts = [(job_id, payload, writer.submit(self._insert_operation(job_id, payload)))
+                           for job_id, state, invoice_id, payload in jobs if state == "pending"]
+                ready = [(job_id, invoice_id, payload)
+                         for job_id, state, invoice_id, payload in jobs if state == "inserted"]
+                for job_id, payload, future in inserts:
+                    try:
+                        inserted = future.result()
+                    except Exception as e:
+                        self._fail(job_id, e)
+                        outcome["failed"] += 1
+                        continue
+                    if inserted is not None:
+                        # Only committed invoices enter the recent history
+                        invoice_id, summary = inserted
+                        record_invoice_history(summary)
+                        ready.append((job_id, invoice_id, payload))
+                renders = []
+                for job_id, invoice_id, payload in ready:
+                    if self.render_budget is None:
+                        future = renderer.submit(self._render, job_id, invoice_id, payload)
+                    else:
+                        # Backpressure: wait for earlier renders to free their share
+                        size = self.render_budget.acquire(estimate_render_bytes(len(payload)))
+                        future = renderer.submit(self._render, job_id, invoice_id, payload)
+                        future.add_done_callback(lambda _, size=size: self.render_budget.release(size))
+                    renders.append((job_id, future))
+                if self.checkpoint:
+                    self.checkpoint()
+                for job_id, future in renders:
+                    try:
+                        future.result()
+                        outcome["rendered"] += 1
+                    except Exception as e:
+                        self._fail(job_id, e)
+                        outcome["failed"] += 1
+        return outcome
+
+    def _insert_operation(self, job_id: int, payload: str) -> Callable[[sqlite3.Cursor], Optional[tuple]]:
+        def operation(cursor):
+            job = json.loads(payload)
+            # Lost the lease or another worker got further: leave the job alone
+            if cursor.execute("""
+                SELECT 1 FROM invoice_jobs
+                WHERE id = ? AND state = 'pending' AND lease_owner = ?
+            """, (job_id, self.worker_id)).fetchone() is None:
+                return None
+            context = job["context"]
+            invoice_id, date_created = insert_invoice(cursor, context, job["status"])
+            cursor.execute("""
+                UPDATE invoice_jobs
+                SET state = 'inserted', invoice_id = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            """, (invoice_id, job_id))
+            return invoice_id, (context["invoice_number"], context["name"], date_created, context["total"])
+        return operation
+
+    def _render(self, job_id: int, invoice_id: int, payload: str) -> None:
+        job = json.loads(payload)
+        store_invoice_document(invoice_id, job["context"], job["customer_label"])
+        get_db_writer().submit(lambda cursor: cursor.execute("""
+            UPDATE invoice_jobs
+            SET state = 'rendered', lease_owner = NULL, lease_expires = NULL,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        """, (job_id,))).result()
+
+    def _fail(self, job_id: int, error: Exception) -> None:
+        get_db_writer().submit(lambda cursor: cursor.execute("""
+            UPDATE invoice_jobs
+            SET state = 'failed', last_error = ?, failures = failures + 1,
+                lease_owner = NULL, lease_expires = NULL, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        """, (str(error), job_id))).result()
+
+def read_bulk_invoices(path: str, admin: str) -> Iterator[tuple]:
+    """Stream (idempotency key, context, error) from a JSONL file of invoices
+
+    Every chunk goes through validate_invoice_chunk() first, so rejected
+    lines never reach build_invoice_context() or the job queue.
+    """
+    run_stamp = datetime.date.today().strftime('%Y%m%d')
+    base = os.path.basename(path)
+    for chunk in read_jsonl_chunks(path):
+        valid, errors = validate_invoice_chunk([(line_number, record) for line_number, _, record in chunk])
+        messages = {}
+        for line_number, field, message in errors:
+            messages.setdefault(line_number, []).append(f"{field}: {message}")
+        for line_number, line, _ in chunk:
+            # Re-running the same file maps every line to the job it already has
+            key = f"{base}:{line_number}:{hashlib.sha1(line.encode('utf-8')).hexdigest()[:12]}"
+            if line_number in messages:
+                yield key, None, f"line {line_number}: {'; '.join(messages[line_number])}"
+                continue
+            record = valid[line_number]
+            key = str(record["key"] or key)
+            # Keys are unique across runs, so numbers derived from them are too
+            number = f"INV-{run_stamp}-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:10].upper()}"
+            try:
+                context = build_invoice_context(
+                    number, record["name"], record["phone"],
+                    record["email"], record["invoice_list"], record["tax_rate"], admin,
+                    region=record["region"])
+            except (ValueError, KeyError) as e:
+                yield key, None, f"line {line_number}: {e}"
+                continue
+            yield key, context, None
+
+# --- Recurring Invoices ---
+# Cadence name -> (days, months) added per period
+RECURRING_CADENCES = {
+    "weekly": (7, 0),
+    "monthly": (0, 1),
+    "quarterly": (0, 3),
+    "yearly": (0, 12),
+}
+RECURRING_INVOICE_STATUS = "Draft"
+RECURRING_JOB_RUN = "recurring"
+
+def add_cadence(start: datetime.date, cadence: str, periods: int = 1) -> datetime.date:
+    """Date of the run `periods` cadences after start, clamping to month ends"""
+    days, months = RECURRING_CADENCES[cadence]
+    if not months:
+        return start + datetime.timedelta(days=days * periods)
+    month_index = start.month - 1 + months * periods
+    year, month = start.year + month_index // 12, month_index % 12 + 1
+    return datetime.date(year, month, min(start.day, calendar.monthrange(year, month)[1]))
+
+def create_recurring_invoice(cursor: sqlite3.Cursor, context: Dict[str, Any], cadence: str,
+                             start_date: datetime.date) -> int:
+    """Store a recurring invoice definition from an invoice context, first run on start_date"""
+    if cadence not in RECURRING_CADENCES:
+        raise ValueError(f"Unknown cadence '{cadence}'")
+    cursor.execute("""
+        INSERT INTO recurring_invoices (
+            customer_name, customer_email, customer_phone, tax_rate, tax_region,
+            cadence, start_date, next_run, created_by
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (context["name"], context["email"], context["phone"], context["tax_rate"],
+          context.get("tax_region"), cadence, start_date.isoformat(), start_date.isoformat(),
+          context["admin_name"]))
+    recurring_id = cursor.lastrowid
+    cursor.executemany("""
+        INSERT INTO recurring_invoice_items (recurring_id, description, quantity, unit_price, category)
+        VALUES (?, ?, ?, ?, ?)
+    """, [(recurring_id, item[1], item[0], item[2], item[4] if len(item) > 4 else "")
+          for item in context["invoice_list"]])
+    return recurring_id
+
+def parse_offpeak_windows(windows: Iterable[str]) -> List[tuple]:
+    """Parse "HH:MM-HH:MM" strings into (start, end) time pairs"""
+    parsed = []
+    for window in windows:
+        start, end = (datetime.time.fromisoformat(part.strip()) for part in window.split("-"))
+        parsed.append((start, end))
+    return parsed
+
+def in_offpeak_window(now: datetime.datetime, windows: List[tuple]) -> bool:
+    """Whether now falls in any window; windows may wrap past midnight, none means always"""
+    if not windows:
+        return True
+    current = now.time()
+    for start, end in windows:
+        if start <= end:
+            if start <= current < end:
+                return True
+        elif current >= start or current < end:
+            return True
+    return False
+
+def due_recurring_invoices(conn: sqlite3.Connection, today: datetime.date,
+                           limit: int) -> List[tuple]:
+    """(id, next_run) of active definitions due by today, oldest first"""
+    # Served by the partial index on next_run over active definitions
+    return conn.execute("""
+        SELECT id, next_run FROM recurring_invoices
+        WHERE active = 1 AND next_run <= ?
+        ORDER BY next_run
+        LIMIT ?
+    """, (today.isoformat(), limit)).fetchall()
+
+def _enqueue_recurring_run(recurring_id: int, next_run: str) -> Callable[[sqlite3.Cursor], Optional[str]]:
+    """Writer operation that queues one due run of a definition and advances it"""
+    def operation(cursor):
+        definition = cursor.execute("""
+            SELECT customer_name, customer_email, customer_phone, tax_rate, tax_region,
+                   cadence, start_date, runs, created_by
+            FROM recurring_invoices
+            WHERE id = ? AND active = 1 AND next_run = ?
+        """, (recurring_id, next_run)).fetchone()
+        if definition is None:
+            return None  # Already issued by another scheduler or deactivated
+        name, email, phone, tax_rate, region, cadence, start_date, runs, created_by = definition
+        invoice_list = [[quantity, description, price, round(quantity * price, 2), category or ""]
+                        for description, quantity, price, category in cursor.execute("""
+                            SELECT description, quantity, unit_price, category FROM recurring_invoice_items
+                            WHERE recurring_id = ? ORDER BY id
+                        """, (recurring_id,))]
+        run_date = datetime.date.fromisoformat(next_run)
+        # One invoice per definition and run date, so a retry cannot bill twice
+        invoice_number = f"INV-{run_date:%Y%m%d}-R{recurring_id}"
+        context = build_invoice_context(invoice_number, name, phone or "", email or "",
+                                        invoice_list, tax_rate, created_by, run_date, region)
+        enqueue_invoice_job(cursor, RECURRING_JOB_RUN, f"recurring:{recurring_id}:{next_run}",
+                            context, RECURRING_INVOICE_STATUS)
+        following = add_cadence(datetime.date.fromisoformat(start_date), cadence, runs + 1)
+        cursor.execute("""
+            UPDATE recurring_invoices
+            SET runs = runs + 1, next_run = ?, last_invoice_number = ?
+            WHERE id = ?
+        """, (following.isoformat(), invoice_number, recurring_id))
+        return invoice_number
+    return operation
+
+class RecurringInvoiceScheduler:
+    """Issue due recurring invoices in batches during off-peak windows.
+
+    Each batch of due runs is queued as invoice jobs in one group commit and
+    then worked off by an InvoiceJobRunner rendering with at most max_workers
+    threads, so an interrupted run resumes where it stopped. The window is
+    re-checked between batches, so the scheduler stops once peak hours begin.
+    """
+
+    def __init__(self, windows: Optional[List[tuple]] = None, batch_size: Optional[int] = None,
+                 max_workers: Optional[int] = None, poll_seconds: Optional[float] = None):
+        settings = load_settings()
+        if windows is None:
+            windows = parse_offpeak_windows(settings.get("recurring_offpeak_windows", ["22:00-06:00"]))
+        self.windows = windows
+        self.batch_size = batch_size or int(settings.get("recurring_batch_size", 50))
+        self.max_workers = max_workers or int(settings.get("recurring_max_workers", 1))
+        self.poll_seconds = poll_seconds or float(settings.get("recurring_poll_seconds", 300))
+        self._stop = threading.Event()
+        self._thread = None
+
+    @profiled("recurring_invoices")
+    def run_due(self, now: Optional[datetime.datetime] = None, force: bool = False) -> Dict[str, int]:
+        """Queue and issue everything due, batch by batch; returns job counts"""
+        outcome = {"queued": 0, "rendered": 0, "failed": 0}
+        runner = InvoiceJobRunner(batch_size=self.batch_size, max_workers=self.max_workers,
+                                  memory_budget=memory_budget_from_settings())
+
+        def should_stop():
+            return self._stop.is_set() or not (
+                force or in_offpeak_window(now or datetime.datetime.now(), self.windows))
+
+        while not should_stop():
+            # Finish jobs left by an interrupted run before queueing more
+            for state, count in runner.run(RECURRING_JOB_RUN, should_stop).items():
+                outcome[state] += count
+            if should_stop():
+                break
+            conn = connect_database()
+            try:
+                due = due_recurring_invoices(conn, (now or datetime.datetime.now()).date(),
+                                             self.batch_size)
+            finally:
+                conn.close()
+            if not due:
+                break
+            writer = get_db_writer()
+            futures = [writer.submit(_enqueue_recurring_run(recurring_id, next_run))
+                       for recurring_id, next_run in due]
+            outcome["queued"] += sum(future.result() is not None for future in futures)
+        return outcome
+
+    def start(self) -> None:
+        """Check for due invoices every poll_seconds on a background thread"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="RecurringScheduler", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Stop after the batch in progress"""
+        self._stop.set()
 
-def validate_email(email: str) -> bool:
-    """Simple email validation"""
-    # For now, accept any non-empty input
-    return bool(email.strip())
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.run_due()
+            except Exception as e:
+                print(f"Error issuing recurring invoices: {e}")
+            self._stop.wait(self.poll_seconds)
 
-def apply_azure_theme(window):
-    # Configure customtkinter appearance
-    ctk.set_appearance_mode("dark")  # Set to dark mode for modern look
-    ctk.set_default_color_theme("blue")  # Use blue theme
-    
-    # Configure ttk style for treeview
-    style = ttk.Style(window)
-    style.configure("Treeview",
-                   background="#2b2b2b",
-                   foreground="white",
-                   rowheight=30,
-                   fieldbackground="#2b2b2b",
-                   borderwidth=0)
-    style.configure("Treeview.Heading",
-                   background="#1e1e1e",
-                   foreground="white",
-                   font=('Aptos Black', 10, 'bold'),
-                   borderwidth=0)
-    style.map('Treeview', 
-              background=[('selected', '#0078D7')],
-              foreground=[('selected', 'white')])
-    
-    # Configure alternating row colors
-    style.map('Treeview',
-              background=[('selected', '#0078D7'),
-                         ('alternate', '#2b2b2b')],
-              foreground=[('selected', 'white'),
-                         ('!selected', 'white')])
-    
-    # Configure custom styles for better visual hierarchy
-    style.configure("Custom.TFrame",
-                   background="#1e1e1e")
-    style.configure("Custom.TLabel",
-                   background="#1e1e1e",
-                   foreground="white",
-                   font=('Aptos', 10))
-    style.configure("Custom.TButton",
-                   background="#0078D7",
-                   foreground="white",
-                   font=('Aptos', 10, 'bold'))
+# --- Invoice Preview ---
+# Character width of the plain text preview; long descriptions are cut to fit
+PREVIEW_WIDTH = 64
+PREVIEW_DESCRIPTION_WIDTH = PREVIEW_WIDTH - 32
 
-# --- Database Setup ---
-def setup_database():
-    """Setup database with proper error handling and security measures"""
-    try:
-        conn = sqlite3.connect("admin_accounts.db")
-        cursor = conn.cursor()
-        
-        # Create admins table with additional security fields
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS admins (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password TEXT NOT NULL,
-                email TEXT UNIQUE,
-                last_login TIMESTAMP,
-                failed_attempts INTEGER DEFAULT 0,
-                account_locked BOOLEAN DEFAULT 0
-            )
-        """)
-        
-        # Create items table for storing predefined items/services
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS items (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                description TEXT,
-                unit_price REAL NOT NULL,
-                category TEXT,
-                created_by TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(name, created_by)
-            )
-        """)
-        
-        # Create invoices table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS invoices (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                invoice_number TEXT UNIQUE NOT NULL,
-                customer_name TEXT NOT NULL,
-                customer_email TEXT,
-                customer_phone TEXT,
-                total_amount REAL NOT NULL,
-                date_created TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                created_by TEXT NOT NULL,
-                status TEXT DEFAULT 'Draft'
-            )
-        """)
-        
-        # Add new columns for tax information if they don't exist
-        try:
-            cursor.execute("ALTER TABLE invoices ADD COLUMN tax_rate REAL DEFAULT 0")
-        except sqlite3.OperationalError:
-            pass  # Column already exists
-            
-        try:
-            cursor.execute("ALTER TABLE invoices ADD COLUMN tax_amount REAL DEFAULT 0")
-        except sqlite3.OperationalError:
-            pass  # Column already exists
-            
-        try:
-            cursor.execute("ALTER TABLE invoices ADD COLUMN subtotal REAL DEFAULT 0")
-        except sqlite3.OperationalError:
-            pass  # Column already exists
-        
-        # Create invoice_items table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS invoice_items (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                invoice_id INTEGER,
-                description TEXT NOT NULL,
-                quantity INTEGER NOT NULL,
-                unit_price REAL NOT NULL,
-                total_price REAL NOT NULL,
-                FOREIGN KEY (invoice_id) REFERENCES invoices (id)
-            )
-        """)
-        
-        conn.commit()
-    except sqlite3.Error as e:
-        messagebox.showerror("Database Error", f"Error setting up database: {str(e)}")
-    finally:
-        if 'conn' in locals():
-            conn.close()
+def format_preview_header(name: str, phone: str, email: str, status: str = "",
+                          region: Optional[str] = None, repeat: str = "",
+                          date: Optional[datetime.date] = None) -> str:
+    """Header block of the preview: customer, date and invoice options"""
+    lines = [f"{'INVOICE PREVIEW':<{PREVIEW_WIDTH - 10}}{(date or datetime.date.today()):%Y-%m-%d}",
+             "",
+             f"Bill to: {name or '(no name)'}"]
+    if phone:
+        lines.append(f"         {phone}")
+    if email:
+        lines.append(f"         {email}")
+    options = [f"Status: {status}"] if status else []
+    if region and region != FLAT_TAX_RATE:
+        options.append(f"Tax rules: {region}")
+    if repeat and repeat != "Never":
+        options.append(f"Repeats: {repeat}")
+    if options:
+        lines.append("   ".join(options))
+    lines += ["", f"{'Qty':>5}  {'Description':<{PREVIEW_DESCRIPTION_WIDTH}}  {'Price':>10}  {'Total':>11}",
+              "-" * PREVIEW_WIDTH]
+    return "".join(line + "\n" for line in lines)
 
-setup_database()
+def format_preview_line(item: list) -> str:
+    """One preview row for an invoice_list entry"""
+    description = " ".join(str(item[1]).split())
+    if len(description) > PREVIEW_DESCRIPTION_WIDTH:
+        description = description[:PREVIEW_DESCRIPTION_WIDTH - 3] + "..."
+    return (f"{item[0]:>5}  {description:<{PREVIEW_DESCRIPTION_WIDTH}}  "
+            f"{item[2]:>10.2f}  {item[3]:>11.2f}\n")
+
+def format_preview_totals(subtotal: float, tax: float, total: float, lines: int) -> str:
+    """Totals block at the foot of the preview"""
+    return ("-" * PREVIEW_WIDTH + "\n"
+            f"{f'{lines} line(s)':<{PREVIEW_WIDTH - 24}}{'Subtotal':>10}  {subtotal:>12.2f}\n"
+            f"{'':<{PREVIEW_WIDTH - 24}}{'Tax':>10}  {tax:>12.2f}\n"
+            f"{'':<{PREVIEW_WIDTH - 24}}{'Total':>10}  {total:>12.2f}\n")
+
+class InvoicePreview:
+    """Plain text invoice preview kept in step with the line list
+
+    The text widget holds three regions: the header, one row per line item
+    and the totals. Each update rewrites only its own region, and new line
+    items are appended after the rows already shown, so adding a line costs
+    the same whether the invoice has five lines or five thousand.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.header_lines = 0
+        self.rows = 0
+        self.header = ""
+        self.footer = ""
+
+    def _line(self, offset: int) -> str:
+        # Text indices are 1-based line numbers
+        return f"{offset + 1}.0"
+
+    def _edit(self, start: int, end: Optional[int], content: str) -> None:
+        """Replace the lines from start up to end (or the end of the text) with content"""
+        self.text.configure(state="normal")
+        self.text.delete(self._line(start), "end" if end is None else self._line(end))
+        if content:
+            self.text.insert(self._line(start), content)
+        self.text.configure(state="disabled")
+
+    def update_header(self, header: str) -> None:
+        """Show a new header, leaving the rows and totals alone"""
+        if header == self.header:
+            return
+        self._edit(0, self.header_lines, header)
+        self.header = header
+        self.header_lines = header.count("\n")
+
+    def update_lines(self, invoice_list: list) -> None:
+        """Append rows for lines added since the last update
+
+        A shorter list means the invoice was cleared, so the rows are
+        rebuilt from scratch.
+        """
+        start = self.header_lines
+        if len(invoice_list) < self.rows:
+            self._edit(start, start + self.rows, "")
+            self.rows = 0
+        if len(invoice_list) > self.rows:
+            at = start + self.rows
+            self._edit(at, at, "".join(format_preview_line(item) for item in invoice_list[self.rows:]))
+            self.rows = len(invoice_list)
+
+    def update_totals(self, footer: str) -> None:
+        """Show new totals below the rows"""
+        if footer == self.footer:
+            return
+        self._edit(self.header_lines + self.rows, None, footer)
+        self.footer = footer
 
 # --- Dynamic Form Switching ---
 def load_login_form():
@@ -316,29 +3909,26 @@ def register():
             messagebox.showerror("Error", "Passwords do not match.")
             return
 
-        try:
-            conn = sqlite3.connect("admin_accounts.db")
-            cursor = conn.cursor()
-            
+        def insert_admin(cursor):
             # Check if username already exists
             cursor.execute("SELECT * FROM admins WHERE username = ?", (username,))
             if cursor.fetchone():
-                messagebox.showerror("Error", "Username already exists.")
-                return
+                return False
                 
             cursor.execute("""
                 INSERT INTO admins (username, password, last_login)
                 VALUES (?, ?, datetime('now'))
             """, (username, password))
-            
-            conn.commit()
+            return True
+
+        try:
+            if not get_db_writer().submit(insert_admin).result():
+                messagebox.showerror("Error", "Username already exists.")
+                return
             messagebox.showinfo("Success", "Registration successful! Please log in.")
             load_login_form()
         except sqlite3.Error as e:
             messagebox.showerror("Database Error", f"Error during registration: {str(e)}")
-        finally:
-            if 'conn' in locals():
-                conn.close()
 
     clear_window(login_window)
     
@@ -395,17 +3985,16 @@ def register():
                  height=32).pack(pady=5)
 
 # --- Login Verification ---
-def login():
-    """Enhanced login with security features"""
-    username = login_username_entry.get().strip()
-    password = login_password_entry.get()
-    
-    if not username or not password:
-        messagebox.showerror("Error", "Username and password are required.")
-        return
-        
+LOGIN_MAX_ATTEMPTS = 3
+
+def authenticate_admin(username: str, password: str) -> tuple:
+    """Check an admin's credentials and record the attempt.
+
+    Returns (outcome, failed attempts), outcome being "ok", "unknown",
+    "locked", "invalid", or "lockout" when this attempt locked the account.
+    """
+    conn = connect_database()
     try:
-        conn = sqlite3.connect("admin_accounts.db")
         cursor = conn.cursor()
         
         # First check if the username exists
@@ -413,13 +4002,11 @@ def login():
         account = cursor.fetchone()
         
         if not account:
-            messagebox.showerror("Error", "Invalid username or password.")
-            return
+            return "unknown", 0
             
         # Check if account is locked
         if account[6]:  # account_locked field
-            messagebox.showerror("Error", "Account is locked. Please contact administrator.")
-            return
+            return "locked", account[5]
             
         # Now verify the password
         cursor.execute("""
@@ -428,45 +4015,64 @@ def login():
         """, (username, password))
         
         login_successful = cursor.fetchone() is not None
+    finally:
+        conn.close()
+    
+    if login_successful:
+        # Reset failed attempts and update last login
+        get_db_writer().submit(lambda cursor: cursor.execute("""
+            UPDATE admins 
+            SET failed_attempts = 0, last_login = datetime('now')
+            WHERE username = ?
+        """, (username,))).result()
+        return "ok", 0
+    
+    def record_failed_attempt(cursor):
+        # Increment failed attempts
+        cursor.execute("""
+            UPDATE admins 
+            SET failed_attempts = failed_attempts + 1
+            WHERE username = ?
+        """, (username,))
         
-        if login_successful:
-            # Reset failed attempts and update last login
-            cursor.execute("""
-                UPDATE admins 
-                SET failed_attempts = 0, last_login = datetime('now')
-                WHERE username = ?
-            """, (username,))
-            conn.commit()
-            
-            global logged_in_admin
-            logged_in_admin = username
-            login_window.destroy()
-            launch_main_app()
-        else:
-            # Increment failed attempts
-            cursor.execute("""
-                UPDATE admins 
-                SET failed_attempts = failed_attempts + 1
-                WHERE username = ?
-            """, (username,))
-            
-            # Check if account should be locked
-            cursor.execute("SELECT failed_attempts FROM admins WHERE username = ?", (username,))
-            attempts = cursor.fetchone()[0]
-            
-            if attempts >= 3:
-                cursor.execute("UPDATE admins SET account_locked = 1 WHERE username = ?", (username,))
-                messagebox.showerror("Error", "Too many failed attempts. Account locked.")
-            else:
-                messagebox.showerror("Error", f"Invalid username or password. {3-attempts} attempts remaining.")
-                
-            conn.commit()
-            
+        # Check if account should be locked
+        cursor.execute("SELECT failed_attempts FROM admins WHERE username = ?", (username,))
+        attempts = cursor.fetchone()[0]
+        if attempts >= LOGIN_MAX_ATTEMPTS:
+            cursor.execute("UPDATE admins SET account_locked = 1 WHERE username = ?", (username,))
+        return attempts
+    
+    attempts = get_db_writer().submit(record_failed_attempt).result()
+    return ("lockout" if attempts >= LOGIN_MAX_ATTEMPTS else "invalid"), attempts
+
+def login():
+    """Enhanced login with security features"""
+    username = login_username_entry.get().strip()
+    password = login_password_entry.get()
+    
+    if not username or not password:
+        messagebox.showerror("Error", "Username and password are required.")
+        return
+        
+    try:
+        outcome, attempts = authenticate_admin(username, password)
     except sqlite3.Error as e:
         messagebox.showerror("Database Error", f"Error during login: {str(e)}")
-    finally:
-        if 'conn' in locals():
-            conn.close()
+        return
+    
+    if outcome == "ok":
+        global logged_in_admin
+        logged_in_admin = username
+        login_window.destroy()
+        launch_main_app()
+    elif outcome == "unknown":
+        messagebox.showerror("Error", "Invalid username or password.")
+    elif outcome == "locked":
+        messagebox.showerror("Error", "Account is locked. Please contact administrator.")
+    elif outcome == "lockout":
+        messagebox.showerror("Error", "Too many failed attempts. Account locked.")
+    else:
+        messagebox.showerror("Error", f"Invalid username or password. {LOGIN_MAX_ATTEMPTS - attempts} attempts remaining.")
 
 # --- Main Invoice Application ---
 def launch_main_app():
@@ -536,16 +4142,10 @@ def launch_main_app():
             if price < 0:
                 raise ValueError("Price cannot be negative")
             
-            conn = sqlite3.connect("admin_accounts.db")
-            cursor = conn.cursor()
-            
-            cursor.execute("""
+            get_db_writer().submit(lambda cursor: cursor.execute("""
                 INSERT INTO items (name, description, unit_price, category, created_by)
                 VALUES (?, ?, ?, ?, ?)
-            """, (name, description, price, category, logged_in_admin))
-            
-            conn.commit()
-            conn.close()
+            """, (name, description, price, category, logged_in_admin))).result()
             
             # Clear fields
             new_item_name.delete(0, tk.END)
@@ -564,6 +4164,7 @@ def launch_main_app():
         except Exception as e:
             messagebox.showerror("Error", f"An error occurred: {str(e)}")
 
+    @profiled("load_items")
     def load_items():
         """Load items from database into the treeview"""
         # Clear existing items
@@ -571,7 +4172,7 @@ def launch_main_app():
             items_tree.delete(item)
         
         try:
-            conn = sqlite3.connect("admin_accounts.db")
+            conn = connect_database()
             cursor = conn.cursor()
             
             cursor.execute("""
@@ -598,15 +4199,10 @@ def launch_main_app():
             
         if messagebox.askyesno("Confirm Delete", "Are you sure you want to delete this item?"):
             try:
-                conn = sqlite3.connect("admin_accounts.db")
-                cursor = conn.cursor()
-                
                 item_name = items_tree.item(selected[0])['values'][0]
-                cursor.execute("DELETE FROM items WHERE name = ? AND created_by = ?",
-                             (item_name, logged_in_admin))
-                
-                conn.commit()
-                conn.close()
+                get_db_writer().submit(lambda cursor: cursor.execute(
+                    "DELETE FROM items WHERE name = ? AND created_by = ?",
+                    (item_name, logged_in_admin))).result()
                 
                 load_items()
                 messagebox.showinfo("Success", "Item deleted successfully!")
@@ -614,6 +4210,59 @@ def launch_main_app():
             except sqlite3.Error as e:
                 messagebox.showerror("Database Error", f"Error deleting item: {str(e)}")
 
+    def import_catalog_file():
+        """Import a CSV/JSONL catalog in the background and refresh the list once"""
+        path = filedialog.askopenfilename(
+            title="Import Catalog",
+            filetypes=[("Catalog files", "*.csv *.jsonl *.ndjson"), ("All files", "*.*")])
+        if not path:
+            return
+        future = Future()
+        admin = logged_in_admin
+
+        def run_import():
+            try:
+                future.set_result(import_catalog(path, admin))
+            except Exception as e:
+                future.set_exception(e)
+
+        import_catalog_btn.configure(state="disabled", text="Importing...")
+        threading.Thread(target=run_import, name="CatalogImport", daemon=True).start()
+        main_window.after(100, finish_catalog_import, future)
+
+    def finish_catalog_import(future):
+        """Poll a running catalog import and report it when done"""
+        if not future.done():
+            main_window.after(100, finish_catalog_import, future)
+            return
+        import_catalog_btn.configure(state="normal", text="Import Catalog")
+        try:
+            result = future.result()
+        except (OSError, UnicodeDecodeError, csv.Error) as e:
+            messagebox.showerror("Import Error", f"Error reading catalog: {str(e)}")
+            return
+        except sqlite3.Error as e:
+            messagebox.showerror("Database Error", f"Error importing catalog: {str(e)}")
+            load_items()  # Chunks before the failure are committed
+            return
+        load_items()
+        messagebox.showinfo("Import Complete", format_catalog_import_report(result))
+
+    # Catalog item last copied into the entry fields, for its category
+    catalog_pick = {}
+    
+    def selected_tax_region():
+        """None for the flat tax rate, else the region whose rules apply"""
+        choice = tax_region_menu.get()
+        if choice == FLAT_TAX_RATE:
+            return None
+        return "" if choice == ANY_TAX_REGION else choice
+    
+    def on_tax_region_change(choice):
+        """The flat rate entry only applies without tax rules"""
+        tax_rate_entry.configure(state="normal" if choice == FLAT_TAX_RATE else "disabled")
+        update_totals()
+
     def add_item_to_invoice():
         """Add selected item from items list to current invoice"""
         selected = items_tree.selection()
@@ -628,6 +4277,8 @@ def launch_main_app():
         desc_entry.insert(0, item_values[0])  # Just use the item name without description
         price_spinbox.delete(0, tk.END)
         price_spinbox.insert(0, item_values[2].replace('$', ''))
+        # Remember the category so the line is taxed by its rules
+        catalog_pick.update(name=str(item_values[0]), category=str(item_values[3]))
         
         # Switch to invoice tab
         tabview.set("New Invoice")
@@ -653,8 +4304,10 @@ def launch_main_app():
                 raise ValueError("Price cannot be negative")
                 
             line_total = round(qty * price, 2)
-            invoice_item = [qty, desc, price, line_total]
-            tree.insert('', 0, values=invoice_item)
+            category = catalog_pick.get("category", "") if desc == catalog_pick.get("name") else ""
+            invoice_item = [qty, desc, price, line_total, category]
+            tree.insert('', 0, values=invoice_item[:4])
+            catalog_pick.clear()
             clear_item()
             invoice_list.append(invoice_item)
             
@@ -663,17 +4316,102 @@ def launch_main_app():
         except ValueError as e:
             messagebox.showerror("Invalid Input", str(e))
 
+    def paste_items():
+        """Add line items pasted from a spreadsheet or CSV"""
+        try:
+            text = main_window.clipboard_get()
+        except tk.TclError:
+            messagebox.showwarning("Paste Items", "The clipboard does not contain text")
+            return
+        start_line_import(lambda: parse_line_items(text))
+    
+    def import_items():
+        """Add line items from a CSV or tab separated file"""
+        path = filedialog.askopenfilename(
+            title="Import Items",
+            filetypes=[("CSV or text files", "*.csv *.tsv *.txt"), ("All files", "*.*")])
+        if path:
+            start_line_import(lambda: read_line_items_file(path))
+    
+    def start_line_import(parse):
+        """Parse and validate line items off the UI thread"""
+        future = Future()
+        
+        def run_parse():
+            try:
+                future.set_result(parse())
+            except Exception as e:
+                future.set_exception(e)
+        
+        for button in (paste_items_btn, import_items_btn):
+            button.configure(state="disabled")
+        threading.Thread(target=run_parse, name="LineImport", daemon=True).start()
+        main_window.after(50, finish_line_import, future)
+    
+    def finish_line_import(future):
+        """Wait for the parser, then add its rows in chunks"""
+        if not future.done():
+            main_window.after(50, finish_line_import, future)
+            return
+        try:
+            rows, errors = future.result()
+        except Exception as e:
+            for button in (paste_items_btn, import_items_btn):
+                button.configure(state="normal")
+            messagebox.showerror("Import Error", f"Error reading items: {str(e)}")
+            return
+        insert_line_chunk(rows, errors, 0)
+    
+    def insert_line_chunk(rows, errors, start):
+        """Insert one chunk of rows into the tree, yielding to the event loop between chunks"""
+        chunk = rows[start:start + LINE_IMPORT_CHUNK_ROWS]
+        for invoice_item in chunk:
+            tree.insert('', 0, values=invoice_item[:4])
+        invoice_list.extend(chunk)
+        preview.update_lines(invoice_list)
+        if start + LINE_IMPORT_CHUNK_ROWS < len(rows):
+            main_window.after(1, insert_line_chunk, rows, errors, start + LINE_IMPORT_CHUNK_ROWS)
+            return
+        
+        # All rows are in: one totals update for the whole import
+        update_totals()
+        for button in (paste_items_btn, import_items_btn):
+            button.configure(state="normal")
+        if errors:
+            report = "\n".join(f"Line {line_number}: {error}" for line_number, error in errors[:10])
+            if len(errors) > 10:
+                report += f"\n... and {len(errors) - 10} more"
+            messagebox.showwarning("Items Skipped",
+                                   f"Added {len(rows)} item(s), skipped {len(errors)}:\n{report}")
+
     def update_totals():
         """Update subtotal, tax, and total amounts"""
         subtotal = sum(item[3] for item in invoice_list)
-        tax_rate = float(tax_rate_entry.get() or 0) / 100
-        tax = round(subtotal * tax_rate, 2)
+        tax_rate = float(tax_rate_entry.get() or 0)
+        tax = calculate_invoice_tax(invoice_list, tax_rate, selected_tax_region())[1]
         total = round(subtotal + tax, 2)
     
         
         subtotal_label.configure(text=f"Subtotal: ${subtotal:.2f}")
         tax_label.configure(text=f"Tax: ${tax:.2f}")
         total_label.configure(text=f"Total: ${total:.2f}")
+        refresh_preview_header()
+        preview.update_lines(invoice_list)
+        preview.update_totals(format_preview_totals(subtotal, tax, total, len(invoice_list)))
+
+    def refresh_preview_header(event=None):
+        """Redraw the preview header from the customer fields"""
+        name = f"{first_name_entry.get().strip()} {last_name_entry.get().strip()}".strip()
+        preview.update_header(format_preview_header(name, phone_entry.get().strip(),
+                                                    email_entry.get().strip(), status_menu.get(),
+                                                    selected_tax_region(), repeat_menu.get()))
+
+    def on_tax_rate_edit(event=None):
+        """Retotal as the flat rate is typed, ignoring partial input"""
+        try:
+            update_totals()
+        except ValueError:
+            pass
 
     def new_invoice():
         """Clear all fields and start a new invoice"""
@@ -681,58 +4419,88 @@ def launch_main_app():
         last_name_entry.delete(0, tk.END)
         phone_entry.delete(0, tk.END)
         email_entry.delete(0, tk.END)
+        tax_region_menu.set(FLAT_TAX_RATE)
+        tax_rate_entry.configure(state="normal")
         tax_rate_entry.delete(0, tk.END)
         tax_rate_entry.insert(0, "0")
+        repeat_menu.set("Never")
+        status_menu.set(default_invoice_status())
         clear_item()
         tree.delete(*tree.get_children())
         invoice_list.clear()
         update_totals()
 
+    search_runner = LatestQueryRunner()
+    search_after_id = None
+    last_search_term = None
+
+    @profiled("update_invoice_display")
     def update_invoice_display():
         """Update the invoice display with recent invoices and search results"""
-        # Clear existing items
-        for item in search_tree.get_children():
-            search_tree.delete(item)
+        nonlocal last_search_term
+        search_term = search_entry.get().strip()
+        last_search_term = search_term
+        
+        if not search_term:
+            # If no search term, show recent invoices straight from the cache
+            search_runner.cancel()
+            display_invoice_rows(list(invoice_history), "Recent Invoices")
+            return
+        
+        def query(conn):
+            # Search live and archived invoices
+            return query_invoice_summaries(conn, search_term)
+        
+        # Run the query off the Tk thread and pick the result up when ready
+        generation, future = search_runner.submit(query)
+        main_window.after(10, show_search_results, generation, future, search_term)
+
+    def show_search_results(generation, future, search_term):
+        """Display a finished search unless a newer one has been started"""
+        if not future.done():
+            main_window.after(25, show_search_results, generation, future, search_term)
+            return
+        if not search_runner.is_current(generation):
+            return
+        try:
+            results = future.result()
+        except QueryCancelled:
+            return
+        except sqlite3.Error as e:
+            messagebox.showerror("Database Error", f"Error retrieving invoices: {str(e)}")
+            return
+        
+        display_invoice_rows(results, f"Search Results for '{search_term}'")
+
+    def display_invoice_rows(results, title):
+        """Fill the history tree with invoice summaries"""
+        # Clear existing items
+        search_tree.delete(*search_tree.get_children())
+        results_label.configure(text=title)
         
-        try:
-            conn = sqlite3.connect("admin_accounts.db")
-            cursor = conn.cursor()
-            search_term = search_entry.get().strip()
+        # Display results with alternating colors
+        for i, result in enumerate(results):
+            formatted_result = list(result)
+            formatted_result[3] = f"${result[3]:.2f}"  # Format total as currency
             
-            if search_term:
-                # If there's a search term, search in database
-                cursor.execute("""
-                    SELECT invoice_number, customer_name, date_created, total_amount
-                    FROM invoices
-                    WHERE customer_name LIKE ?
-                    ORDER BY date_created DESC
-                """, (f"%{search_term}%",))
-                results_label.configure(text=f"Search Results for '{search_term}'")
+            if i % 2 == 0:
+                search_tree.insert('', 'end', values=formatted_result, tags=('evenrow',))
             else:
-                # If no search term, show recent invoices
-                cursor.execute("""
-                    SELECT invoice_number, customer_name, date_created, total_amount
-                    FROM invoices
-                    ORDER BY date_created DESC
-                    LIMIT 10
-                """)
-                results_label.configure(text="Recent Invoices")
-            
-            results = cursor.fetchall()
-            conn.close()
-            
-            # Display results with alternating colors
-            for i, result in enumerate(results):
-                formatted_result = list(result)
-                formatted_result[3] = f"${result[3]:.2f}"  # Format total as currency
-                
-                if i % 2 == 0:
-                    search_tree.insert('', 'end', values=formatted_result, tags=('evenrow',))
-                else:
-                    search_tree.insert('', 'end', values=formatted_result, tags=('oddrow',))
-                    
-        except sqlite3.Error as e:
-            messagebox.showerror("Database Error", f"Error retrieving invoices: {str(e)}")
+                search_tree.insert('', 'end', values=formatted_result, tags=('oddrow',))
+
+    def schedule_search(event=None):
+        """Debounce typing in the search box into a single live search"""
+        nonlocal search_after_id
+        if search_entry.get().strip() == last_search_term:
+            return  # Navigation keys and the like, nothing to search for
+        if search_after_id is not None:
+            main_window.after_cancel(search_after_id)
+        search_after_id = main_window.after(SEARCH_DEBOUNCE_MS, run_scheduled_search)
+
+    def run_scheduled_search():
+        nonlocal search_after_id
+        search_after_id = None
+        update_invoice_display()
 
     def clear_invoice_history():
         """Clear the invoice history display"""
@@ -746,6 +4514,7 @@ def launch_main_app():
         """Trigger search and update display"""
         update_invoice_display()
 
+    @profiled("generate_invoice")
     def generate_invoice():
         """Generate and save invoice with validation"""
         try:
@@ -759,85 +4528,42 @@ def launch_main_app():
                 raise ValueError("First name and last name are required")
             if not phone and not email:
                 raise ValueError("Either phone or email is required")
+            if phone and not validate_phone(phone):
+                raise ValueError("Phone number must have 7 to 15 digits, optionally starting with +")
+            if email and not validate_email(email):
+                raise ValueError("Email address is not valid")
             if not invoice_list:
                 raise ValueError("Invoice must have at least one item")
                 
             # Generate invoice number
             invoice_number = f"INV-{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}"
             
-            # Format customer name for filename (remove special characters)
-            customer_name = f"{first_name}_{last_name}"
-            customer_name = "".join(c for c in customer_name if c.isalnum() or c == '_')
-            
-            # Calculate totals
-            subtotal = sum(item[3] for item in invoice_list)
+            # Calculate totals and build the document context
             tax_rate = float(tax_rate_entry.get() or 0)
-            tax_amount = round(subtotal * (tax_rate / 100), 2)
-            total = round(subtotal + tax_amount, 2)
-            
-            # Save to database
-            conn = sqlite3.connect("admin_accounts.db")
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                INSERT INTO invoices (
-                    invoice_number, customer_name, customer_email, customer_phone,
-                    total_amount, tax_rate, tax_amount, subtotal,
-                    created_by, status
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                invoice_number,
-                f"{first_name} {last_name}",
-                email,
-                phone,
-                total,
-                tax_rate,
-                tax_amount,
-                subtotal,
-                logged_in_admin,
-                "Paid"
-            ))
+            context = build_invoice_context(invoice_number, f"{first_name} {last_name}",
+                                            phone, email, invoice_list, tax_rate, logged_in_admin,
+                                            region=selected_tax_region())
+            cadence = repeat_menu.get().lower()
+            status = status_menu.get()
             
-            invoice_id = cursor.lastrowid
+            # Save to database, with a recurring definition if one was requested
+            def insert_new_invoice(cursor):
+                invoice_id, date_created = insert_invoice(cursor, context, status)
+                if cadence in RECURRING_CADENCES:
+                    create_recurring_invoice(cursor, context, cadence,
+                                             add_cadence(datetime.date.today(), cadence))
+                return invoice_id, date_created
             
-            # Save invoice items
-            for item in invoice_list:
-                cursor.execute("""
-                    INSERT INTO invoice_items (
-                        invoice_id, description, quantity, unit_price, total_price
-                    ) VALUES (?, ?, ?, ?, ?)
-                """, (invoice_id, item[1], item[0], item[2], item[3]))
+            invoice_id, date_created = get_db_writer().submit(insert_new_invoice).result()
+            record_invoice_history((invoice_number, context["name"], date_created, context["total"]))
             
-            conn.commit()
-            conn.close()
-            
-            # Generate document
-            doc = DocxTemplate("pyinvoice.docx")
-            doc.render({
-                "admin_name": logged_in_admin,
-                "company_name": "Your Company",
-                "company_address": "123 Business St",
-                "company_phone": "123-456-7890",
-                "invoice_number": invoice_number,
-                "name": f"{first_name} {last_name}",
-                "phone": phone,
-                "email": email,
-                "invoice_list": invoice_list,
-                "subtotal": subtotal,
-                "tax": tax_amount,
-                "tax_rate": tax_rate,
-                "total": total,
-                "date": datetime.datetime.now().strftime("%Y-%m-%d")
-            })
-            
-            # Save document with new naming format
-            doc_name = f"INV_{invoice_number}_{customer_name}.docx"
-            doc.save(doc_name)
+            # Save document with new naming format into the sharded store
+            doc_path = store_invoice_document(invoice_id, context, f"{first_name}_{last_name}")
             
             # Update display
             update_invoice_display()
             
-            messagebox.showinfo("Success", f"Invoice {invoice_number} has been generated and saved as {doc_name}")
+            messagebox.showinfo("Success", f"Invoice {invoice_number} has been generated and saved as {doc_path}")
             new_invoice()
             
         except ValueError as e:
@@ -845,8 +4571,170 @@ def launch_main_app():
         except Exception as e:
             messagebox.showerror("Error", f"An error occurred: {str(e)}")
 
+    # Reusable invoice details window, created on first use
+    details_view = {}
+
+    def build_details_window():
+        """Create the invoice details window and keep its widgets for rebinding"""
+        details_window = ctk.CTkToplevel()
+        details_window.geometry("800x600")
+        # Hide instead of destroying so the next invoice only rebinds data
+        details_window.protocol("WM_DELETE_WINDOW", details_window.withdraw)
+        
+        # Main frame
+        main_frame = ctk.CTkFrame(details_window)
+        main_frame.pack(fill="both", expand=True, padx=20, pady=20)
+        
+        # Header frame
+        header_frame = ctk.CTkFrame(main_frame)
+        header_frame.pack(fill="x", padx=10, pady=10)
+        
+        # Invoice details
+        number_label = ctk.CTkLabel(header_frame, font=('Aptos Black', 16))
+        number_label.pack(pady=5)
+        header_labels = []
+        for _ in range(5):  # Customer, email, phone, date, status
+            label = ctk.CTkLabel(header_frame, font=('Aptos Black', 14))
+            label.pack(pady=2)
+            header_labels.append(label)
+        
+        # Receivable actions for the invoice on display
+        actions_frame = ctk.CTkFrame(header_frame, fg_color="transparent")
+        actions_frame.pack(pady=5)
+        action_buttons = {}
+        for action, text in (("Sent", "Mark Sent"), ("Payment", "Record Payment"), ("Void", "Void")):
+            button = ctk.CTkButton(actions_frame, text=text, width=120,
+                                   command=lambda action=action: apply_invoice_action(action))
+            button.pack(side="left", padx=5)
+            action_buttons[action] = button
+        
+        # Items frame
+        items_frame = ctk.CTkFrame(main_frame)
+        items_frame.pack(fill="both", expand=True, padx=10, pady=10)
+        
+        # Create treeview for items
+        columns = ('description', 'quantity', 'price', 'total')
+        items_tree = ttk.Treeview(items_frame, columns=columns, show="headings", height=10)
+        
+        # Configure columns
+        items_tree.heading('description', text='Description', anchor='w')
+        items_tree.heading('quantity', text='Quantity', anchor='center')
+        items_tree.heading('price', text='Unit Price', anchor='e')
+        items_tree.heading('total', text='Total', anchor='e')
+        
+        items_tree.column('description', width=400, anchor='w')
+        items_tree.column('quantity', width=100, anchor='center')
+        items_tree.column('price', width=150, anchor='e')
+        items_tree.column('total', width=150, anchor='e')
+        
+        # Add scrollbars
+        v_scrollbar = ttk.Scrollbar(items_frame, orient="vertical", command=items_tree.yview)
+        h_scrollbar = ttk.Scrollbar(items_frame, orient="horizontal", command=items_tree.xview)
+        items_tree.configure(yscrollcommand=v_scrollbar.set, xscrollcommand=h_scrollbar.set)
+        
+        # Pack tree and scrollbars
+        items_tree.pack(side="left", fill="both", expand=True)
+        v_scrollbar.pack(side="right", fill="y")
+        h_scrollbar.pack(side="bottom", fill="x")
+        
+        # Totals Frame with tax information
+        totals_frame = ctk.CTkFrame(main_frame, fg_color="transparent")
+        totals_frame.pack(fill="x", pady=10, padx=10)
+        
+        totals_labels = []
+        for _ in range(3):  # Subtotal, tax rate, tax amount
+            label = ctk.CTkLabel(totals_frame, font=('Aptos', 14), text_color="#ffffff")
+            label.pack(side="left", padx=10)
+            totals_labels.append(label)
+        total_label = ctk.CTkLabel(totals_frame, font=('Aptos Black', 16), text_color="#0078D7")
+        total_label.pack(side="left", padx=10)
+        
+        details_view.update(window=details_window, number=number_label, header=header_labels,
+                            actions=action_buttons, items=items_tree, totals=totals_labels,
+                            total=total_label)
+
+    def show_invoice_details(details):
+        """Bind invoice details to the reusable window and bring it up"""
+        if not details_view or not details_view["window"].winfo_exists():
+            build_details_window()
+        invoice_data = details["invoice"]
+        
+        details_view["window"].title(f"Invoice Details - {invoice_data[0]}")
+        details_view["number"].configure(text=f"Invoice Number: {invoice_data[0]}")
+        status = invoice_data[9] or "Draft"
+        outstanding = round((invoice_data[5] or 0) - (invoice_data[10] or 0), 2)
+        status_text = f"Status: {status}"
+        if status not in ("Paid", "Void") and invoice_data[10] is not None:
+            status_text += f" (${outstanding:.2f} outstanding)"
+        for label, text in zip(details_view["header"], (f"Customer: {invoice_data[1]}",
+                                                        f"Email: {invoice_data[2]}",
+                                                        f"Phone: {invoice_data[3]}",
+                                                        f"Date: {invoice_data[4]}",
+                                                        status_text)):
+            label.configure(text=text)
+        
+        # Archived invoices are closed, so only live ones offer actions
+        allowed = INVOICE_STATUS_TRANSITIONS.get(status, ()) if invoice_data[10] is not None else ()
+        for action, button in details_view["actions"].items():
+            enabled = "Paid" in allowed if action == "Payment" else action in allowed
+            button.configure(state="normal" if enabled else "disabled")
+        details_view.update(invoice_number=invoice_data[0], outstanding=outstanding)
+        
+        # Replace items in treeview
+        items_tree = details_view["items"]
+        items_tree.delete(*items_tree.get_children())
+        for item in details["items"]:
+            items_tree.insert('', 'end', values=(
+                item[0],  # description
+                item[1],  # quantity
+                f"${item[2]:.2f}",  # unit price
+                f"${item[3]:.2f}"   # total
+            ))
+        
+        # Add tax information and totals
+        subtotal = invoice_data[8] if invoice_data[8] is not None else 0
+        tax_rate = invoice_data[6] if invoice_data[6] is not None else 0
+        tax_amount = invoice_data[7] if invoice_data[7] is not None else 0
+        total = invoice_data[5] if invoice_data[5] is not None else 0
+        for label, text in zip(details_view["totals"], (f"Subtotal: ${subtotal:.2f}",
+                                                        f"Tax Rate: {tax_rate}%",
+                                                        f"Tax Amount: ${tax_amount:.2f}")):
+            label.configure(text=text)
+        details_view["total"].configure(text=f"Total: ${total:.2f}")
+        
+        details_view["window"].deiconify()
+        details_view["window"].lift()
+
+    def apply_invoice_action(action):
+        """Mark the displayed invoice Sent or Void, or record a payment against it"""
+        invoice_number = details_view["invoice_number"]
+        try:
+            if action == "Payment":
+                dialog = ctk.CTkInputDialog(
+                    text=f"Amount received (${details_view['outstanding']:.2f} outstanding):",
+                    title="Record Payment")
+                value = dialog.get_input()
+                if not value:
+                    return
+                record_payment(invoice_number, float(value), recorded_by=logged_in_admin)
+            else:
+                if action == "Void" and not messagebox.askyesno(
+                        "Void Invoice", f"Void invoice {invoice_number}? This cannot be undone."):
+                    return
+                set_invoice_status(invoice_number, action, logged_in_admin)
+        except ValueError as e:
+            messagebox.showerror("Invoice Status", str(e))
+            return
+        except sqlite3.Error as e:
+            messagebox.showerror("Database Error", f"Error updating invoice: {str(e)}")
+            return
+        details = get_invoice_details_cache().get(invoice_number)
+        if details:
+            show_invoice_details(details)
+
+    @profiled("view_invoice_details")
     def view_invoice_details(event):
-        """Display invoice details in a new window when double-clicking an invoice"""
+        """Display invoice details in the details window when double-clicking an invoice"""
         try:
             # Get selected item
             selected_item = search_tree.selection()
@@ -856,132 +4744,28 @@ def launch_main_app():
             # Get invoice number from selected item
             invoice_number = search_tree.item(selected_item[0])['values'][0]
             
-            # Connect to database
-            conn = sqlite3.connect("admin_accounts.db")
-            cursor = conn.cursor()
-            
-            # Get invoice details including tax information
-            cursor.execute("""
-                SELECT i.invoice_number, i.customer_name, i.customer_email, i.customer_phone,
-                       i.date_created, i.total_amount, i.tax_rate, i.tax_amount, i.subtotal
-                FROM invoices i
-                WHERE i.invoice_number = ?
-            """, (invoice_number,))
-            
-            invoice_data = cursor.fetchone()
-            if not invoice_data:
+            cache = get_invoice_details_cache()
+            details = cache.get(invoice_number)
+            if not details:
                 messagebox.showerror("Error", "Invoice not found")
                 return
+            show_invoice_details(details)
             
-            # Get invoice items
-            cursor.execute("""
-                SELECT description, quantity, unit_price, total_price
-                FROM invoice_items
-                WHERE invoice_id = (SELECT id FROM invoices WHERE invoice_number = ?)
-                ORDER BY id
-            """, (invoice_number,))
-            
-            items = cursor.fetchall()
-            conn.close()
-            
-            # Create new window for invoice details
-            details_window = ctk.CTkToplevel()
-            details_window.title(f"Invoice Details - {invoice_number}")
-            details_window.geometry("800x600")
-            
-            # Main frame
-            main_frame = ctk.CTkFrame(details_window)
-            main_frame.pack(fill="both", expand=True, padx=20, pady=20)
-            
-            # Header frame
-            header_frame = ctk.CTkFrame(main_frame)
-            header_frame.pack(fill="x", padx=10, pady=10)
-            
-            # Invoice details
-            ctk.CTkLabel(header_frame, text=f"Invoice Number: {invoice_data[0]}", 
-                        font=('Aptos Black', 16)).pack(pady=5)
-            ctk.CTkLabel(header_frame, text=f"Customer: {invoice_data[1]}", 
-                        font=('Aptos Black', 14)).pack(pady=2)
-            ctk.CTkLabel(header_frame, text=f"Email: {invoice_data[2]}", 
-                        font=('Aptos Black', 14)).pack(pady=2)
-            ctk.CTkLabel(header_frame, text=f"Phone: {invoice_data[3]}", 
-                        font=('Aptos Black', 14)).pack(pady=2)
-            ctk.CTkLabel(header_frame, text=f"Date: {invoice_data[4]}", 
-                        font=('Aptos Black', 14)).pack(pady=2)
-            
-            # Items frame
-            items_frame = ctk.CTkFrame(main_frame)
-            items_frame.pack(fill="both", expand=True, padx=10, pady=10)
-            
-            # Create treeview for items
-            columns = ('description', 'quantity', 'price', 'total')
-            items_tree = ttk.Treeview(items_frame, columns=columns, show="headings", height=10)
-            
-            # Configure columns
-            items_tree.heading('description', text='Description', anchor='w')
-            items_tree.heading('quantity', text='Quantity', anchor='center')
-            items_tree.heading('price', text='Unit Price', anchor='e')
-            items_tree.heading('total', text='Total', anchor='e')
-            
-            items_tree.column('description', width=400, anchor='w')
-            items_tree.column('quantity', width=100, anchor='center')
-            items_tree.column('price', width=150, anchor='e')
-            items_tree.column('total', width=150, anchor='e')
-            
-            # Add scrollbars
-            v_scrollbar = ttk.Scrollbar(items_frame, orient="vertical", command=items_tree.yview)
-            h_scrollbar = ttk.Scrollbar(items_frame, orient="horizontal", command=items_tree.xview)
-            items_tree.configure(yscrollcommand=v_scrollbar.set, xscrollcommand=h_scrollbar.set)
-            
-            # Pack tree and scrollbars
-            items_tree.pack(side="left", fill="both", expand=True)
-            v_scrollbar.pack(side="right", fill="y")
-            h_scrollbar.pack(side="bottom", fill="x")
-            
-            # Add items to treeview
-            for item in items:
-                items_tree.insert('', 'end', values=(
-                    item[0],  # description
-                    item[1],  # quantity
-                    f"${item[2]:.2f}",  # unit price
-                    f"${item[3]:.2f}"   # total
-                ))
-            
-            # Totals Frame with tax information
-            totals_frame = ctk.CTkFrame(main_frame, fg_color="transparent")
-            totals_frame.pack(fill="x", pady=10, padx=10)
-            
-            # Add tax information and totals
-            subtotal = invoice_data[8] if invoice_data[8] is not None else 0
-            tax_rate = invoice_data[6] if invoice_data[6] is not None else 0
-            tax_amount = invoice_data[7] if invoice_data[7] is not None else 0
-            total = invoice_data[5] if invoice_data[5] is not None else 0
-            
-            ctk.CTkLabel(totals_frame, 
-                        text=f"Subtotal: ${subtotal:.2f}",
-                        font=('Aptos', 14),
-                        text_color="#ffffff").pack(side="left", padx=10)
-            
-            ctk.CTkLabel(totals_frame, 
-                        text=f"Tax Rate: {tax_rate}%",
-                        font=('Aptos', 14),
-                        text_color="#ffffff").pack(side="left", padx=10)
-            
-            ctk.CTkLabel(totals_frame, 
-                        text=f"Tax Amount: ${tax_amount:.2f}",
-                        font=('Aptos', 14),
-                        text_color="#ffffff").pack(side="left", padx=10)
-            
-            ctk.CTkLabel(totals_frame, 
-                        text=f"Total: ${total:.2f}",
-                        font=('Aptos Black', 16),
-                        text_color="#0078D7").pack(side="left", padx=10)
+            # Warm the cache with the neighbouring rows for quick browsing
+            neighbours = [search_tree.prev(selected_item[0]), search_tree.next(selected_item[0])]
+            cache.prefetch([search_tree.item(row)['values'][0] for row in neighbours if row])
             
         except sqlite3.Error as e:
             messagebox.showerror("Database Error", f"Error viewing invoice: {str(e)}")
         except Exception as e:
             messagebox.showerror("Error", f"An error occurred: {str(e)}")
 
+    def on_search_select(event):
+        """Follow the selection with the details window while it is open"""
+        if details_view and details_view["window"].winfo_exists() \
+                and details_view["window"].winfo_viewable():
+            view_invoice_details(event)
+
     # New Invoice Form
     customer_frame = ctk.CTkFrame(new_invoice_tab,
                                 fg_color="#2b2b2b",
@@ -1037,9 +4821,9 @@ def launch_main_app():
     # Add phone number validation
     def validate_phone_input(event=None):
         value = phone_entry.get()
-        # Remove any non-digit characters
-        new_value = ''.join(filter(str.isdigit, value))
-        # If the value changed (had non-digits), update the entry
+        # Remove any non-digit characters but a leading +
+        new_value = normalize_phone(value)
+        # If the value changed (had other characters), update the entry
         if new_value != value:
             phone_entry.delete(0, tk.END)
             phone_entry.insert(0, new_value)
@@ -1072,10 +4856,74 @@ def launch_main_app():
     tax_rate_entry.insert(0, "0")
     tax_rate_entry.grid(row=5, column=0, padx=10, pady=5)
     
+    # Repeat cadence; anything but Never also stores a recurring definition
+    ctk.CTkLabel(info_grid, 
+                text="Repeat", 
+                font=('Aptos', 12),
+                text_color="#ffffff").grid(row=4, column=1, padx=10, pady=5, sticky="w")
+    repeat_menu = ctk.CTkOptionMenu(info_grid,
+                                    values=["Never"] + [cadence.title() for cadence in RECURRING_CADENCES],
+                                    command=refresh_preview_header,
+                                    width=200,
+                                    height=35,
+                                    font=('Aptos', 12),
+                                    corner_radius=8)
+    repeat_menu.set("Never")
+    repeat_menu.grid(row=5, column=1, padx=10, pady=5)
+    
+    # Tax region; picking one taxes each line by the compiled tax rules
+    ctk.CTkLabel(info_grid, 
+                text="Tax Rules", 
+                font=('Aptos', 12),
+                text_color="#ffffff").grid(row=6, column=0, padx=10, pady=5, sticky="w")
+    tax_engine = get_tax_engine()
+    tax_region_menu = ctk.CTkOptionMenu(info_grid,
+                                        values=[FLAT_TAX_RATE] + ([ANY_TAX_REGION] if tax_engine.has_rules() else [])
+                                               + tax_engine.regions(),
+                                        command=on_tax_region_change,
+                                        width=200,
+                                        height=35,
+                                        font=('Aptos', 12),
+                                        corner_radius=8)
+    tax_region_menu.set(FLAT_TAX_RATE)
+    tax_region_menu.grid(row=7, column=0, padx=10, pady=5)
+    
+    # Status the invoice is created with; Sent invoices count as receivables
+    ctk.CTkLabel(info_grid, 
+                text="Status", 
+                font=('Aptos', 12),
+                text_color="#ffffff").grid(row=6, column=1, padx=10, pady=5, sticky="w")
+    status_menu = ctk.CTkOptionMenu(info_grid,
+                                    values=["Paid", "Sent", "Draft"],
+                                    command=refresh_preview_header,
+                                    width=200,
+                                    height=35,
+                                    font=('Aptos', 12),
+                                    corner_radius=8)
+    status_menu.set(default_invoice_status())
+    status_menu.grid(row=7, column=1, padx=10, pady=5)
+    
+    # Keep the preview header in step with the customer fields
+    for entry in (first_name_entry, last_name_entry, phone_entry, email_entry):
+        entry.bind('<KeyRelease>', refresh_preview_header, add="+")
+    tax_rate_entry.bind('<KeyRelease>', on_tax_rate_edit, add="+")
+    
     # Create a container frame for items
     items_container = ctk.CTkFrame(new_invoice_tab)
     items_container.pack(padx=20, pady=20, fill="both", expand=True)
     
+    # Live preview, drawn from invoice_list and the customer fields
+    preview_frame = ctk.CTkFrame(items_container)
+    preview_frame.pack(side="right", fill="y", padx=(10, 0), pady=(0, 10))
+    ctk.CTkLabel(preview_frame, text="Preview", font=('Aptos Black', 16)).pack(pady=10)
+    preview_text = ctk.CTkTextbox(preview_frame,
+                                  width=PREVIEW_WIDTH * 8 + 20,
+                                  font=('Consolas', 12),
+                                  wrap="none",
+                                  state="disabled")
+    preview_text.pack(fill="both", expand=True, padx=10, pady=(0, 10))
+    preview = InvoicePreview(preview_text)
+    
     # Items Frame
     items_frame = ctk.CTkFrame(items_container)
     items_frame.pack(padx=0, pady=(0, 10), fill="both", expand=True)
@@ -1111,6 +4959,12 @@ def launch_main_app():
     clear_btn = ctk.CTkButton(entry_frame, text="Clear", command=clear_item)
     clear_btn.pack(side="left", padx=5)
     
+    # Bulk entry buttons
+    paste_items_btn = ctk.CTkButton(entry_frame, text="Paste Items", command=paste_items)
+    paste_items_btn.pack(side="left", padx=5)
+    import_items_btn = ctk.CTkButton(entry_frame, text="Import Items", command=import_items)
+    import_items_btn.pack(side="left", padx=5)
+    
     # Create Treeview for items
     tree_frame = ctk.CTkFrame(items_frame)
     tree_frame.pack(fill="both", expand=True, pady=10)
@@ -1185,6 +5039,9 @@ def launch_main_app():
     generate_invoice_btn.bind("<Enter>", on_enter)
     generate_invoice_btn.bind("<Leave>", on_leave)
     
+    # Draw the empty preview
+    update_totals()
+    
     # Search and History Tab
     search_frame = ctk.CTkFrame(search_tab,
                                fg_color="#2b2b2b",
@@ -1209,6 +5066,7 @@ def launch_main_app():
                                corner_radius=8)
     search_entry.pack(side="left", padx=10)
     search_entry.bind('<Return>', lambda event: search_invoices())
+    search_entry.bind('<KeyRelease>', schedule_search, add="+")
     
     # Search Button with modern styling
     search_btn = ctk.CTkButton(search_section, 
@@ -1288,6 +5146,7 @@ def launch_main_app():
 
     # Bind double-click event to search tree
     search_tree.bind('<Double-1>', view_invoice_details)
+    search_tree.bind('<<TreeviewSelect>>', on_search_select)
 
     # Items Management Tab
     items_frame = ctk.CTkFrame(items_tab,
@@ -1405,6 +5264,18 @@ def launch_main_app():
                                    hover_color="#c82333")
     delete_item_btn.pack(side="left", padx=5)
     
+    # Import Catalog Button
+    import_catalog_btn = ctk.CTkButton(button_frame, 
+                                      text="Import Catalog", 
+                                      font=('Aptos Black', 14),
+                                      command=import_catalog_file,
+                                      width=150,
+                                      height=40,
+                                      corner_radius=10,
+                                      fg_color="#0078D7",
+                                      hover_color="#005a9e")
+    import_catalog_btn.pack(side="left", padx=5)
+    
     # Add hover effects
     def on_enter_add_item(e):
         add_item_button.configure(fg_color="#005a9e")
@@ -1476,18 +5347,1077 @@ def launch_main_app():
     # Load existing items
     load_items()
 
-    # Initialize the invoice display
+    # Initialize the recent invoices cache and the invoice display
+    try:
+        load_invoice_history()
+    except sqlite3.Error as e:
+        messagebox.showerror("Database Error", f"Error loading recent invoices: {str(e)}")
     update_invoice_display()
+    
+    # Sent invoices past their payment terms become Overdue
+    try:
+        mark_overdue_invoices()
+    except sqlite3.Error as e:
+        messagebox.showerror("Database Error", f"Error updating overdue invoices: {str(e)}")
+    
+    # Issue due recurring invoices in the background during off-peak windows
+    RecurringInvoiceScheduler().start()
+    
+    # Database maintenance once the user has been idle for a while
+    idle_maintenance = IdleMaintenance()
+    main_window.bind_all("<Any-KeyPress>", idle_maintenance.note_activity, add="+")
+    main_window.bind_all("<Any-ButtonPress>", idle_maintenance.note_activity, add="+")
+    
+    def poll_idle_maintenance():
+        idle_maintenance.poll()
+        main_window.after(60000, poll_idle_maintenance)
+    
+    main_window.after(60000, poll_idle_maintenance)
+    
+    # Hidden developer menu (Ctrl+Alt+P) to profile GUI actions in the field
+    profiling_enabled = tk.BooleanVar(value=get_profiler().enabled)
+    developer_menu = tk.Menu(main_window, tearoff=0)
+    developer_menu.add_checkbutton(label="Profile GUI actions",
+                                   variable=profiling_enabled,
+                                   command=lambda: setattr(get_profiler(), "enabled", profiling_enabled.get()))
+    developer_menu.add_command(label=f"Profiles: {os.path.abspath(get_profiler().directory)}",
+                               state="disabled")
+    main_window.bind("<Control-Alt-p>", lambda e: developer_menu.tk_popup(e.x_root, e.y_root))
 
     main_window.mainloop()
 
-# --- Login UI ---
+# --- Load Test ---
+# Mixed workloads against a scratch copy of the database, to find where
+# concurrent workstations start queueing on the write lock
+LOAD_TEST_ADMIN = "loadtest"
+LOAD_TEST_CATALOG_SIZE = 200
+LOAD_TEST_CUSTOMERS = 100
+LOAD_TEST_MIX = {"login": 10, "item_lookup": 40, "history_search": 30, "generate": 20}
+
+def prepare_load_test_directory(directory: str, source: str = DATABASE_FILE,
+                                template_path: str = "pyinvoice.docx") -> None:
+    """Copy the database, template and settings into a scratch directory.
+
+    The copy gets a load test admin (password = username) with a catalog.
+    """
+    os.makedirs(directory, exist_ok=True)
+    src = connect_database(source)
+    dst = sqlite3.connect(os.path.join(directory, DATABASE_FILE))
+    try:
+        src.backup(dst)
+        with dst:
+            dst.execute("""
+                INSERT INTO admins (username, password) VALUES (?, ?)
+                ON CONFLICT(username) DO UPDATE SET
+                    password = excluded.password, failed_attempts = 0, account_locked = 0
+            """, (LOAD_TEST_ADMIN, LOAD_TEST_ADMIN))
+            dst.executemany("""
+                INSERT OR IGNORE INTO items (name, description, unit_price, category, created_by)
+                VALUES (?, ?, ?, ?, ?)
+            """, [(f"Load item {i}", "Load test item", round(5 + i % 50 * 1.5, 2), f"Category {i % 8}",
+                   LOAD_TEST_ADMIN) for i in range(LOAD_TEST_CATALOG_SIZE)])
+    finally:
+        src.close()
+        dst.close()
+    shutil.copy(template_path, os.path.join(directory, os.path.basename(template_path)))
+    if os.path.exists(SETTINGS_FILE):
+        shutil.copy(SETTINGS_FILE, os.path.join(directory, SETTINGS_FILE))
+
+def _load_login(conn: sqlite3.Connection, rng: random.Random, state: Dict[str, Any]) -> None:
+    outcome, _ = authenticate_admin(LOAD_TEST_ADMIN, LOAD_TEST_ADMIN)
+    if outcome != "ok":
+        raise RuntimeError(f"Load test login failed: {outcome}")
+
+def _load_item_lookup(conn: sqlite3.Connection, rng: random.Random, state: Dict[str, Any]) -> None:
+    # Same query the Items tab runs
+    conn.execute("""
+        SELECT name, description, unit_price, category
+        FROM items
+        WHERE created_by = ?
+        ORDER BY category, name
+    """, (LOAD_TEST_ADMIN,)).fetchall()
+
+def _load_history_search(conn: sqlite3.Connection, rng: random.Random, state: Dict[str, Any]) -> None:
+    query_invoice_summaries(conn, f"Load customer {rng.randrange(LOAD_TEST_CUSTOMERS)}")
+
+def _load_generate(conn: sqlite3.Connection, rng: random.Random, state: Dict[str, Any]) -> None:
+    state["generated"] += 1
+    invoice_list = []
+    for _ in range(rng.randint(1, 10)):
+        qty, price = rng.randint(1, 5), round(5 + rng.randrange(50) * 1.5, 2)
+        invoice_list.append([qty, f"Load item {rng.randrange(LOAD_TEST_CATALOG_SIZE)}", price,
+                             round(qty * price, 2)])
+    customer = f"Load customer {rng.randrange(LOAD_TEST_CUSTOMERS)}"
+    context = build_invoice_context(
+        f"{state['prefix']}-{state['generated']}", customer, "555-0100",
+        "load@example.com", invoice_list, 5.0, LOAD_TEST_ADMIN)
+    invoice_id, _ = get_db_writer().submit(
+        lambda cursor: insert_invoice(cursor, context, default_invoice_status())).result()
+    if state["render"]:
+        store_invoice_document(invoice_id, context, customer.replace(" ", "_"))
+
+LOAD_TEST_OPERATIONS = {
+    "login": _load_login,
+    "item_lookup": _load_item_lookup,
+    "history_search": _load_history_search,
+    "generate": _load_generate,
+}
+
+def parse_load_test_mix(text: str) -> Dict[str, int]:
+    """Parse operation weights such as "login=10,generate=5" """
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in LOAD_TEST_OPERATIONS:
+            raise ValueError(f"Unknown operation '{name}', expected one of {', '.join(LOAD_TEST_OPERATIONS)}")
+        mix[name] = int(weight or 1)
+    if not any(weight > 0 for weight in mix.values()):
+        raise ValueError("The mix needs at least one operation with a positive weight")
+    return mix
+
+def _is_lock_error(error: Exception) -> bool:
+    return isinstance(error, sqlite3.OperationalError) and ("locked" in str(error) or "busy" in str(error))
+
+def _load_test_worker(worker: int, mix: Dict[str, int], interval: float, duration: float,
+                      seed: int, render: bool, barrier=None) -> Dict[str, Any]:
+    """Run operations from the mix for duration seconds, one every interval.
+
+    Latency is measured from each operation's scheduled start, so time spent
+    behind schedule counts against it instead of quietly lowering the rate.
+    An interval of 0 runs operations back to back.
+    """
+    rng = random.Random(seed + worker)
+    names = [name for name, weight in mix.items() if weight > 0]
+    weights = [mix[name] for name in names]
+    # Invoice numbers must not repeat across runs against the same scratch database
+    state = {"prefix": f"LT-{time.time_ns():x}-{worker}", "generated": 0, "render": render}
+    latencies = {name: [] for name in names}
+    errors = dict.fromkeys(names, 0)
+    locked = dict.fromkeys(names, 0)
+    messages = {}
+    conn = connect_database()
+    try:
+        # Warm up caches and the compiled template outside the measurement
+        for name in names:
+            try:
+                LOAD_TEST_OPERATIONS[name](conn, rng, state)
+            except Exception:
+                pass
+        if barrier is not None:
+            barrier.wait()
+        start = time.time()
+        deadline = start + duration
+        # Stagger workers across one interval so they do not fire together
+        scheduled = start + interval * rng.random()
+        while True:
+            if interval:
+                if scheduled >= deadline:
+                    break
+                delay = scheduled - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                began = scheduled
+                scheduled += interval
+            else:
+                began = time.time()
+                if began >= deadline:
+                    break
+            name = rng.choices(names, weights)[0]
+            try:
+                LOAD_TEST_OPERATIONS[name](conn, rng, state)
+            except Exception as e:
+                if _is_lock_error(e):
+                    locked[name] += 1
+                else:
+                    errors[name] += 1
+                messages.setdefault(name, f"{type(e).__name__}: {e}")
+                continue
+            latencies[name].append(time.time() - began)
+        elapsed = time.time() - start
+    finally:
+        conn.close()
+    return {"latencies": latencies, "errors": errors, "locked": locked, "messages": messages,
+            "elapsed": elapsed}
+
+def _writer_lock_stats() -> Dict[str, float]:
+    if _db_writer is None:
+        return {"lock_wait_seconds": 0.0, "lock_wait_max": 0.0, "commits": 0}
+    return {"lock_wait_seconds": _db_writer.lock_wait_seconds,
+            "lock_wait_max": _db_writer.lock_wait_max, "commits": _db_writer.commits}
+
+def _load_test_process(directory, results, barrier, *arguments) -> None:
+    # Entry point of a worker process: one process stands in for one workstation.
+    # Importing this module moved to the application directory, so move back
+    os.chdir(directory)
+    try:
+        result = _load_test_worker(*arguments, barrier=barrier)
+    except Exception as e:
+        result = {"failed": str(e)}
+    if _db_writer is not None:
+        _db_writer.stop()
+    result["writer"] = _writer_lock_stats()
+    results.put(result)
+
+def _percentile(ordered: List[float], fraction: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+@profiled("load_test")
+def run_load_test(directory: str, workers: int = 4, rate: float = 0.0, duration: float = 30.0,
+                  mix: Optional[Dict[str, int]] = None, processes: bool = False,
+                  render: bool = True, seed: int = 0) -> Dict[str, Any]:
+    """Run a mixed workload against the database in a prepared scratch directory.
+
+    rate is the target operations per second across all workers (0 = as
+    fast as they can go). Threads share this process's database writer like
+    one busy workstation; with processes each worker has its own writer and
+    competes for the write lock like a separate workstation. Returns per
+    operation throughput, latency percentiles and error counts, plus the time
+    writers spent waiting for the write lock.
+    """
+    mix = mix or LOAD_TEST_MIX
+    directory = os.path.abspath(directory)
+    interval = workers / rate if rate else 0.0
+    previous_directory = os.getcwd()
+    writer_was_running = _db_writer is not None and _db_writer.running
+    if _db_writer is not None:
+        _db_writer.stop()
+    os.chdir(directory)
+    try:
+        if _db_writer is not None:
+            _db_writer.start()  # Reopens on the scratch database
+        if processes:
+            context = multiprocessing.get_context("spawn")
+            results, barrier = context.Queue(), context.Barrier(workers)
+            children = [context.Process(target=_load_test_process,
+                                        args=(directory, results, barrier, worker, mix, interval,
+                                              duration, seed, render),
+                                        name=f"LoadTest-{worker}")
+                        for worker in range(workers)]
+            for child in children:
+                child.start()
+            outcomes = [results.get() for _ in children]
+            for child in children:
+                child.join()
+        else:
+            before = _writer_lock_stats()
+            barrier = threading.Barrier(workers)
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="LoadTest") as pool:
+                futures = [pool.submit(_load_test_worker, worker, mix, interval, duration, seed, render, barrier)
+                           for worker in range(workers)]
+                outcomes = [future.result() for future in futures]
+            if _db_writer is not None:
+                _db_writer.flush()
+            after = _writer_lock_stats()
+            outcomes[0]["writer"] = {key: after[key] - before[key] for key in after}
+            outcomes[0]["writer"]["lock_wait_max"] = after["lock_wait_max"]
+    finally:
+        if _db_writer is not None:
+            _db_writer.stop()
+        os.chdir(previous_directory)
+        if writer_was_running:
+            _db_writer.start()
+
+    failed = [outcome["failed"] for outcome in outcomes if "failed" in outcome]
+    if failed:
+        raise RuntimeError(f"Load test worker failed: {failed[0]}")
+    elapsed = max(outcome["elapsed"] for outcome in outcomes)
+    operations = {}
+    for name in mix:
+        samples = sorted(value for outcome in outcomes for value in outcome["latencies"].get(name, []))
+        operations[name] = {
+            "count": len(samples),
+            "throughput": len(samples) / elapsed if elapsed else 0.0,
+            "p50": _percentile(samples, 0.50),
+            "p90": _percentile(samples, 0.90),
+            "p99": _percentile(samples, 0.99),
+            "max": samples[-1] if samples else 0.0,
+            "errors": sum(outcome["errors"].get(name, 0) for outcome in outcomes),
+            "locked": sum(outcome["locked"].get(name, 0) for outcome in outcomes),
+            "first_error": next((outcome["messages"][name] for outcome in outcomes
+                                 if name in outcome["messages"]), None),
+        }
+    writers = [outcome["writer"] for outcome in outcomes if "writer" in outcome]
+    return {
+        "workers": workers,
+        "mode": "processes" if processes else "threads",
+        "target_rate": rate,
+        "elapsed": elapsed,
+        "operations": operations,
+        "throughput": sum(op["throughput"] for op in operations.values()),
+        "lock_wait_seconds": sum(writer["lock_wait_seconds"] for writer in writers),
+        "lock_wait_max": max((writer["lock_wait_max"] for writer in writers), default=0.0),
+        "commits": sum(writer["commits"] for writer in writers),
+    }
+
+def format_load_test_report(result: Dict[str, Any]) -> str:
+    """Table of a run_load_test() result"""
+    lines = [f"{result['workers']} {result['mode']}, target "
+             f"{result['target_rate'] or 'unlimited'} ops/s, {result['elapsed']:.1f} s",
+             f"{'operation':<15} {'ops':>7} {'ops/s':>8} {'p50 ms':>8} {'p90 ms':>8} "
+             f"{'p99 ms':>8} {'max ms':>8} {'errors':>7} {'locked':>7}"]
+    for name, op in result["operations"].items():
+        lines.append(f"{name:<15} {op['count']:>7} {op['throughput']:>8.1f} {op['p50'] * 1000:>8.1f} "
+                     f"{op['p90'] * 1000:>8.1f} {op['p99'] * 1000:>8.1f} {op['max'] * 1000:>8.1f} "
+                     f"{op['errors']:>7} {op['locked']:>7}")
+    lines.append(f"total: {result['throughput']:.1f} ops/s, {result['commits']} commits, "
+                 f"{result['lock_wait_seconds'] * 1000:.0f} ms waiting for the write lock "
+                 f"(longest {result['lock_wait_max'] * 1000:.0f} ms)")
+    for name, op in result["operations"].items():
+        if op["first_error"]:
+            lines.append(f"first {name} error: {op['first_error']}")
+    return "\n".join(lines)
+
+# --- Command Line ---
+def cli_archive(args) -> int:
+    """Archive closed invoices older than --before into per-year databases"""
+    try:
+        cutoff = datetime.date.fromisoformat(args.before)
+    except ValueError:
+        print(f"Invalid date '{args.before}', expected YYYY-MM-DD")
+        return 2
+    try:
+        archived = archive_invoices(cutoff, archive_dir=args.archive_dir)
+    except sqlite3.Error as e:
+        print(f"Error archiving invoices: {e}")
+        return 1
+    if not archived:
+        print("No invoices to archive.")
+    for year, count in sorted(archived.items()):
+        print(f"{year}: archived {count} invoice(s) to {archive_path(year, args.archive_dir)}")
+    return 0
+
+def cli_bundle(args) -> int:
+    """Roll the documents generated in a date range into one zip bundle"""
+    try:
+        date_from = datetime.date.fromisoformat(args.date_from)
+        date_to = datetime.date.fromisoformat(args.date_to or args.date_from)
+    except ValueError:
+        print("Invalid date, expected YYYY-MM-DD")
+        return 2
+    conn = connect_database()
+    try:
+        paths = [row[0] for row in conn.execute("""
+            SELECT document_path FROM invoices
+            WHERE document_path IS NOT NULL
+              AND date_created >= ? AND date_created < date(?, '+1 day')
+            ORDER BY date_created
+        """, (date_from.isoformat(), date_to.isoformat()))]
+    finally:
+        conn.close()
+    paths = [path for path in paths if os.path.exists(path)]
+    if not paths:
+        print("No documents to bundle.")
+        return 0
+    bundle_name = f"invoices_{date_from:%Y%m%d}_{date_to:%Y%m%d}.zip"
+    bundle_path = get_output_store().bundle(paths, bundle_name, args.bundle_dir)
+    print(f"Bundled {len(paths)} document(s) into {bundle_path}")
+    return 0
+
+def _sample_invoice_context(lines: int) -> Dict[str, Any]:
+    """Build a realistic invoice context for benchmarks"""
+    invoice_list = []
+    for i in range(lines):
+        qty, price = i % 7 + 1, round(3.5 + i % 40 * 1.25, 2)
+        invoice_list.append([qty, f"Service item #{i} & support", price, round(qty * price, 2)])
+    subtotal = round(sum(item[3] for item in invoice_list), 2)
+    return {
+        "admin_name": "admin",
+        "company_name": "Your Company",
+        "company_address": "123 Business St",
+        "company_phone": "123-456-7890",
+        "invoice_number": "INV-20250101120000",
+        "name": "Jane <Doe>",
+        "phone": "123456789",
+        "email": "jane@example.com",
+        "invoice_list": invoice_list,
+        "subtotal": subtotal,
+        "tax": round(subtotal * 0.1, 2),
+        "tax_rate": 10.0,
+        "total": round(subtotal * 1.1, 2),
+        "date": "2025-01-01"
+    }
+
+def cli_benchmark_render(args) -> int:
+    """Compare the docxtpl pipeline with the compiled renderer"""
+    compiled = CompiledDocxTemplate.compile(args.template)
+    if compiled is None:
+        print("Template uses constructs the compiled renderer does not support.")
+        return 1
+    context = _sample_invoice_context(args.lines)
+
+    def docxtpl_render():
+        doc = DocxTemplate(args.template)
+        doc.render(context, autoescape=True)
+        buffer = io.BytesIO()
+        doc.save(buffer)
+        return buffer.getvalue()
+
+    # Both paths must produce the same members
+    with zipfile.ZipFile(io.BytesIO(docxtpl_render())) as expected, \
+            zipfile.ZipFile(io.BytesIO(compiled.render(context))) as actual:
+        if expected.namelist() != actual.namelist():
+            print("Output mismatch: member lists differ")
+            return 1
+        for name in expected.namelist():
+            if expected.read(name) != actual.read(name):
+                print(f"Output mismatch in {name}")
+                return 1
+
+    elapsed = {}
+    for label, render in (("docxtpl", docxtpl_render), ("compiled", lambda: compiled.render(context))):
+        start = time.perf_counter()
+        for _ in range(args.count):
+            render()
+        elapsed[label] = time.perf_counter() - start
+        print(f"{label:>9}: {elapsed[label] / args.count * 1000:8.2f} ms/invoice "
+              f"({args.count / elapsed[label]:8.1f} invoices/s)")
+    print(f"  speedup: {elapsed['docxtpl'] / elapsed['compiled']:.1f}x "
+          f"({args.lines} line items, byte-identical members)")
+    return 0
+
+def cli_benchmark_large(args) -> int:
+    """Measure time and peak memory for invoices with many line items"""
+    compiled = CompiledDocxTemplate.compile(args.template)
+    if compiled is None:
+        print("Template uses constructs the compiled renderer does not support.")
+        return 1
+    print(f"{'lines':>7} {'renderer':>10} {'seconds':>9} {'peak MiB':>9} {'size KiB':>9}")
+    for lines in args.lines:
+        context = _sample_invoice_context(0)
+
+        def rows():
+            for i in range(lines):
+                qty, price = i % 7 + 1, round(3.5 + i % 40 * 1.25, 2)
+                yield [qty, f"Meter reading #{i}", price, round(qty * price, 2)]
+
+        def run_streaming(f):
+            compiled.write_streaming(f, context, rows())
+
+        def run_compiled(f):
+            f.write(compiled.render(dict(context, invoice_list=list(rows()))))
+
+        def run_docxtpl(f):
+            doc = DocxTemplate(args.template)
+            doc.render(dict(context, invoice_list=list(rows())), autoescape=True)
+            doc.save(f)
+
+        renderers = [("streaming", run_streaming), ("compiled", run_compiled)]
+        if lines <= args.docxtpl_max:
+            renderers.append(("docxtpl", run_docxtpl))
+        for label, run in renderers:
+            with tempfile.TemporaryFile() as f:
+                tracemalloc.start()
+                start = time.perf_counter()
+                run(f)
+                elapsed = time.perf_counter() - start
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                size = f.tell()
+            print(f"{lines:>7} {label:>10} {elapsed:>9.2f} {peak / 2**20:>9.1f} {size / 1024:>9.0f}")
+    return 0
+
+def _admin_exists(username: str) -> bool:
+    conn = connect_database()
+    try:
+        return conn.execute("SELECT 1 FROM admins WHERE username = ?", (username,)).fetchone() is not None
+    finally:
+        conn.close()
+
+def cli_import_catalog(args) -> int:
+    """Upsert a CSV/JSONL catalog into the items of an admin"""
+    if not _admin_exists(args.admin):
+        print(f"Unknown admin '{args.admin}'")
+        return 2
+    last_report = [time.perf_counter()]
+
+    def progress(imported):
+        if time.perf_counter() - last_report[0] >= 1:
+            last_report[0] = time.perf_counter()
+            print(f"  {imported} item(s) written...")
+
+    try:
+        result = import_catalog(args.file, args.admin, args.chunk_size, progress)
+    except (OSError, UnicodeDecodeError, csv.Error) as e:
+        print(f"Error reading catalog: {e}")
+        return 1
+    except sqlite3.Error as e:
+        print(f"Error importing catalog: {e}")
+        return 1
+    print(format_catalog_import_report(result))
+    return 0
+
+def cli_run_recurring(args) -> int:
+    """Issue the recurring invoices that are due"""
+    scheduler = RecurringInvoiceScheduler(batch_size=args.batch_size, max_workers=args.workers)
+    if args.list:
+        conn = connect_database()
+        try:
+            due = conn.execute("""
+                SELECT id, customer_name, cadence, next_run FROM recurring_invoices
+                WHERE active = 1 AND next_run <= ?
+                ORDER BY next_run
+            """, (datetime.date.today().isoformat(),)).fetchall()
+        finally:
+            conn.close()
+        for recurring_id, name, cadence, next_run in due:
+            print(f"R{recurring_id}: {name} ({cadence}) due {next_run}")
+        print(f"{len(due)} recurring invoice(s) due.")
+        return 0
+    if not args.force and not in_offpeak_window(datetime.datetime.now(), scheduler.windows):
+        print("Outside the off-peak windows; use --force to run now.")
+        return 0
+    try:
+        outcome = scheduler.run_due(force=args.force)
+    except sqlite3.Error as e:
+        print(f"Error issuing recurring invoices: {e}")
+        return 1
+    print(f"Queued {outcome['queued']} recurring invoice(s), rendered {outcome['rendered']}, "
+          f"failed {outcome['failed']}.")
+    return 1 if outcome["failed"] else 0
+
+def cli_validate_invoices(args) -> int:
+    """Check a bulk invoice file without queueing anything; exit 1 if any row is rejected"""
+    try:
+        result = validate_invoice_file(args.file, args.chunk_rows, args.max_errors)
+    except (OSError, UnicodeDecodeError) as e:
+        print(f"Error reading invoices: {e}")
+        return 2
+    print(format_validation_report(result))
+    if args.errors:
+        with open(args.errors, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["line", "field", "message"])
+            writer.writerows(result["errors"])
+        print(f"Wrote {len(result['errors'])} error(s) to {args.errors}")
+    return 1 if result["rejected"] else 0
+
+def cli_bulk_invoices(args) -> int:
+    """Queue the invoices of a JSONL file as a resumable bulk run and work it off"""
+    if not _admin_exists(args.admin):
+        print(f"Unknown admin '{args.admin}'")
+        return 2
+    run_id = f"bulk:{os.path.basename(args.file)}"
+    status = args.status or default_invoice_status()
+    budget = memory_budget_from_settings(args.memory_budget)
+    report = MemoryReport() if args.memory_report else contextlib.nullcontext()
+    with report:
+        writer = get_db_writer()
+        queued = known = 0
+        try:
+            # Read through a generator, in chunks bounded by count and estimated bytes
+            chunks = chunked_by_budget(
+                read_bulk_invoices(args.file, args.admin), CATALOG_IMPORT_CHUNK_SIZE,
+                budget.limit // 4 if budget else None,
+                lambda entry: estimate_context_bytes(entry[1]) if entry[1] else 0)
+            for chunk in chunks:
+                for key, context, error in chunk:
+                    if error:
+                        print(f"Skipped {error}")
+                entries = [(key, context) for key, context, error in chunk if context is not None]
+
+                def enqueue(cursor, entries=entries):
+                    return sum(enqueue_invoice_job(cursor, run_id, key, context, status)
+                               for key, context in entries)
+
+                added = writer.submit(enqueue).result()
+                queued += added
+                known += len(entries) - added
+        except OSError as e:
+            print(f"Error reading invoices: {e}")
+            return 1
+        print(f"{run_id}: queued {queued} new job(s), {known} already queued")
+        return _work_invoice_jobs(run_id, args.workers, budget, report)
+
+def _work_invoice_jobs(run_id: Optional[str], workers: int,
+                       budget: Optional[MemoryBudget] = None, report=None) -> int:
+    """Run the job runner for a run and print where it stands"""
+    runner = InvoiceJobRunner(max_workers=workers, memory_budget=budget,
+                              checkpoint=report.checkpoint if isinstance(report, MemoryReport) else None)
+    try:
+        outcome = runner.run(run_id)
+    except sqlite3.Error as e:
+        print(f"Error running invoice jobs: {e}")
+        return 1
+    print(f"Rendered {outcome['rendered']} invoice(s), {outcome['failed']} failed")
+    if runner.render_budget is not None:
+        print(f"Render budget {runner.render_budget.limit / 2**20:.1f} MiB: peak reserved "
+              f"{runner.render_budget.peak / 2**20:.1f} MiB, waited {runner.render_budget.waits} time(s)")
+    return _print_job_counts(run_id)
+
+def _print_job_counts(run_id: Optional[str]) -> int:
+    conn = connect_database()
+    try:
+        counts = invoice_job_counts(conn, run_id)
+        failures = conn.execute("""
+            SELECT idempotency_key, last_error FROM invoice_jobs
+            WHERE state = 'failed' AND (? IS NULL OR run_id = ?)
+            ORDER BY id LIMIT 10
+        """, (run_id, run_id)).fetchall()
+    finally:
+        conn.close()
+    print(", ".join(f"{state}: {counts[state]}" for state in JOB_STATES))
+    for key, error in failures:
+        print(f"  {key}: {error}")
+    return 1 if counts["failed"] else 0
+
+def cli_jobs(args) -> int:
+    """Show, resume or retry queued invoice jobs"""
+    if args.action == "status":
+        return _print_job_counts(args.run)
+    budget = memory_budget_from_settings(args.memory_budget)
+    with (MemoryReport() if args.memory_report else contextlib.nullcontext()) as report:
+        if args.action == "retry":
+            print(f"Requeued {retry_failed_jobs(args.run)} failed job(s)")
+        return _work_invoice_jobs(args.run, args.workers, budget, report)
+
+def cli_tax_rules(args) -> int:
+    """List, add, exempt or remove tax rules"""
+    region, category = args.region or "", args.category or ""
+    if args.action == "add":
+        if not args.name or args.rate is None:
+            print("add needs --name and --rate")
+            return 2
+        operation = lambda cursor: cursor.execute("""
+            INSERT INTO tax_rules (name, rate, region, category, compound, priority)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(name, region, category) DO UPDATE SET
+                rate = excluded.rate, compound = excluded.compound, priority = excluded.priority
+        """, (args.name, args.rate, region, category, int(args.compound), args.priority))
+    elif args.action == "exempt":
+        operation = lambda cursor: cursor.execute(
+            "INSERT OR IGNORE INTO tax_exemptions (region, category) VALUES (?, ?)", (region, category))
+    elif args.action == "remove":
+        if args.name:
+            operation = lambda cursor: cursor.execute(
+                "DELETE FROM tax_rules WHERE name = ? AND region = ? AND category = ?",
+                (args.name, region, category))
+        else:
+            operation = lambda cursor: cursor.execute(
+                "DELETE FROM tax_exemptions WHERE region = ? AND category = ?", (region, category))
+    else:
+        operation = None
+    if operation is not None:
+        try:
+            get_db_writer().submit(operation).result()
+        except sqlite3.Error as e:
+            print(f"Error updating tax rules: {e}")
+            return 1
+        invalidate_tax_engine()
+    conn = connect_database()
+    try:
+        rules = conn.execute("""
+            SELECT name, rate, region, category, compound, priority FROM tax_rules
+            ORDER BY region, category, priority, name
+        """).fetchall()
+        exemptions = conn.execute("SELECT region, category FROM tax_exemptions ORDER BY region, category").fetchall()
+    finally:
+        conn.close()
+    for name, rate, rule_region, rule_category, compound, priority in rules:
+        print(f"{name:<10} {rate:>7.3f}%  region={rule_region or '*':<8} category={rule_category or '*':<12} "
+              f"priority={priority}{' compound' if compound else ''}")
+    for rule_region, rule_category in exemptions:
+        print(f"exempt     region={rule_region or '*':<8} category={rule_category or '*'}")
+    if not rules and not exemptions:
+        print("No tax rules; invoices use the flat tax rate.")
+    return 0
+
+def cli_maintenance(args) -> int:
+    """Analyze, incrementally vacuum or migrate the database and report the effect"""
+    try:
+        if args.migrate or args.page_size:
+            result = migrate_database(args.page_size)
+        else:
+            result = run_maintenance(args.vacuum_pages, args.analyze)
+    except ValueError as e:
+        print(e)
+        return 2
+    except sqlite3.Error as e:
+        print(f"Error maintaining database: {e}")
+        return 1
+    print(f"before: {format_database_stats(result['before'])}")
+    print(f" after: {format_database_stats(result['after'])}")
+    if result.get("compacted"):
+        print(f"Compacted {result['compacted']} consumed change log entries.")
+    if result["after"]["auto_vacuum"] != "incremental":
+        print("Run with --migrate once to enable incremental vacuum.")
+    return 0
+
+def cli_changes(args) -> int:
+    """Register change feed consumers, read their changes or compact the log"""
+    try:
+        if args.action == "register":
+            watermark = register_change_consumer(args.consumer, args.from_start)
+            print(f"Consumer '{args.consumer}' reads changes after {watermark}")
+            return 0
+        if args.action == "compact":
+            print(f"Compacted {compact_change_log()} consumed change log entries")
+            return 0
+        conn = connect_database()
+        try:
+            if args.action == "status":
+                status = change_feed_status(conn)
+                print(f"Retained {status['retained']} change(s)"
+                      + (f", seq {status['oldest']}-{status['latest']}" if status["retained"] else ""))
+                for consumer in status["consumers"]:
+                    print(f"{consumer['name']:<20} watermark {consumer['watermark']:<8} "
+                          f"pending {consumer['pending']:<8} updated {consumer['updated_at']}")
+                return 0
+            changes = read_changes(conn, args.consumer, args.limit)
+        finally:
+            conn.close()
+        for change in changes:
+            print(json.dumps(change, default=str))
+        if changes and args.ack:
+            acknowledge_changes(args.consumer, changes[-1]["seq"])
+    except ValueError as e:
+        print(e)
+        return 2
+    except sqlite3.Error as e:
+        print(f"Error reading the change feed: {e}")
+        return 1
+    return 0
+
+def cli_receivables(args) -> int:
+    """Aging report, open invoices, payments and status changes"""
+    try:
+        if args.action == "pay":
+            if not args.invoice or args.amount is None:
+                print("pay needs --invoice and --amount")
+                return 2
+            paid_on = datetime.date.fromisoformat(args.date) if args.date else None
+            status, outstanding = record_payment(args.invoice, args.amount, paid_on,
+                                                 args.method or "", args.reference or "")
+            print(f"{args.invoice}: {status}, ${outstanding:,.2f} outstanding")
+            return 0
+        if args.action == "set-status":
+            if not args.invoice or args.status not in INVOICE_STATUSES:
+                print(f"set-status needs --invoice and --status ({', '.join(INVOICE_STATUSES)})")
+                return 2
+            print(f"{args.invoice}: {set_invoice_status(args.invoice, args.status)}")
+            return 0
+        as_of = datetime.date.fromisoformat(args.date) if args.date else datetime.date.today()
+        overdue = mark_overdue_invoices(today=as_of)
+        if overdue:
+            print(f"Marked {overdue} invoice(s) Overdue")
+        conn = connect_database()
+        try:
+            if args.action == "open":
+                for number, customer, date_created, status, total, outstanding in open_invoices(conn, args.limit):
+                    print(f"{date_created[:10]}  {number:<24} {status:<8} ${total:>10,.2f} "
+                          f"${outstanding:>10,.2f}  {customer}")
+                return 0
+            report = aging_report(conn, as_of)
+        finally:
+            conn.close()
+    except ValueError as e:
+        print(e)
+        return 2
+    except sqlite3.Error as e:
+        print(f"Error updating receivables: {e}")
+        return 1
+    print(f"Receivables aging as of {report['as_of']} (days since invoice date)")
+    for label, count, amount in report["buckets"]:
+        print(f"{label:>6} days: {count:>6} invoice(s) ${amount:>12,.2f}")
+    print(f"{'total':>11}: {report['count']:>6} invoice(s) ${report['outstanding']:>12,.2f}")
+    return 0
+
+def cli_statements(args) -> int:
+    """Render statements for every customer with invoices in a month or date range"""
+    try:
+        if args.date_from:
+            date_from = datetime.date.fromisoformat(args.date_from)
+            date_to = datetime.date.fromisoformat(args.date_to) if args.date_to else datetime.date.today()
+        else:
+            # Default to last month
+            month = args.month or (datetime.date.today().replace(day=1) - datetime.timedelta(days=1)).strftime("%Y-%m")
+            date_from = datetime.date.fromisoformat(f"{month}-01")
+            date_to = date_from.replace(day=calendar.monthrange(date_from.year, date_from.month)[1])
+    except ValueError:
+        print("Invalid date, expected YYYY-MM or YYYY-MM-DD")
+        return 2
+    try:
+        result = generate_statements(date_from, date_to, args.customer, args.workers, args.template)
+    except FileNotFoundError as e:
+        print(e)
+        return 1
+    except sqlite3.Error as e:
+        print(f"Error generating statements: {e}")
+        return 1
+    print(f"{result['statements']} statement(s) covering {result['invoices']} invoice(s) "
+          f"from {date_from} to {date_to} in {result['seconds']:.1f} s")
+    return 0
+
+def cli_customers(args) -> int:
+    """List customers with their totals, or one customer's invoice history"""
+    conn = connect_database()
+    try:
+        if args.id is not None:
+            totals = customer_totals(conn, args.id)
+            if not totals["invoices"]:
+                print(f"No live invoices for customer {args.id}")
+                return 1
+            print(f"{totals['invoices']} invoice(s), ${totals['total']:,.2f} billed, "
+                  f"{totals['first'][:10]} to {totals['last'][:10]}")
+            for invoice_number, customer_name, date_created, total in customer_history(conn, args.id, args.limit):
+                print(f"{date_created[:10]}  {invoice_number:<24} ${total:>10,.2f}  {customer_name}")
+            return 0
+        for customer_id, name, email, phone in find_customers(conn, args.search or "", args.limit):
+            totals = customer_totals(conn, customer_id)
+            print(f"{customer_id:>6}  {name:<30} {email or '':<28} {phone or '':<16} "
+                  f"{totals['invoices']:>5} invoice(s) ${totals['total']:>12,.2f}")
+    except sqlite3.Error as e:
+        print(f"Error reading customers: {e}")
+        return 1
+    finally:
+        conn.close()
+    return 0
+
+def cli_load_test(args) -> int:
+    """Run a concurrent mixed workload against a scratch copy of the database"""
+    try:
+        mix = parse_load_test_mix(args.mix) if args.mix else LOAD_TEST_MIX
+    except ValueError as e:
+        print(e)
+        return 2
+    directory = args.directory or tempfile.mkdtemp(prefix="invoicemaker-load-")
+    try:
+        prepare_load_test_directory(directory, args.database)
+        for workers in args.workers:
+            result = run_load_test(directory, workers, args.rate, args.duration, mix,
+                                   args.processes, not args.no_render, args.seed)
+            print(format_load_test_report(result))
+            print()
+    except (sqlite3.Error, RuntimeError, OSError) as e:
+        print(f"Load test failed: {e}")
+        return 1
+    finally:
+        if not args.directory:
+            shutil.rmtree(directory, ignore_errors=True)
+    return 0
+
+def add_memory_arguments(parser: argparse.ArgumentParser) -> None:
+    """Options of the commands that support the bounded-memory mode"""
+    parser.add_argument("--memory-budget", type=float, metavar="MB",
+                        help="Cap estimated memory of queued batches and renders in flight "
+                             "(default: memory_budget_mb setting, 0 for no cap)")
+    parser.add_argument("--memory-report", action="store_true",
+                        help="Print the tracemalloc peak and top allocations when done")
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    """Build the command line parser; without a command the GUI starts"""
+    parser = argparse.ArgumentParser(description="Invoice Generator")
+    parser.add_argument("--profile", action="store_true",
+                        help=f"Write cProfile .pstats and collapsed-stack .folded files to {PROFILE_DIR}/")
+    subparsers = parser.add_subparsers(dest="command")
+    
+    archive_parser = subparsers.add_parser("archive",
+                                           help="Move old closed invoices into per-year archive databases")
+    archive_parser.add_argument("--before", required=True,
+                                help="Archive invoices created before this date (YYYY-MM-DD)")
+    archive_parser.add_argument("--archive-dir", default=ARCHIVE_DIR,
+                                help="Directory for the per-year archive databases")
+    archive_parser.set_defaults(handler=cli_archive)
+    
+    bundle_parser = subparsers.add_parser("bundle",
+                                          help="Roll generated documents into a zip bundle with a manifest")
+    bundle_parser.add_argument("--from", dest="date_from", required=True,
+                               help="First creation date to include (YYYY-MM-DD)")
+    bundle_parser.add_argument("--to", dest="date_to",
+                               help="Last creation date to include (defaults to --from)")
+    bundle_parser.add_argument("--bundle-dir", default=BUNDLE_DIR,
+                               help="Directory the bundle is written to")
+    bundle_parser.set_defaults(handler=cli_bundle)
+    
+    import_parser = subparsers.add_parser("import-catalog",
+                                          help="Insert or update items from a CSV or JSONL catalog")
+    import_parser.add_argument("file", help="Catalog file (.csv, or .jsonl with one object per line)")
+    import_parser.add_argument("--admin", required=True,
+                               help="Admin whose items the catalog is imported into")
+    import_parser.add_argument("--chunk-size", type=int, default=CATALOG_IMPORT_CHUNK_SIZE,
+                               help="Rows validated and written per transaction")
+    import_parser.set_defaults(handler=cli_import_catalog)
+    
+    recurring_parser = subparsers.add_parser("run-recurring",
+                                             help="Issue due recurring invoices in batches")
+    recurring_parser.add_argument("--force", action="store_true",
+                                  help="Run even outside the configured off-peak windows")
+    recurring_parser.add_argument("--list", action="store_true",
+                                  help="Only list the definitions that are due")
+    recurring_parser.add_argument("--batch-size", type=int,
+                                  help="Invoices committed per batch")
+    recurring_parser.add_argument("--workers", type=int,
+                                  help="Maximum documents rendered at the same time")
+    recurring_parser.set_defaults(handler=cli_run_recurring)
+    
+    bulk_parser = subparsers.add_parser("bulk-invoices",
+                                        help="Generate the invoices of a JSONL file as a resumable run")
+    bulk_parser.add_argument("file", help="JSONL file with one invoice object per line")
+    bulk_parser.add_argument("--admin", required=True,
+                             help="Admin the invoices are created by")
+    bulk_parser.add_argument("--workers", type=int, default=1,
+                             help="Maximum documents rendered at the same time")
+    bulk_parser.add_argument("--status", choices=["Paid", "Sent", "Draft"],
+                             help="Status the invoices are created with "
+                                  "(default: default_invoice_status from the settings)")
+    add_memory_arguments(bulk_parser)
+    bulk_parser.set_defaults(handler=cli_bulk_invoices)
+    
+    validate_parser = subparsers.add_parser("validate-invoices",
+                                            help="Check a bulk invoice JSONL file and report bad rows")
+    validate_parser.add_argument("file", help="JSONL file with one invoice object per line")
+    validate_parser.add_argument("--chunk-rows", type=int, default=VALIDATION_CHUNK_ROWS,
+                                 help="Rows validated per chunk")
+    validate_parser.add_argument("--max-errors", type=int, default=VALIDATION_MAX_ERRORS,
+                                 help="Errors kept for the report (all are counted)")
+    validate_parser.add_argument("--errors", metavar="CSV",
+                                 help="Write the kept errors as line,field,message rows")
+    validate_parser.set_defaults(handler=cli_validate_invoices)
+    
+    jobs_parser = subparsers.add_parser("jobs",
+                                        help="Show, resume or retry queued invoice jobs")
+    jobs_parser.add_argument("action", choices=["status", "resume", "retry"],
+                             help="status lists job states, resume finishes interrupted runs, "
+                                  "retry requeues failed jobs and runs them")
+    jobs_parser.add_argument("--run", help="Only jobs of this run (e.g. bulk:january.jsonl)")
+    jobs_parser.add_argument("--workers", type=int, default=1,
+                             help="Maximum documents rendered at the same time")
+    add_memory_arguments(jobs_parser)
+    jobs_parser.set_defaults(handler=cli_jobs)
+    
+    tax_parser = subparsers.add_parser("tax-rules",
+                                       help="List or edit per-region and per-category tax rules")
+    tax_parser.add_argument("action", choices=["list", "add", "exempt", "remove"],
+                            help="remove deletes the rule named by --name, or the exemption without it")
+    tax_parser.add_argument("--name", help="Tax name, e.g. GST")
+    tax_parser.add_argument("--rate", type=float, help="Rate in percent")
+    tax_parser.add_argument("--region", help="Region the rule applies to (default: any)")
+    tax_parser.add_argument("--category", help="Item category the rule applies to (default: any)")
+    tax_parser.add_argument("--compound", action="store_true",
+                            help="Apply on top of the taxes with a lower priority")
+    tax_parser.add_argument("--priority", type=int, default=0,
+                            help="Order in which taxes apply")
+    tax_parser.set_defaults(handler=cli_tax_rules)
+    
+    maintenance_parser = subparsers.add_parser("maintenance",
+                                               help="Refresh planner statistics and reclaim free pages")
+    maintenance_parser.add_argument("--analyze", action="store_true",
+                                    help="Run a full ANALYZE instead of PRAGMA optimize")
+    maintenance_parser.add_argument("--vacuum-pages", type=int, default=MAINTENANCE_VACUUM_PAGES,
+                                    help="Free pages to release per run (incremental vacuum)")
+    maintenance_parser.add_argument("--migrate", action="store_true",
+                                    help="Rebuild with auto_vacuum=INCREMENTAL; needs exclusive access")
+    maintenance_parser.add_argument("--page-size", type=int,
+                                    help="Page size to rebuild with (implies --migrate)")
+    maintenance_parser.set_defaults(handler=cli_maintenance)
+    
+    changes_parser = subparsers.add_parser("changes",
+                                           help="Incremental feed of invoice and item changes")
+    changes_parser.add_argument("action", choices=["register", "read", "status", "compact"],
+                                help="read prints changes after the consumer's watermark as JSON lines")
+    changes_parser.add_argument("--consumer", default="default",
+                                help="Name the consumer's watermark is stored under")
+    changes_parser.add_argument("--from-start", action="store_true",
+                                help="register: start at the oldest retained change")
+    changes_parser.add_argument("--limit", type=int, default=CHANGE_BATCH_SIZE,
+                                help="read: maximum changes to print")
+    changes_parser.add_argument("--ack", action="store_true",
+                                help="read: move the watermark past the printed changes")
+    changes_parser.set_defaults(handler=cli_changes)
+    
+    receivables_parser = subparsers.add_parser("receivables",
+                                               help="Aging report, open invoices and payments")
+    receivables_parser.add_argument("action", choices=["aging", "open", "pay", "set-status"],
+                                    help="aging and open first mark overdue invoices")
+    receivables_parser.add_argument("--invoice", help="Invoice number to pay or change")
+    receivables_parser.add_argument("--amount", type=float, help="pay: amount received")
+    receivables_parser.add_argument("--date", help="pay: payment date; aging/open: report date (YYYY-MM-DD)")
+    receivables_parser.add_argument("--method", help="pay: e.g. cash, card, transfer")
+    receivables_parser.add_argument("--reference", help="pay: receipt or transaction reference")
+    receivables_parser.add_argument("--status", help="set-status: new status")
+    receivables_parser.add_argument("--limit", type=int, default=100, help="open: maximum rows to print")
+    receivables_parser.set_defaults(handler=cli_receivables)
+    
+    statements_parser = subparsers.add_parser("statements",
+                                              help="Render one statement per customer for a period")
+    statements_parser.add_argument("--month", help="Month to cover (YYYY-MM, default: last month)")
+    statements_parser.add_argument("--from", dest="date_from", help="First invoice date (YYYY-MM-DD)")
+    statements_parser.add_argument("--to", dest="date_to", help="Last invoice date (defaults to today)")
+    statements_parser.add_argument("--customer", type=int, action="append",
+                                   help="Only this customer id; may be repeated")
+    statements_parser.add_argument("--workers", type=int, default=1,
+                                   help="Maximum statements rendered at the same time")
+    statements_parser.add_argument("--template", default=STATEMENT_TEMPLATE,
+                                   help=f"Statement template (default: {STATEMENT_TEMPLATE}, which ships with the app)")
+    statements_parser.set_defaults(handler=cli_statements)
+    
+    customers_parser = subparsers.add_parser("customers",
+                                             help="List customers or show one customer's invoices")
+    customers_parser.add_argument("--search", help="Part of the customer name")
+    customers_parser.add_argument("--id", type=int, help="Show this customer's invoice history")
+    customers_parser.add_argument("--limit", type=int, default=50, help="Maximum rows to print")
+    customers_parser.set_defaults(handler=cli_customers)
+    
+    load_parser = subparsers.add_parser("load-test",
+                                        help="Measure throughput and lock contention under concurrent load")
+    load_parser.add_argument("--workers", type=int, nargs="+", default=[4],
+                             help="Concurrent workers; several values run one test each")
+    load_parser.add_argument("--processes", action="store_true",
+                             help="Run workers as processes, like separate workstations")
+    load_parser.add_argument("--rate", type=float, default=0.0,
+                             help="Target operations per second across all workers (0 = unlimited)")
+    load_parser.add_argument("--duration", type=float, default=30.0,
+                             help="Seconds per test")
+    load_parser.add_argument("--mix",
+                             help="Operation weights, e.g. login=10,item_lookup=40,history_search=30,generate=20")
+    load_parser.add_argument("--no-render", action="store_true",
+                             help="Only insert generated invoices, skip writing their documents")
+    load_parser.add_argument("--database", default=DATABASE_FILE,
+                             help="Database to copy into the scratch directory")
+    load_parser.add_argument("--directory",
+                             help="Scratch directory to use and keep (default: a temporary one)")
+    load_parser.add_argument("--seed", type=int, default=0,
+                             help="Random seed for the operation sequence")
+    load_parser.set_defaults(handler=cli_load_test)
+    
+    benchmark_parser = subparsers.add_parser("benchmark-render",
+                                             help="Benchmark the compiled renderer against docxtpl")
+    benchmark_parser.add_argument("--template", default="pyinvoice.docx",
+                                  help="Template to benchmark")
+    benchmark_parser.add_argument("--count", type=int, default=100,
+                                  help="Number of invoices to render per renderer")
+    benchmark_parser.add_argument("--lines", type=int, default=10,
+                                  help="Line items per invoice")
+    benchmark_parser.set_defaults(handler=cli_benchmark_render)
+    
+    large_parser = subparsers.add_parser("benchmark-large",
+                                         help="Benchmark rendering invoices with many line items")
+    large_parser.add_argument("--template", default="pyinvoice.docx",
+                              help="Template to benchmark")
+    large_parser.add_argument("--lines", type=int, nargs="+", default=[1000, 10000, 50000],
+                              help="Line counts to benchmark")
+    large_parser.add_argument("--docxtpl-max", type=int, default=10000,
+                              help="Largest line count to also run through docxtpl")
+    large_parser.set_defaults(handler=cli_benchmark_large)
+    
+    return parser
+
 logged_in_admin = None  # Variable to store the logged-in admin's username
-login_window = ctk.CTk()
-login_window.state('zoomed')
-login_window.title("Admin Login")
-apply_azure_theme(login_window)
-load_login_form()
-login_window.mainloop()
+
+if __name__ == "__main__":
+    args = build_arg_parser().parse_args()
+    get_profiler().enabled = args.profile
+    if args.command:
+        sys.exit(get_profiler().wrap(args.command, args.handler)(args))
+    
+    # --- Login UI ---
+    login_window = ctk.CTk()
+    login_window.state('zoomed')
+    login_window.title("Admin Login")
+    apply_azure_theme(login_window)
+    load_login_form()
+    login_window.mainloop()
 
 